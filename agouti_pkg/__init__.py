@@ -1 +1,10 @@
+# the library API is imported on first use, so that the command line tool
+# does not pay for it at start-up
 
+
+def __getattr__(name):
+    if name == "Annotator":
+        from agouti_pkg.annotator import Annotator
+        return Annotator
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__,
+                                                                    name))
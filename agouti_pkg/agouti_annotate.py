@@ -3,42 +3,253 @@
 
 import os
 import sys
-import codecs
 from agouti_pkg.eprint import eprint
 import agouti_pkg.gffutils
-import agouti_pkg.gffutils.inspect as inspect
-from operator import attrgetter
-from agouti_pkg.database import Database
+from agouti_pkg.database import Database, index_path
 from agouti_pkg.argument_parser import (parse_arguments,
                              create_attributes_and_features_dict)
 from agouti_pkg.sequence_ontology import *
 from agouti_pkg.processing_product import ProcessingProduct
 from agouti_pkg.miscallaneous import *
 from agouti_pkg.read_input import *
+from agouti_pkg.errors import AgoutiError, InputFormatError
 from agouti_pkg.header import *
-from agouti_pkg.output_processing import prepare_output
+from agouti_pkg.output_processing import (annotation_records,
+                                          add_closest_genes, format_records,
+                                          record_fields)
+from agouti_pkg.output_writer import OutputWriter
+from agouti_pkg.streams import open_output
+from agouti_pkg.sweep import sweep_overlaps
 
 
-def main(args):
-    """Main function
+def region_overlaps(db, products, featuretypes, strand_specific=False):
+    """Finds features overlapping each ProcessingProduct with a separate\
+        FeatureDB.region() query per interval
 
     Arguments:
-        args {argparse.Namespace} -- command line arguments parsed with\
-            argparse
+        db {Database} -- object of the Database class
+        products {iterable} -- ProcessingProduct objects
+        featuretypes {list} -- feature types to be reported
+
+    Keyword Arguments:
+        strand_specific {bool} -- report only features on the same strand\
+            (default: {False})
+
+    Yields:
+        tuple -- ProcessingProduct, list of overlapping features
     """
 
-    chromosomes_not_found = set()  ## chromosomes in the input file but not found in the reference annotations
-    chromosomes_found = set()  ## chromosomes in the input file and found in the reference annotations
+    for product in products:
+        strand = product.strand if strand_specific else None
+        yield product, list(db.database.region(region=product.coordinates,
+                                               strand=strand,
+                                               featuretype=featuretypes,
+                                               completely_within=False))
+
+
+def find_overlaps(db, products, featuretypes, args, index=None):
+    """Finds features overlapping each ProcessingProduct using the engine\
+        selected with --engine. The "auto" engine uses the OverlapIndex if it\
+        was stored with the database (or given). Otherwise, it uses the\
+        sorted sweep if the intervals are sorted by (seqid, start) and the\
+        OverlapIndex built in memory if they are not.
+
+    Arguments:
+        db {Database} -- object of the Database class
+        products {IntervalBatch} -- input intervals
+        featuretypes {list} -- feature types to be reported
+        args {argparse.Namespace} -- command line arguments
+
+    Keyword Arguments:
+        index {OverlapIndex} -- OverlapIndex loaded beforehand\
+            (default: {None})
+
+    Returns:
+        generator -- tuples of ProcessingProduct and a list of overlapping\
+            features, in the order of products. The sweep and index engines\
+            report only features at the annotated level (--level)
+    """
+
+    engine = args.engine
+    if engine == "region":
+        return region_overlaps(db, products, featuretypes,
+                               args.strand_specific)
+    if engine == "auto":
+        if (index is not None or os.path.isdir(index_path(db.name))
+                or not products.is_sorted()):
+            engine = "index"
+        else:
+            engine = "sweep"
+    if engine == "index":
+        if index is None:
+            index = db.overlap_index(featuretypes)
+        return index.overlaps(db, products, featuretypes,
+                              args.strand_specific, args.level)
+    return sweep_overlaps(db, products, featuretypes, args.strand_specific,
+                          args.level)
+
+
+def annotate_records(db, products, args, attributes_and_features, header,
+                     featuretypes_from_db, index=None):
+    """Annotates ProcessingProduct objects
+
+    Arguments:
+        db {Database} -- object of the Database class
+        products {IntervalBatch} -- input intervals
+        args {argparse.Namespace} -- command line arguments
+        attributes_and_features {dict} -- features and attributes to be\
+            reported
+        header {list} -- header of the output
+        featuretypes_from_db {list} -- all feature types from the database
+
+    Keyword Arguments:
+        index {OverlapIndex} -- OverlapIndex loaded beforehand\
+            (default: {None})
+
+    Yields:
+        list -- AnnotationRecord objects of each product (see\
+            output_processing.annotation_records); None if the transcript\
+            was not found (transcriptomic mode)
+    """
 
-    num_of_bed_fields = -1
     lengths_dict = {}  # stores length of UTRs and CDS of a given transcript
 
+    if (args.transcriptomic):
+        batch, products = products, list(products)
+        # transcripts, their levels, genes and models are read in bulk
+        db.prefetch((value.coordinates[0] for value in products),
+                    featuretypes_from_db)
+        locations = [None] * len(products)
+        if args.annotate_relative_location:
+            # relative locations are classified for the whole batch at once
+            locations = batch.relative_locations(
+                [sum(db.transcript_model(value.coordinates[0],
+                                         featuretypes_from_db)[0])
+                 for value in products], args.offset)
+        for value, location in zip(products, locations):
+            try:
+                id = value.coordinates[0]
+
+                overlapping_features = [db.get_feature(id)]
+                g2t, cds_start = value.genomic_to_transcriptomic(
+                    db, featuretypes_from_db)
+                lengths_dict[value.coordinates[0]] = g2t
+
+                yield annotation_records(lengths_dict, header, args,
+                                         attributes_and_features, db, value,
+                                         overlapping_features, g2t, cds_start,
+                                         relative_location=location)
+
+            except (agouti_pkg.gffutils.exceptions.FeatureNotFoundError):
+                eprint("WARNING: Couldn't find transcript {}. Please make sure that it exists in your GTF/GFF3 file.".format(id))
+                yield None
+
+    else:
+        records = [annotation_records(lengths_dict, header, args,
+                                      attributes_and_features, db, value,
+                                      overlapping_features, value.coordinates)
+                   for value, overlapping_features in find_overlaps(
+                       db, products, list(attributes_and_features.keys()),
+                       args, index=index)]
+        # the closest genes of all intergenic intervals of the batch are
+        # found at once
+        add_closest_genes(db, records)
+        yield from records
+
+
+def annotate_products(db, products, args, attributes_and_features, header,
+                      featuretypes_from_db, index=None):
+    """Annotates ProcessingProduct objects
+
+    Arguments:
+        db {Database} -- object of the Database class
+        products {IntervalBatch} -- input intervals
+        args {argparse.Namespace} -- command line arguments
+        attributes_and_features {dict} -- features and attributes to be\
+            reported
+        header {list} -- header of the output
+        featuretypes_from_db {list} -- all feature types from the database
+
+    Keyword Arguments:
+        index {OverlapIndex} -- OverlapIndex loaded beforehand\
+            (default: {None})
+
+    Yields:
+        str -- output line for each product; None if the transcript was not\
+            found (transcriptomic mode)
+    """
+
+    for records in annotate_records(db, products, args,
+                                    attributes_and_features, header,
+                                    featuretypes_from_db, index):
+        yield None if records is None else format_records(records, header,
+                                                          args)
+
+
+def annotate_outputs(db, products, args, attributes_and_features, header,
+                     featuretypes_from_db, index=None, output=True,
+                     statistics=False):
+    """Annotates ProcessingProduct objects as annotate_products, but the\
+        output lines and the columns counted in the statistics are produced\
+        only if needed
+
+    Arguments:
+        db {Database} -- object of the Database class
+        products {IntervalBatch} -- input intervals
+        args {argparse.Namespace} -- command line arguments
+        attributes_and_features {dict} -- features and attributes to be\
+            reported
+        header {list} -- header of the output
+        featuretypes_from_db {list} -- all feature types from the database
+
+    Keyword Arguments:
+        index {OverlapIndex} -- OverlapIndex loaded beforehand\
+            (default: {None})
+        output {bool} -- produce the output lines (default: {True})
+        statistics {bool} -- produce the columns counted in the statistics,\
+            see record_fields (default: {False})
+
+    Yields:
+        tuple -- output lines (None if output is False), list of columns of\
+            the output lines (None if statistics is False) for each\
+            product; None if the transcript was not found (transcriptomic\
+            mode)
+    """
+
+    for records in annotate_records(db, products, args,
+                                    attributes_and_features, header,
+                                    featuretypes_from_db, index):
+        if records is None:
+            yield None
+            continue
+        yield (format_records(records, header, args) if output else None,
+               list(record_fields(records, header, args)) if statistics
+               else None)
+
+
+def open_database(args):
+    """Opens the database and selects features and attributes to be\
+        reported (see create_attributes_and_features_dict)
+
+    Arguments:
+        args {argparse.Namespace} -- command line arguments
+
+    Raises:
+        AgoutiError -- the database cannot be opened or the features and\
+            attributes are incorrect
+
+    Returns:
+        tuple -- Database object, list of all feature types from the\
+            database, dictionary of features and attributes to be reported
+    """
+
     try:
         db = Database(agouti_pkg.gffutils.FeatureDB(args.database, keep_order=False),
                     args.database)  # reading the database from file
+    except AgoutiError:
+        raise
     except ValueError:
-        eprint("ERROR: the database provided does not exists")
-        sys.exit()
+        raise AgoutiError("the database provided does not exists")
 
     # list all featuretypes existing in db
     featuretypes_from_db = list(db.database.featuretypes())
@@ -50,91 +261,177 @@ def main(args):
 
 
     except IndexError:
+        raise AgoutiError("arguments provided with --combine, --select_attributes or --select_features are incorrect")
+
+    return db, featuretypes_from_db, attributes_and_features
+
+
+def read_intervals(args, input_file):
+    """Reads the input intervals in BED or custom format (see --custom)
+
+    Arguments:
+        args {argparse.Namespace} -- command line arguments
+        input_file {str} -- input file name or path, "-" for stdin, or\
+            a binary file object (see streams.open_input)
+
+    Raises:
+        InputFormatError -- the input has the wrong format (see\
+            read_custom_format and read_BED_file)
+
+    Returns:
+        tuple -- generator yielding IntervalBatch objects, number of\
+            columns in the input file, list of header lines
+    """
+
+    num_of_bed_fields = -1
+
+    if (args.custom == "BED"):
+        try:
+            return read_BED_file(input_file, num_of_bed_fields,
+                                 args.first_base_num, args.header_lines,
+                                 args.batch_size)
+        except FileNotFoundError:
+            eprint("ERROR: the input file does not exists")
+            sys.exit()
+    else:
+        try:
+            return read_custom_format(input_file, args.custom, args.sep,
+                                      args.first_base_num,
+                                      num_of_bed_fields, args.header_lines,
+                                      args.batch_size)
+        except FileNotFoundError:
+            eprint("ERROR: the input file does not exists")
+            sys.exit()
+
+
+def main(args):
+    """Main function
+
+    Arguments:
+        args {argparse.Namespace} -- command line arguments parsed with\
+            argparse
+    """
 
-        eprint("ERROR: arguments provided with --combine, --select_attributes or --select_features are incorrect")
-        sys.exit()
+    chromosomes_not_found = set()  ## chromosomes in the input file but not found in the reference annotations
 
     try:
-        if (args.custom == "BED"):
-            try:
-                products, num_of_bed_fields = read_BED_file(args.bed,
-                                                            num_of_bed_fields,
-                                                            args.first_base_num, args.header_lines)
-            except FileNotFoundError:
-                eprint("ERROR: the input file does not exists")
-                sys.exit()
-        else:
-            try:
-                products, num_of_bed_fields = read_custom_format(args.bed, args.custom,
-                                                                args.sep,
-                                                                args.first_base_num,
-                                                                num_of_bed_fields, args.header_lines)
-            except FileNotFoundError:
-                eprint("ERROR: the input file does not exists")
-                sys.exit()
-    except IndexError:
-        eprint("ERROR: the input file has the wrong format")
-        sys.exit()
+        db, featuretypes_from_db, attributes_and_features = open_database(
+            args)
+        input_batches, num_of_bed_fields, header_lines = read_intervals(
+            args, args.bed)
+    except AgoutiError as e:
+        eprint("ERROR: {}".format(e))
+        sys.exit(1)
 
     header = prepare_header(db, attributes_and_features, args,
-                            num_of_bed_fields, args.header_lines)
-    
-    whole_output = f"{header[0].strip()}"
+                            num_of_bed_fields, args.header_lines,
+                            header_lines[-1] if header_lines else None)
 
-    for key, value in products.items():
-        if (args.transcriptomic):
-            try:
-                id = value.coordinates[0]
+    output = sys.stdout
+    index = None
+    if not args.stats_only:
+        try:
+            output = open_output(args.output, args.compression)
+            if args.index:
+                from agouti_pkg.output_index import OutputIndexWriter
+                index = OutputIndexWriter(args.output, output.encoding)
+        except OSError as e:
+            eprint("ERROR: cannot write the output file: {}".format(e))
+            sys.exit()
 
-                overlapping_features = [db.database[id]]
-                g2t, cds_start = value.genomic_to_transcriptomic(
-                    db, featuretypes_from_db)
-                lengths_dict[value.coordinates[0]] = g2t
+    # the output is streamed; statistics are counted on the fly from the
+    # annotation records, the output lines are not built with --stats_only
+    stats = StatisticsAccumulator() if (args.statistics or
+                                        args.stats_only) else None
+    writer = None if args.stats_only else OutputWriter(
+        output, buffer_size=args.buffer_size,
+        threaded=args.writer_thread)
 
-                out = prepare_output(lengths_dict, header, args,
-                                     attributes_and_features, db, value,
-                                     overlapping_features, g2t, cds_start)
-                
-                whole_output = f"{whole_output}\n{out}"
+    # malformed input lines are found only when they are read, possibly
+    # after a part of the output has been written
+    completed = False
+    try:
+        if args.custom != "BED":
+            # all but the last header line are copied to the output
+            for line in header_lines[:args.header_lines - 1]:
+                if writer is not None:
+                    writer.write_line(line.strip())
+                else:
+                    print(line.strip())
+                if index is not None:
+                    index.skip(line.strip())
 
-            except (agouti_pkg.gffutils.exceptions.FeatureNotFoundError):
-                eprint("WARNING: Couldn't find transcript {}. Please make sure that it exists in your GTF/GFF3 file.".format(id))
+        if stats is not None:
+            stats.add(header[0].strip())
+        if writer is not None:
+            writer.write_line(header[0].strip())
+        if index is not None:
+            index.skip(header[0].strip())
 
+        # the input is read and annotated in batches -> bounded memory usage
+        kwargs = {"args": args,
+                  "attributes_and_features": attributes_and_features,
+                  "header": header,
+                  "featuretypes_from_db": featuretypes_from_db,
+                  "output": writer is not None,
+                  "statistics": stats is not None}
+
+        if args.threads > 1:
+            from agouti_pkg.parallel import parallel_annotate
+            if not args.transcriptomic and args.engine in ("auto", "index"):
+                # built once and shared with the workers
+                kwargs["index"] = db.overlap_index(
+                    list(attributes_and_features.keys()))
+            annotated = parallel_annotate(annotate_outputs, args.database,
+                                          input_batches, args.threads, kwargs)
         else:
+            annotated = ((batch, annotate_outputs(db, batch, **kwargs))
+                         for batch in input_batches)
 
-            region = value.coordinates
+        for batch, outputs in annotated:
 
-            ## test whether chromosome is present in annotations
-            if value.coordinates[0] not in chromosomes_found:
-                if len(list(db.database.region(seqid=value.coordinates[0]))) == 0:
-                    chromosomes_not_found.add(value.coordinates[0])
-                else:
-                    chromosomes_found.add(value.coordinates[0])
-            ##
-            
-            if (not args.strand_specific):
-                overlapping_features = list(
-                    db.database.region(region=region,
-                                       featuretype=attributes_and_features.keys(),
-                                       completely_within=False))
-
-            elif(args.strand_specific):
-                overlapping_features = list(db.database.region(region=region,
-                                                               strand=value.strand,
-                                                               featuretype=attributes_and_features.keys(),
-                                                               completely_within=False))
-
-            out = prepare_output(lengths_dict, header, args,
-                                 attributes_and_features, db, value,
-                                 overlapping_features, region)
-            
-            whole_output = f"{whole_output}\n{out}"
-
-    if args.statistics or args.stats_only:
-        statistics(whole_output)
-    
-    if not args.stats_only:
-        print(whole_output)
+            ## test whether chromosomes are present in annotations
+            if not args.transcriptomic:
+                chromosomes_not_found.update(seqid for seqid in batch.seqids
+                                             if not db.has_seqid(seqid))
+
+            for i, result in enumerate(outputs):
+                if result is None:
+                    continue
+                out, fields = result
+                if stats is not None:
+                    stats.add_fields(fields)
+                if writer is not None:
+                    writer.write_line(out)
+                    if index is not None:
+                        index.add(batch.seqids[batch.seqid_codes[i]],
+                                  int(batch.starts[i]), int(batch.ends[i]),
+                                  batch.names[i], out)
+        completed = True
+    except InputFormatError as e:
+        eprint("ERROR: {}".format(e))
+    finally:
+        if writer is not None:
+            writer.close()
+        if output is not sys.stdout:
+            output.close()
+        if index is not None:
+            if completed:
+                index.close(output.buffer.blocks)
+            else:
+                index.discard()
+
+    if not completed:
+        if writer is not None and args.output != "-":
+            os.remove(args.output)
+            eprint("ERROR: the incomplete output file {} was removed".format(
+                args.output))
+        elif writer is not None:
+            eprint("ERROR: the output is incomplete")
+        sys.exit(1)
+
+    if stats is not None:
+        stats.report()
 
     if len(chromosomes_not_found):
         eprint(f"WARNING: The following chromosomes were not found in the annotations: {', '.join(list(chromosomes_not_found))}")
@@ -12,7 +12,10 @@ import argparse
 from agouti_pkg.anytree import Node, RenderTree, importer
 from agouti_pkg.anytree.exporter import DotExporter
 from agouti_pkg.argument_parser import parse_arguments
-import gzip
+from agouti_pkg.database import (Database, create_feature_levels,
+                                 create_level1_parents,
+                                 create_transcript_models,
+                                 create_features_fingerprint, index_path)
 
 output_lines = []
 
@@ -23,35 +26,21 @@ def transform_func(x):
 
 
 def inspect_db(args, db):
-    try:
-        features = {}
-        if args.annotation.endswith(".gz"):
-            f = gzip.open(args.annotation, "rb")
-        else:
-            f = open(args.annotation)
-        lines = f.readlines()
-        for line in lines:
-            if isinstance(line, bytes):
-                line = line.decode()
-            splitted = line.strip().split("\t")
-            if (not line.startswith("#")):
-                feature = splitted[2].lower()
-                attributes = splitted[8].strip().replace('"', "").replace("'", "")
-                if feature not in features.keys():
-                    features[feature] = set()
-                tab = attributes.split(db.dialect["field separator"])
-                tab = list(filter(None, tab))
-                for attribute in tab:
-                    a = attribute.strip().split(db.dialect["keyval separator"])
-                    a = list(filter(None, a))
-                    features[feature].add(a[0])  # was a[0].lower()
-        f.close()
-    except IndexError:
-        eprint("{}ERROR: The file {} has the wrong format".format(os.linesep,
-                                                          args.annotation))
-        os.system("rm -f {}".format(args.database))
-        sys.exit()
-    return features
+    """Lists attributes available for each feature type. They are collected\
+        by gffutils while the annotation file is parsed, so the file is not\
+        read again.
+
+    Arguments:
+        args {argparse.Namespace} -- command-line arguments
+        db {FeatureDB} -- database returned by gffutils.create_db
+
+    Returns:
+        dict -- feature type, set of its attribute keys; in the order of\
+            the first occurrence of the feature type in the file
+    """
+
+    return {feature: set(attributes)
+            for feature, attributes in db.attribute_keys.items()}
 
 
 def find_children(_parent, parent_child, prefix=""):
@@ -106,7 +95,8 @@ def main(args):
                                         merge_strategy="create_unique",
                                         transform=transform_func,
                                         dbfn=":memory:",
-                                        checklines=50)
+                                        checklines=50,
+                                        processes=args.threads)
             else:
                 db = agouti_pkg.gffutils.create_db(args.annotation, force=True,
                                         keep_order=False,
@@ -114,7 +104,8 @@ def main(args):
                                         merge_strategy="create_unique",
                                         transform=transform_func,
                                         dbfn=args.database,
-                                        checklines=50)
+                                        checklines=50,
+                                        processes=args.threads)
         else:
             if (not args.save_on_disk):
                 db = agouti_pkg.gffutils.create_db(args.annotation, force=True,
@@ -124,7 +115,8 @@ def main(args):
                                     disable_infer_genes= not args.infer_genes,
                                     disable_infer_transcripts=not args.infer_transcripts,
                                     transform=transform_func,
-                                    dbfn=":memory:", checklines=50)
+                                    dbfn=":memory:", checklines=50,
+                                    processes=args.threads)
             else:
                 db = agouti_pkg.gffutils.create_db(args.annotation, force=True,
                                     keep_order=False,
@@ -133,7 +125,8 @@ def main(args):
                                     disable_infer_genes= not args.infer_genes,
                                     disable_infer_transcripts=not args.infer_transcripts,
                                     transform=transform_func,
-                                    dbfn=args.database, checklines=50)
+                                    dbfn=args.database, checklines=50,
+                                    processes=args.threads)
 
     except ValueError:
         eprint("{}ERROR: The file {} has the wrong format or does not exist".format(os.linesep, args.annotation))
@@ -197,14 +190,22 @@ def main(args):
         os.system("rm -f {}".format(args.database))
         sys.exit()
 
+    create_feature_levels(db.conn)
+    create_level1_parents(db.conn)
+    create_transcript_models(db.conn, db.featuretypes())
+    create_features_fingerprint(db.conn)
+
     if (not args.save_on_disk):
         bck = sqlite3.connect(args.database)
         with bck:
             db.conn.backup(bck)
         bck.close()
+    from agouti_pkg.overlap_index import write_index  # needs NumPy
+    write_index(Database(db, args.database), args.database)
     print("-"*10)
     print("The pipeline finished successfully!")
     print("Available attributes and relations are available in the file {}.database.structure.txt".format(args.database))
+    print("The overlap index was written to {}".format(index_path(args.database)))
     database_struct.close()
 
 
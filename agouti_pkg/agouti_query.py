@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import sys
+import sqlite3
+from agouti_pkg.eprint import eprint
+from agouti_pkg.output_index import IndexedOutput
+
+
+def parse_region(region, indexed):
+    """Parses a region in the "chr:start-end" or "chr" format
+
+    Arguments:
+        region {str} -- the region (1-based, inclusive coordinates)
+        indexed {IndexedOutput} -- the indexed output; a region with a colon\
+            is a whole chromosome only if the chromosome is in the index
+
+    Raises:
+        ValueError -- the coordinates of the region are invalid
+
+    Returns:
+        tuple -- chromosome, start and end (None for the whole chromosome)
+    """
+
+    seqid, sep, coords = region.rpartition(":")
+    if not sep or indexed.has_seqid(region):
+        return region, None, None
+    start, sep, end = coords.replace(",", "").partition("-")
+    try:
+        start = int(start)
+        end = int(end) if sep else start
+    except ValueError:
+        raise ValueError("invalid coordinates of the region {}".format(
+            region))
+    if start < 1:
+        raise ValueError("the start of the region {} must be a positive "
+                         "integer".format(region))
+    if start > end:
+        raise ValueError("the start of the region {} is greater than its "
+                         "end".format(region))
+    return seqid, start, end
+
+
+def main(args):
+    """Main function
+
+    Arguments:
+        args {argparse.Namespace} -- command line arguments parsed with\
+            argparse
+    """
+
+    try:
+        indexed = IndexedOutput(args.input)
+    except FileNotFoundError as e:
+        eprint("ERROR: cannot open the indexed output: {} does not exist "
+               "(annotate with --index to create it)".format(e))
+        sys.exit(1)
+    except (OSError, sqlite3.Error) as e:
+        eprint("ERROR: cannot open the indexed output: {}".format(e))
+        sys.exit(1)
+
+    records = []
+    for region in args.regions or []:
+        try:
+            seqid, start, end = parse_region(region, indexed)
+        except ValueError as e:
+            eprint("ERROR: {}".format(e))
+            sys.exit(1)
+        records.extend(indexed.region(seqid, start, end))
+    for name in args.names or []:
+        records.extend(indexed.name(name))
+
+    output = sys.stdout.buffer
+    if not args.no_header:
+        output.write(indexed.header())
+    for data in indexed.read(records):
+        output.write(data)
+    output.flush()
+    indexed.close()
+    return
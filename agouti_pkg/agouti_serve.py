@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import io
+import os
+import sys
+import stat
+import locale
+import signal
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from agouti_pkg.eprint import eprint
+from agouti_pkg.agouti_annotate import (open_database, read_intervals,
+                                        annotate_products)
+from agouti_pkg.header import prepare_header
+from agouti_pkg.errors import AgoutiError, InputFormatError
+
+
+STATUS_CODES = {200: "OK", 400: "Bad Request", 404: "Not Found",
+                405: "Method Not Allowed", 411: "Length Required",
+                500: "Internal Server Error"}
+
+
+class BadRequest(Exception):
+    """The input intervals sent by the client cannot be parsed"""
+
+
+class AnnotationService(object):
+    """Annotates input intervals sent to the server. The database, the\
+        dictionary of features and attributes and the overlap index are\
+        loaded once. SQLite connections cannot be shared between threads,\
+        so all the methods must be called from the same (worker) thread."""
+
+    def __init__(self, args):
+        """
+        Arguments:
+            args {argparse.Namespace} -- command line arguments
+        """
+
+        self.args = args
+        self.encoding = locale.getpreferredencoding(False)
+        self.db = None
+        self.kwargs = None
+
+    def load(self):
+        """Opens the database and loads the overlap index
+        """
+
+        args = self.args
+        self.db, featuretypes_from_db, attributes_and_features = \
+            open_database(args)
+        self.kwargs = {"args": args,
+                       "attributes_and_features": attributes_and_features,
+                       "featuretypes_from_db": featuretypes_from_db}
+        if not args.transcriptomic and args.engine in ("auto", "index"):
+            self.kwargs["index"] = self.db.overlap_index(
+                list(attributes_and_features.keys()))
+
+    def annotate(self, body):
+        """Annotates the input intervals
+
+        Arguments:
+            body {bytes} -- input file (as in agouti annotate --input)
+
+        Raises:
+            BadRequest -- the input has the wrong format
+
+        Returns:
+            bytes -- the output of agouti annotate
+        """
+
+        args = self.args
+        lines = []
+        try:
+            input_batches, num_of_bed_fields, header_lines = read_intervals(
+                args, io.BufferedReader(io.BytesIO(body)))
+            header = prepare_header(self.db, self.kwargs[
+                                        "attributes_and_features"], args,
+                                    num_of_bed_fields, args.header_lines,
+                                    header_lines[-1] if header_lines else None)
+            if args.custom != "BED":
+                # all but the last header line are copied to the output
+                lines.extend(line.strip() for line in
+                             header_lines[:args.header_lines - 1])
+            lines.append(header[0].strip())
+            for batch in input_batches:
+                lines.extend(out for out in annotate_products(
+                    self.db, batch, header=header, **self.kwargs)
+                    if out is not None)
+        except InputFormatError as e:
+            raise BadRequest(str(e))
+        except (ValueError, IndexError, UnicodeDecodeError, EOFError,
+                OSError):
+            raise BadRequest("the input has the wrong format")
+        return "".join(line + "\n" for line in lines).encode(self.encoding)
+
+
+def _response(status, body, content_type, keep_alive):
+    """Formats the HTTP response
+
+    Arguments:
+        status {int} -- HTTP status code
+        body {bytes} -- response body
+        content_type {str} -- value of the Content-Type header
+        keep_alive {bool} -- keep the connection open
+
+    Returns:
+        bytes -- the response
+    """
+
+    head = ("HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n"
+            "Connection: {}\r\n\r\n").format(
+                status, STATUS_CODES[status], content_type, len(body),
+                "keep-alive" if keep_alive else "close")
+    return head.encode("latin-1") + body
+
+
+async def handle_client(reader, writer, service, executor):
+    """Answers HTTP requests sent over a single connection. Requests are\
+        annotated one at a time by the worker thread; other connections are\
+        served by the event loop in the meantime.
+
+    Arguments:
+        reader {asyncio.StreamReader} -- stream of the requests
+        writer {asyncio.StreamWriter} -- stream of the responses
+        service {AnnotationService} -- service with the database loaded
+        executor {ThreadPoolExecutor} -- executor with a single worker thread
+    """
+
+    loop = asyncio.get_event_loop()
+    text = "text/plain; charset=utf-8"
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, target, version = request_line.decode(
+                "latin-1").split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            keep_alive = (version == "HTTP/1.1" and
+                          headers.get("connection", "").lower() != "close")
+            length = headers.get("content-length")
+            body = await reader.readexactly(int(length)) if length else b""
+
+            content_type = text
+            if target.split("?")[0] != "/annotate":
+                status, payload = 404, b"Not found, use POST /annotate\n"
+            elif method != "POST":
+                status, payload = 405, b"Use POST /annotate\n"
+            elif length is None:
+                # chunked requests are not supported
+                status, payload, keep_alive = 411, b"Length required\n", False
+            else:
+                try:
+                    payload = await loop.run_in_executor(
+                        executor, service.annotate, body)
+                    status = 200
+                    content_type = ("text/tab-separated-values; "
+                                    "charset={}".format(service.encoding))
+                except BadRequest as e:
+                    status, payload = 400, "{}\n".format(e).encode()
+                except Exception as e:
+                    eprint("ERROR: {}".format(repr(e)))
+                    status, payload = 500, b"Internal server error\n"
+
+            writer.write(_response(status, payload, content_type, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass  # malformed request or the client disconnected
+    finally:
+        writer.close()
+
+
+async def serve(args, service, executor):
+    """Loads the database and answers requests until interrupted
+
+    Arguments:
+        args {argparse.Namespace} -- command line arguments
+        service {AnnotationService} -- service to be loaded
+        executor {ThreadPoolExecutor} -- executor with a single worker thread
+    """
+
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(executor, service.load)
+    handler = functools.partial(handle_client, service=service,
+                                executor=executor)
+    if args.socket:
+        server = await asyncio.start_unix_server(handler, path=args.socket)
+        address = args.socket
+    else:
+        server = await asyncio.start_server(handler, args.host, args.port)
+        address = "http://{}:{}".format(args.host, args.port)
+    eprint("agouti is listening on {} (POST /annotate)".format(address))
+    async with server:
+        await server.serve_forever()
+
+
+def main(args):
+    """Main function
+
+    Arguments:
+        args {argparse.Namespace} -- command line arguments parsed with\
+            argparse
+    """
+
+    if (args.socket and os.path.exists(args.socket)
+            and stat.S_ISSOCK(os.stat(args.socket).st_mode)):
+        os.remove(args.socket)  # left by a server that was killed
+    executor = ThreadPoolExecutor(max_workers=1)
+    # SIGTERM stops the server like Ctrl+C, so that the socket is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    try:
+        asyncio.run(serve(args, AnnotationService(args), executor))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        eprint("ERROR: cannot start the server: {}".format(e))
+    except AgoutiError as e:
+        eprint("ERROR: {}".format(e))
+        sys.exit(1)
+    finally:
+        executor.shutdown(wait=False)
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return
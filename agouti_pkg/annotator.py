@@ -0,0 +1,178 @@
+import argparse
+from agouti_pkg.argument_parser import (add_annotation_arguments,
+                                        validate_arguments)
+from agouti_pkg.interval_batch import IntervalBatch
+from agouti_pkg.read_input import BATCH_SIZE, batches, _parse_BED_lines
+from agouti_pkg.header import prepare_header
+from agouti_pkg.output_processing import format_records
+
+
+class _OptionParser(argparse.ArgumentParser):
+    """ArgumentParser raising ValueError instead of exiting"""
+
+    def error(self, message):
+        raise ValueError(message)
+
+
+def _option_list(value):
+    """Joins a list of names with commas, as expected by the command line\
+        options (strings are returned unchanged)
+    """
+
+    if value is None or isinstance(value, str):
+        return value
+    return ",".join(value)
+
+
+class Annotator(object):
+    """Annotates intervals from Python code, with the same options and\
+        results as agouti annotate. The database (and the overlap index) is\
+        opened once and reused by all annotate() calls. As the database is\
+        a SQLite connection, an Annotator should be used from a single\
+        thread.
+
+    Example:
+        with Annotator("X.db", features=["mrna", "cds"], level=2) as a:
+            for record in a.annotate([("X", 10020, 10021, "rs1")]):
+                print(record.interval.processing_product, record.feature_id,
+                      record.values)
+    """
+
+    def __init__(self, database, features=None, attributes=None,
+                 combine=None, level=2, transcriptomic=False,
+                 strand_specific=False, completely_within=False,
+                 relative_location=False, coordinates=0, engine="auto",
+                 batch_size=BATCH_SIZE):
+        """
+        Arguments:
+            database {str} -- database file created with agouti create_db
+
+        Keyword Arguments:
+            features {list} -- feature types to be reported, as in\
+                --select_features (default: {None})
+            attributes {list} -- attributes to be reported, as in\
+                --select_attributes (default: {None})
+            combine {dict} -- feature types and their attributes to be\
+                reported, as in --combine (default: {None})
+            level {int} -- annotated level, as in --level (default: {2})
+            transcriptomic {bool} -- transcriptomic mode (default: {False})
+            strand_specific {bool} -- strand-specific search (default: {False})
+            completely_within {bool} -- report only features containing the\
+                whole interval (default: {False})
+            relative_location {bool} -- annotate the relative location of\
+                the interval within the transcript (default: {False})
+            coordinates {int} -- 0 for 0-based start coordinates of the\
+                intervals (as in BED) or 1 for 1-based (default: {0})
+            engine {str} -- overlap engine, as in --engine (default: {"auto"})
+            batch_size {int} -- number of intervals annotated at once\
+                (default: {BATCH_SIZE})
+
+        Raises:
+            ValueError -- the options are incorrect
+            AgoutiError -- the database cannot be used with the options
+        """
+
+        # the options are parsed as in agouti annotate -> the same defaults
+        # and validation
+        if isinstance(combine, dict):
+            combine = ",".join("{}-{}".format(f, ":".join(a))
+                               for f, a in combine.items())
+        argv = ["-d", database, "-l", str(level), "-b", str(coordinates),
+                "-e", engine, "--batch_size", str(batch_size)]
+        for option, value in (("-f", _option_list(features)),
+                              ("-a", _option_list(attributes)),
+                              ("-c", combine)):
+            if value is not None:
+                argv += [option, value]
+        for option, value in (("-t", transcriptomic),
+                              ("-s", strand_specific),
+                              ("-w", completely_within),
+                              ("-r", relative_location)):
+            if value:
+                argv.append(option)
+        parser = _OptionParser("agouti")
+        add_annotation_arguments(parser)
+        args = parser.parse_args(argv)
+        args.command = None
+        validate_arguments(args, parser)
+        self.args = args
+
+        from agouti_pkg.agouti_annotate import open_database
+        self.db, featuretypes_from_db, attributes_and_features = \
+            open_database(args)
+        self.header = prepare_header(self.db, attributes_and_features, args,
+                                     6, 0)
+        self.kwargs = {"args": args,
+                       "attributes_and_features": attributes_and_features,
+                       "header": self.header,
+                       "featuretypes_from_db": featuretypes_from_db}
+        if not transcriptomic and engine in ("auto", "index"):
+            self.kwargs["index"] = self.db.overlap_index(
+                list(attributes_and_features.keys()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes the database
+        """
+
+        self.db.database.conn.close()
+
+    @property
+    def columns(self):
+        """Names of the feature and attribute columns, i.e. keys of\
+            AnnotationRecord.values
+
+        Returns:
+            list -- column names
+        """
+
+        return self.header[1] + self.header[2]
+
+    def annotate(self, intervals):
+        """Annotates the intervals
+
+        Arguments:
+            intervals {iterable} -- tuples (seqid, start, end[, name[,\
+                score[, strand]]]) as in BED columns (transcript ID instead\
+                of seqid in the transcriptomic mode), or an IntervalBatch
+
+        Raises:
+            InputFormatError -- the intervals have the wrong format
+
+        Yields:
+            AnnotationRecord -- records of the intervals, in the order of\
+                the intervals; at least one record for each interval (none\
+                if the transcript is not found in the transcriptomic mode)
+        """
+
+        from agouti_pkg.agouti_annotate import annotate_records
+        if isinstance(intervals, IntervalBatch):
+            input_batches = [intervals]
+        else:
+            lines = ("\t".join(map(str, interval)) for interval in intervals)
+            input_batches = batches(
+                _parse_BED_lines(((line, None) for line in lines),
+                                 self.args.first_base_num),
+                self.args.batch_size)
+        for batch in input_batches:
+            for records in annotate_records(self.db, batch, **self.kwargs):
+                if records is not None:
+                    yield from records
+
+    def format(self, records):
+        """Formats the records of a single interval as in the output of\
+            agouti annotate
+
+        Arguments:
+            records {list} -- AnnotationRecord objects of the interval
+
+        Returns:
+            str -- output lines
+        """
+
+        return format_records(records, self.header, self.args)
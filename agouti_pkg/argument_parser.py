@@ -1,7 +1,6 @@
 import argparse
 from agouti_pkg.sequence_ontology import *
-import pickle
-from agouti_pkg.eprint import eprint
+from agouti_pkg.errors import AgoutiError
 import sys
 
 
@@ -24,10 +23,64 @@ def validate_arguments(args, parser):
         parser.error("--offset should be used with --transcriptomic")
     elif (args.sep != "\t" and args.custom == "BED"):
         parser.error("--separator must be used with --custom option")
+    elif (args.batch_size < 1):
+        parser.error("--batch_size must be a positive integer")
+    elif args.command != "annotate":
+        return
+    elif (args.threads < 1):
+        parser.error("--threads must be a positive integer")
+    elif (args.index and (args.output == "-" or args.stats_only or
+                          args.compression not in ("auto", "bgzf") or
+                          (args.compression == "auto" and
+                           not args.output.endswith((".gz", ".bgz"))))):
+        parser.error("--index requires BGZF output written to a file (-o ending with .gz or .bgz, or --compression bgzf)")
 
     return
 
 
+def add_annotation_arguments(parser):
+    """Adds arguments describing the input format and the annotation to\
+        the parser (shared by the annotate and serve run modes)
+
+    Arguments:
+        parser {ArgumentParser} - ArgumentParser object
+    """
+
+    parser.add_argument('-d', '--database', type=str, help='database file created with the agouti create_db run mode',
+                        required=True, dest='database')
+    parser.add_argument('-m', '--custom', type=str, help='the input text file is in custom format, other than BED. It should contain columns with information about feature id (id), chromosome (chr), start (s) and end (e) coordinates, and optionally about strand. User should provide the proper column indexes (starting from 1) in order: "id,chr,s,e[,strand]". The index of the strand column is optional. Example use: --custom 1,2,4,5,6 or --custom 1,2,4,5. The field separator used in a text file can be specified using the --separator option',
+                        required=False, default="BED", dest='custom')
+    parser.add_argument('-p', '--separator', type=str, help='field separator to be used with the --custom option. Default is "\\t"', required=False, default="\t",
+                        dest='sep')
+    parser.add_argument('-b', '--coordinates', type=int, help='indicate the coordinate system used in the input file (BED/CUSTOM). Either 0 (0-based coordinates) or 1 (1-based coordinates). Default is 0',
+                        choices=[0, 1], required=False, default=0,
+                        dest='first_base_num')
+    parser.add_argument('-n', '--header_lines', type=int, help='the number of header lines in the input file. Default is 0',
+                        required=False, default=0, dest='header_lines')
+    parser.add_argument('-t', '--transcriptomic', action="store_true", help='transcriptomic annotation mode. In this mode, transcript IDs from the GTF/GFF3 are expected to be placed in the first column of provided BED file instead of chromosome names. Coordinates in this mode are assumed to reflect positions within the transcript')
+    parser.add_argument('-f', '--select_features', type=str, help='comma-separated list of feature names to be reported, e.g., "mRNA,CDS". Refer to [db_name].database.structure.txt file for a list of valid features. By default, all features are reported',
+                        required=False, dest='features')
+    parser.add_argument('-a', '--select_attributes', type=str, help='comma-separated list of attribute names to be reported, e.g., "ID,description". Refer to [db_name].database.structure.txt file for a list of valid attributes. By default, all attributes are reported',
+                        required=False, dest='attributes')
+    parser.add_argument('-c', '--combine', type=str, help='list of specific feature-attribute combinations to be reported. The combinations should be specified in the format: feature1-attribute1:attribute2,feature2-attribute1, e.g. "mRNA-ID:description,CDS-ID',
+                        required=False, dest='combine')
+    parser.add_argument('-s', '--strand_specific', action="store_true",
+                        help='strand-specific search')
+    parser.add_argument('-w', '--completly_within', action="store_true",
+                        help='the annotated BED interval must be located entirely within the GTF/GFF3 feature. By default, any overlap is sufficient to trigger annotation')
+    parser.add_argument('-l', '--level', type=int, help='annotate results on a specific level (1 for gene level, 2 for mRNA, tRNA level, etc.). For available levels, refer to the tree-like representation of features in [db_name].database.structure.txt file. Please note that --level 1 cannot be combined with –transcriptomic mode. Default is 2',
+                        choices=[1, 2], required=False, default=2,
+                        dest='level')
+    parser.add_argument('--offset', type=int, help=argparse.SUPPRESS,
+                        required=False, default=0, dest='offset')
+    parser.add_argument('-r', '--annotate_relative_location', action="store_true",
+                        help='annotate the relative location of the interval within the feature. Designed to work with –transcriptomic mode')
+    parser.add_argument('-e', '--engine', type=str, help='method used to find features overlapping the input intervals (genomic mode). "sweep" sorts the intervals and merge-joins them with features read once per chromosome, "index" builds an in-memory overlap index of the features, "region" runs a separate database query for each interval. "auto" uses "sweep" for sorted and "index" for unsorted input',
+                        choices=['auto', 'sweep', 'index', 'region'], required=False, default='auto', dest='engine')
+    parser.add_argument('--batch_size', type=int, help='number of input intervals read and annotated at once. Memory usage depends on the batch size, not on the size of the input file',
+                        required=False, default=100000, dest='batch_size')
+
+
 def parse_arguments(argv):
     """Parse command-line arguments for agouti
 
@@ -50,47 +103,52 @@ def parse_arguments(argv):
                         required=True, dest='database')
     create_db.add_argument('-l', '--low-ram', help='enable low-memory mode of the database creation process (warning: slow!)',
                         action="store_true", dest='save_on_disk')
-    create_db.add_argument('-i', '--infer_genes', help='infer gene features. Use only with GTF files that do not have lines describing genes (warning: slow!)',
+    create_db.add_argument('-i', '--infer_genes', help='infer gene features. Use only with GTF files that do not have lines describing genes',
                         action="store_true", dest='infer_genes')
-    create_db.add_argument('-j', '--infer_transcripts', help='infer transcript features. Use only with GTF files that do not have lines describing transcripts (warning: slow!)',
+    create_db.add_argument('-j', '--infer_transcripts', help='infer transcript features. Use only with GTF files that do not have lines describing transcripts',
                         action="store_true", dest='infer_transcripts')
+    create_db.add_argument('--threads', type=int, help='number of worker processes parsing the annotation file. With more than one, reading (decompression), parsing and inserting into the database run concurrently',
+                        required=False, default=1, dest='threads')
 
     annotate = subprasers.add_parser('annotate', help='run annotation with agouti')
     annotate.add_argument('-i', '--input', type=str,
-                        help='input file in BED or another column-based format (see --custom).', required=True,
+                        help='input file in BED or another column-based format (see --custom), "-" for stdin. Gzip/BGZF-compressed input is decompressed on the fly', required=True,
                         dest='bed')
-    annotate.add_argument('-d', '--database', type=str, help='database file created with the agouti create_db run mode',
-                        required=True, dest='database')
-    annotate.add_argument('-m', '--custom', type=str, help='the input text file is in custom format, other than BED. It should contain columns with information about feature id (id), chromosome (chr), start (s) and end (e) coordinates, and optionally about strand. User should provide the proper column indexes (starting from 1) in order: "id,chr,s,e[,strand]". The index of the strand column is optional. Example use: --custom 1,2,4,5,6 or --custom 1,2,4,5. The field separator used in a text file can be specified using the --separator option',
-                        required=False, default="BED", dest='custom')
-    annotate.add_argument('-p', '--separator', type=str, help='field separator to be used with the --custom option. Default is "\\t"', required=False, default="\t",
-                        dest='sep')
-    annotate.add_argument('-b', '--coordinates', type=int, help='indicate the coordinate system used in the input file (BED/CUSTOM). Either 0 (0-based coordinates) or 1 (1-based coordinates). Default is 0',
-                        choices=[0, 1], required=False, default=0,
-                        dest='first_base_num')
-    annotate.add_argument('-n', '--header_lines', type=int, help='the number of header lines in the input file. Default is 0',
-                        required=False, default=0, dest='header_lines')
-    annotate.add_argument('-t', '--transcriptomic', action="store_true", help='transcriptomic annotation mode. In this mode, transcript IDs from the GTF/GFF3 are expected to be placed in the first column of provided BED file instead of chromosome names. Coordinates in this mode are assumed to reflect positions within the transcript')
-    annotate.add_argument('-f', '--select_features', type=str, help='comma-separated list of feature names to be reported, e.g., "mRNA,CDS". Refer to [db_name].database.structure.txt file for a list of valid features. By default, all features are reported',
-                        required=False, dest='features')
-    annotate.add_argument('-a', '--select_attributes', type=str, help='comma-separated list of attribute names to be reported, e.g., "ID,description". Refer to [db_name].database.structure.txt file for a list of valid attributes. By default, all attributes are reported',
-                        required=False, dest='attributes')
-    annotate.add_argument('-c', '--combine', type=str, help='list of specific feature-attribute combinations to be reported. The combinations should be specified in the format: feature1-attribute1:attribute2,feature2-attribute1, e.g. "mRNA-ID:description,CDS-ID',
-                        required=False, dest='combine')
-    annotate.add_argument('-s', '--strand_specific', action="store_true",
-                        help='strand-specific search')
-    annotate.add_argument('-w', '--completly_within', action="store_true",
-                        help='the annotated BED interval must be located entirely within the GTF/GFF3 feature. By default, any overlap is sufficient to trigger annotation')
-    annotate.add_argument('-l', '--level', type=int, help='annotate results on a specific level (1 for gene level, 2 for mRNA, tRNA level, etc.). For available levels, refer to the tree-like representation of features in [db_name].database.structure.txt file. Please note that --level 1 cannot be combined with –transcriptomic mode. Default is 2',
-                        choices=[1, 2], required=False, default=2,
-                        dest='level')
-    annotate.add_argument('-o', '--offset', type=int, help=argparse.SUPPRESS,
-                        required=False, default=0, dest='offset')
-    annotate.add_argument('-r', '--annotate_relative_location', action="store_true",
-                        help='annotate the relative location of the interval within the feature. Designed to work with –transcriptomic mode')
+    annotate.add_argument('-o', '--output', type=str, help='output file, "-" for stdout',
+                        required=False, default="-", dest='output')
+    annotate.add_argument('--compression', type=str, help='compression of the output. "auto" compresses the output in the BGZF format (readable with gzip) if the name of the output file ends with .gz or .bgz',
+                        choices=['auto', 'none', 'gzip', 'bgzf'], required=False, default='auto', dest='compression')
+    add_annotation_arguments(annotate)
     annotate.add_argument('--statistics', action="store_true", help='calculate additional feature statistics. Those will be displayed on the stderr',
                         dest='statistics')
     annotate.add_argument('--stats_only', action="store_true", help='calculate and display only feature statistics. No annotation will be performed.', dest='stats_only')
+    annotate.add_argument('--buffer_size', type=int, help='size of the output buffer (in characters). The output is written in chunks of roughly this size',
+                        required=False, default=1048576, dest='buffer_size')
+    annotate.add_argument('--writer_thread', action="store_true", help='write the output in a background thread, so that the annotation and writing overlap',
+                        dest='writer_thread')
+    annotate.add_argument('--threads', type=int, help='number of worker processes. Input intervals are partitioned by chromosome (large chromosomes are split into chunks of neighbouring intervals) and annotated in parallel; the output keeps the input order',
+                        required=False, default=1, dest='threads')
+    annotate.add_argument('--index', action="store_true", help='index the BGZF-compressed output by interval coordinates and names. The index is written to [output].agi and allows to extract the annotation of selected intervals with the agouti query run mode',
+                        dest='index')
+
+    serve = subprasers.add_parser('serve', help='run agouti as a server. The database is opened once and annotation requests (input intervals sent with HTTP POST /annotate) are answered without the start-up cost of agouti annotate')
+    serve.add_argument('-u', '--socket', type=str, help='path of the UNIX socket to listen on. By default, the server listens on TCP --host and --port',
+                        required=False, dest='socket')
+    serve.add_argument('--host', type=str, help='address to listen on (TCP)',
+                        required=False, default='127.0.0.1', dest='host')
+    serve.add_argument('--port', type=int, help='port to listen on (TCP)',
+                        required=False, default=8765, dest='port')
+    add_annotation_arguments(serve)
+
+    query = subprasers.add_parser('query', help='extract annotations from the output indexed with agouti annotate --index')
+    query.add_argument('-i', '--input', type=str, help='BGZF-compressed output of agouti annotate, indexed with --index',
+                        required=True, dest='input')
+    query.add_argument('-r', '--region', type=str, action='append', help='report input intervals overlapping the region "chr:start-end" (1-based, inclusive) or the whole chromosome "chr". Can be repeated',
+                        required=False, dest='regions')
+    query.add_argument('-n', '--name', type=str, action='append', help='report input intervals with this name (ID). Can be repeated',
+                        required=False, dest='names')
+    query.add_argument('--no_header', action="store_true", help='do not report the header lines',
+                        dest='no_header')
     if len(sys.argv)==1:
         parser.print_help(sys.stderr)
         sys.exit(1)
@@ -99,9 +157,14 @@ def parse_arguments(argv):
     if args.command == "create_db":
         if ((args.infer_genes or args.infer_transcripts) and args.format == "GFF3"):
             parser.error("Use option --infer_genes and/or --infer_transcripts only with the GTF file format")
-    elif args.command == "annotate":
+        elif args.threads < 1:
+            parser.error("--threads must be a positive integer")
+    elif args.command in ("annotate", "serve"):
         args = parser.parse_args(argv[1:])
         validate_arguments(args, parser)
+    elif args.command == "query":
+        if not (args.regions or args.names):
+            parser.error("Provide at least one --region or --name")
 
     return args
 
@@ -116,6 +179,9 @@ def create_attributes_and_features_dict(database, args, featuretypes_from_db):
         args {argparse.Namespace} -- command-line arguments
         featuretypes_from_db {list} -- list of feature types from the database
 
+    Raises:
+        AgoutiError -- the features cannot be annotated
+
     Returns:
         dict -- dictionary of attributes and features to be annotated
     """
@@ -133,12 +199,12 @@ def create_attributes_and_features_dict(database, args, featuretypes_from_db):
             attributes_and_features[c[0].lower()] = tuple(
                 map(lambda x: x.lower(), list(filter(None, c[1].strip().split(":")))))
     else:
+        import pickle
         try:
             with open('{}.attributes_and_features.pickle'.format(args.database), 'rb') as handle:
                 temp_attributes_and_features = pickle.load(handle)
         except FileNotFoundError:
-            eprint("Cannot locate file 'attributes_and_features.pickle', which should be created during database creation")
-            sys.exit()
+            raise AgoutiError("Cannot locate file 'attributes_and_features.pickle', which should be created during database creation")
         if args.features:
             features_args_list = list(filter(None, args.features.strip().split(",")))
             for feature, attributes in temp_attributes_and_features.items():
@@ -166,8 +232,7 @@ def create_attributes_and_features_dict(database, args, featuretypes_from_db):
                     or f in three_prime_UTR_synonyms or f
                     in five_prime_UTR_synonyms):
                 if (args.combine or args.features):
-                    eprint("In your case (--transcriptomic), features at the 3rd level must be of CDS or UTR type")
-                    sys.exit()
+                    raise AgoutiError("In your case (--transcriptomic), features at the 3rd level must be of CDS or UTR type")
                 else:
                     to_remove.append(f)
 
@@ -183,6 +248,5 @@ def create_attributes_and_features_dict(database, args, featuretypes_from_db):
             if a in database.features_at_2_level:
                 validity = True
     if not validity:
-        eprint("In your case, you need to specify at least one feature at annotated level")
-        sys.exit()
+        raise AgoutiError("In your case, you need to specify at least one feature at annotated level")
     return attributes_and_features
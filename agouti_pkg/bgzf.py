@@ -0,0 +1,159 @@
+import io
+import zlib
+import struct
+from bisect import bisect_right
+
+
+# BGZF (blocked gzip, as written by bgzip) is a series of gzip members of at
+# most 64 kB. Any gzip reader can decompress it, while the block structure
+# allows random access.
+BGZF_BLOCK_SIZE = 0xff00  # uncompressed bytes per block (as in bgzip)
+BGZF_HEADER = struct.Struct("<4BI2BH2BHH")
+BGZF_FOOTER = struct.Struct("<II")
+# empty block marking the end of the file
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+class BgzfWriter(io.RawIOBase):
+    """Binary stream compressing the data in BGZF blocks. Offsets of the\
+        blocks are recorded, so that the file can be indexed."""
+
+    def __init__(self, handle, close_handle=True, compresslevel=6):
+        """
+        Arguments:
+            handle {file} -- binary output stream
+
+        Keyword Arguments:
+            close_handle {bool} -- close the output stream in close()\
+                (default: {True})
+            compresslevel {int} -- zlib compression level (default: {6})
+        """
+
+        super().__init__()
+        self.handle = handle
+        self.close_handle = close_handle
+        self.compresslevel = compresslevel
+        self._buffer = bytearray()
+        # (compressed offset, uncompressed offset) of each block
+        self.blocks = []
+        self._compressed = 0
+        self._uncompressed = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        """Compresses data; full blocks are written to the output stream
+
+        Arguments:
+            data {bytes} -- data to be written
+
+        Returns:
+            int -- number of bytes consumed
+        """
+
+        self._buffer += data
+        while len(self._buffer) >= BGZF_BLOCK_SIZE:
+            self._write_block(bytes(self._buffer[:BGZF_BLOCK_SIZE]))
+            del self._buffer[:BGZF_BLOCK_SIZE]
+        return len(data)
+
+    def _write_block(self, data):
+        """Writes a single BGZF block
+
+        Arguments:
+            data {bytes} -- at most BGZF_BLOCK_SIZE bytes of data
+        """
+
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        block_size = BGZF_HEADER.size + len(compressed) + BGZF_FOOTER.size
+        self.handle.write(BGZF_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66,
+                                           67, 2, block_size - 1))
+        self.handle.write(compressed)
+        self.handle.write(BGZF_FOOTER.pack(zlib.crc32(data) & 0xffffffff,
+                                           len(data)))
+        self.blocks.append((self._compressed, self._uncompressed))
+        self._compressed += block_size
+        self._uncompressed += len(data)
+
+    def flush(self):
+        """Writes the buffered data as a (possibly shorter) block
+        """
+
+        if self._buffer:
+            self._write_block(bytes(self._buffer))
+            self._buffer = bytearray()
+        self.handle.flush()
+
+    def close(self):
+        """Writes the remaining data and the end-of-file marker
+        """
+
+        if self.closed:
+            return
+        self.flush()
+        self.handle.write(BGZF_EOF)
+        super().close()  # flushes the output stream
+        if self.close_handle:
+            self.handle.close()
+
+
+class BgzfReader(object):
+    """Random access to the uncompressed data of a BGZF file, given the\
+        offsets of its blocks (see BgzfWriter.blocks)"""
+
+    def __init__(self, handle, blocks):
+        """
+        Arguments:
+            handle {file} -- BGZF file opened in binary mode
+            blocks {list} -- (compressed offset, uncompressed offset) of\
+                each block, sorted
+        """
+
+        self.handle = handle
+        self.compressed_offsets = [b[0] for b in blocks]
+        self.uncompressed_offsets = [b[1] for b in blocks]
+        self._cached = (None, b"")  # the last decompressed block
+
+    def _block(self, i):
+        """Decompresses the i-th block
+
+        Arguments:
+            i {int} -- number of the block
+
+        Returns:
+            bytes -- uncompressed data of the block
+        """
+
+        if self._cached[0] != i:
+            self.handle.seek(self.compressed_offsets[i])
+            header = BGZF_HEADER.unpack(self.handle.read(BGZF_HEADER.size))
+            compressed = self.handle.read(header[-1] + 1 - BGZF_HEADER.size -
+                                          BGZF_FOOTER.size)
+            self._cached = (i, zlib.decompress(compressed, -15))
+        return self._cached[1]
+
+    def read(self, offset, length):
+        """Reads the uncompressed data; only the blocks containing it are\
+            decompressed
+
+        Arguments:
+            offset {int} -- offset in the uncompressed data
+            length {int} -- number of bytes
+
+        Returns:
+            bytes -- the data
+        """
+
+        chunks = []
+        i = bisect_right(self.uncompressed_offsets, offset) - 1
+        while length > 0 and 0 <= i < len(self.compressed_offsets):
+            data = self._block(i)
+            start = offset - self.uncompressed_offsets[i]
+            chunk = data[start:start + length]
+            chunks.append(chunk)
+            offset += len(chunk)
+            length -= len(chunk)
+            i += 1
+        return b"".join(chunks)
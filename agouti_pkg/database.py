@@ -1,6 +1,230 @@
-from itertools import tee
-import sys
-from agouti_pkg.eprint import eprint
+from itertools import tee, groupby
+from collections import namedtuple
+from agouti_pkg.errors import AgoutiError
+from agouti_pkg.miscallaneous import transcript_model
+from agouti_pkg.gffutils import constants
+
+
+# level of each feature: 1 + number of its ancestors of a different feature
+# type (same as miscallaneous.infer_feature_level used to compute with
+# FeatureDB.parents())
+FEATURE_LEVELS_SQL = """
+    SELECT features.id AS id, 1 + COUNT(DISTINCT parents.id) AS level
+    FROM features
+    LEFT JOIN relations ON relations.child = features.id
+    LEFT JOIN features AS parents ON parents.id = relations.parent
+        AND parents.featuretype != features.featuretype
+    {where}
+    GROUP BY features.id
+"""
+
+
+# level-1 ancestor of each feature that has one: the first ancestor (in the
+# order of FeatureDB.parents()) without parents of its own, or with a single
+# parent of the same feature type (same as get_level1_parent() computed with
+# nested FeatureDB.parents() calls)
+LEVEL1_PARENTS_SQL = """
+    WITH roots AS (
+        SELECT features.id AS id FROM features
+        LEFT JOIN relations ON relations.child = features.id
+        LEFT JOIN features AS parents ON parents.id = relations.parent
+        GROUP BY features.id
+        HAVING COUNT(DISTINCT parents.id) = 0
+            OR (COUNT(DISTINCT parents.id) = 1
+                AND MAX(parents.featuretype = features.featuretype) = 1)
+    )
+    INSERT INTO level1_parents (id, parent)
+    SELECT child, parent FROM (
+        SELECT child, parent, MIN(position) FROM (
+            SELECT relations.child AS child, relations.parent AS parent,
+                MIN(relations.rowid) AS position
+            FROM relations JOIN roots ON roots.id = relations.parent
+            GROUP BY relations.child, relations.parent)
+        GROUP BY child)
+"""
+
+
+# columns of the features table compared by Feature.__eq__ (through str())
+FEATURE_ROW_COLUMNS = ("seqid", "source", "featuretype", "start", "end",
+                       "score", "strand", "frame", "attributes", "extra")
+FeatureRow = namedtuple("FeatureRow", FEATURE_ROW_COLUMNS)
+
+# level-1 children of each feature (as returned by Database.get_children()),
+# together with the parent feature
+TRANSCRIPT_CHILDREN_SQL = """
+    SELECT DISTINCT relations.parent, children.id, {parent}, {children}
+    FROM relations
+    JOIN features AS parents ON parents.id = relations.parent
+    JOIN features AS children ON children.id = relations.child
+    WHERE relations.level = 1
+        AND children.featuretype != parents.featuretype {where}
+    ORDER BY relations.parent
+""".format(parent=", ".join("parents.{}".format(c)
+                            for c in FEATURE_ROW_COLUMNS),
+           children=", ".join("children.{}".format(c)
+                              for c in FEATURE_ROW_COLUMNS),
+           where="{where}")
+
+NO_TRANSCRIPT_MODEL = ((0, 0, 0), None)  # model of a feature without children
+PREFETCH_CHUNK = 500  # ids per SELECT ... WHERE id IN (...) query
+
+
+def iter_transcript_children(conn, transcript_ids=None):
+    """Yields features with their level-1 children
+
+    Arguments:
+        conn {sqlite3.Connection} -- connection to the database
+
+    Keyword Arguments:
+        transcript_ids {list} -- yield only these features, all features\
+            having children if None (default: {None})
+
+    Yields:
+        tuple -- id, FeatureRow of the feature, list of FeatureRow children
+    """
+
+    where, params = "", []
+    if transcript_ids is not None:
+        params = list(transcript_ids)
+        where = "AND relations.parent IN ({})".format(
+            ", ".join("?" for _ in params))
+    n = len(FEATURE_ROW_COLUMNS)
+    rows = conn.execute(TRANSCRIPT_CHILDREN_SQL.format(where=where), params)
+    for parent_id, group in groupby(rows, key=lambda row: row[0]):
+        children = []
+        for row in group:
+            row = tuple(row)
+            children.append(FeatureRow(*row[2 + n:]))
+        yield parent_id, FeatureRow(*row[2:2 + n]), children
+
+
+def create_transcript_models(conn, featuretypes_from_db, batch_size=10000):
+    """Stores lengths of UTRs and CDS (see miscallaneous.transcript_model)\
+        of each feature having children in the transcript_models table
+
+    Arguments:
+        conn {sqlite3.Connection} -- connection to the database
+        featuretypes_from_db {list} -- list of feature types from the database
+
+    Keyword Arguments:
+        batch_size {int} -- rows inserted at once (default: {10000})
+    """
+
+    conn.execute("DROP TABLE IF EXISTS transcript_models")
+    conn.execute("CREATE TABLE transcript_models (id text PRIMARY KEY, "
+                 "five_prime_utr_length int, cds_length int, "
+                 "three_prime_utr_length int, cds_start int)")
+    insert = "INSERT INTO transcript_models VALUES (?, ?, ?, ?, ?)"
+    featuretypes_from_db = list(featuretypes_from_db)
+    batch = []
+    for transcript_id, transcript, children in iter_transcript_children(
+            conn):
+        lengths, cds_start = transcript_model(transcript, children,
+                                              featuretypes_from_db)
+        batch.append((transcript_id,) + tuple(lengths) + (cds_start,))
+        if len(batch) >= batch_size:
+            conn.executemany(insert, batch)
+            batch = []
+    conn.executemany(insert, batch)
+    conn.commit()
+
+
+def create_feature_levels(conn):
+    """Stores the level of each feature in the feature_levels table
+
+    Arguments:
+        conn {sqlite3.Connection} -- connection to the database
+    """
+
+    conn.execute("DROP TABLE IF EXISTS feature_levels")
+    conn.execute("CREATE TABLE feature_levels (id text PRIMARY KEY, "
+                 "level int)")
+    conn.execute("INSERT INTO feature_levels (id, level) {}".format(
+        FEATURE_LEVELS_SQL.format(where="")))
+    conn.commit()
+
+
+def create_level1_parents(conn):
+    """Stores the level-1 ancestor (e.g. gene) of each feature in the\
+        level1_parents table
+
+    Arguments:
+        conn {sqlite3.Connection} -- connection to the database
+    """
+
+    conn.execute("DROP TABLE IF EXISTS level1_parents")
+    conn.execute("CREATE TABLE level1_parents (id text PRIMARY KEY, "
+                 "parent text)")
+    conn.execute(LEVEL1_PARENTS_SQL)
+    conn.commit()
+
+
+def create_features_fingerprint(conn):
+    """Stores a fingerprint of the features table in the\
+        features_fingerprint table: number of rows, the largest row id and\
+        the sums of the start and end coordinates. It is computed once, when\
+        the database is created, and copied to the overlap index, so that an\
+        index left by another build of the database is detected without\
+        scanning the features (see overlap_index.load_index).
+
+    Arguments:
+        conn {sqlite3.Connection} -- connection to the database
+    """
+
+    conn.execute("DROP TABLE IF EXISTS features_fingerprint")
+    conn.execute("CREATE TABLE features_fingerprint (count int, "
+                 "max_rowid int, sum_start int, sum_end int)")
+    conn.execute("INSERT INTO features_fingerprint SELECT count(*), "
+                 "ifnull(max(rowid), 0), ifnull(sum(start), 0), "
+                 "ifnull(sum(end), 0) FROM features")
+    conn.commit()
+
+
+def features_fingerprint(conn):
+    """Returns the fingerprint stored by create_features_fingerprint
+
+    Arguments:
+        conn {sqlite3.Connection} -- connection to the database
+
+    Returns:
+        tuple -- four integers; None if the database has no fingerprint\
+            (created with an older version)
+    """
+
+    if not has_table(conn, "features_fingerprint"):
+        return None
+    row = conn.execute("SELECT count, max_rowid, sum_start, sum_end "
+                       "FROM features_fingerprint").fetchone()
+    return None if row is None else tuple(int(value) for value in row)
+
+
+def index_path(database):
+    """Returns path of the overlap index (see overlap_index.py) stored next to\
+        the database
+
+    Arguments:
+        database {str} -- path of the database file
+
+    Returns:
+        str -- path of the index directory
+    """
+
+    return "{}.overlap_index".format(database)
+
+
+def has_table(conn, name):
+    """Checks whether the table exists in the database
+
+    Arguments:
+        conn {sqlite3.Connection} -- connection to the database
+        name {str} -- name of the table
+
+    Returns:
+        bool -- True if the table exists
+    """
+
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                        "AND name = ?", (name,)).fetchone() is not None
 
 
 class Database(object):
@@ -11,6 +235,20 @@ class Database(object):
         self.features_at_2_level = []
         self.features_at_3_level = []
         self.name = db_name
+        self.seqids = {}  # chromosome -> whether present in the annotations
+        # (chromosome, feature types) -> length of the longest feature
+        self.max_lengths = {}
+        self.features = {}  # feature id -> Feature, filled by prefetch()
+        self._nearest_genes = None  # NearestGeneIndex, built when needed
+        self._overlap_indexes = {}  # feature types -> OverlapIndex
+        self.levels = {}  # feature id -> level
+        # databases created with older versions have no feature_levels table
+        self.has_feature_levels = has_table(database.conn, "feature_levels")
+        self.level1_parents = {}  # feature id -> level-1 ancestor id
+        self.has_level1_parents = has_table(database.conn, "level1_parents")
+        self.transcript_models = {}  # transcript id -> transcript model
+        self.has_transcript_models = has_table(database.conn,
+                                               "transcript_models")
         self.parent_child_relation = set()
         self.create_parent_child_relation()
         self.find_featuretypes_at_given_level(3)
@@ -30,8 +268,7 @@ class Database(object):
                 parent_child.add((tab[0], tab[1]))
             file.close()
         except (IOError, IndexError):
-            eprint("ERROR: Couldn't find the file {}.relations -> create the database again!".format(self.name))
-            sys.exit()
+            raise AgoutiError("Couldn't find the file {}.relations -> create the database again!".format(self.name))
         self.parent_child_relation = parent_child
 
     def find_featuretypes_at_given_level(self, level):
@@ -62,6 +299,282 @@ class Database(object):
             self.features_at_3_level = l3
             
 
+    def has_seqid(self, seqid):
+        """Checks whether the chromosome is present in the annotations
+
+        Arguments:
+            seqid {str} -- chromosome
+
+        Returns:
+            bool -- True if at least one feature is located on the chromosome
+        """
+
+        if seqid not in self.seqids:
+            c = self.database.conn.execute(
+                "SELECT 1 FROM features WHERE seqid = ? LIMIT 1", (seqid,))
+            self.seqids[seqid] = c.fetchone() is not None
+        return self.seqids[seqid]
+
+    def max_feature_length(self, seqid, featuretypes):
+        """Returns end - start of the longest feature of the given types on\
+            the chromosome, which is computed on the first call
+
+        Arguments:
+            seqid {str} -- chromosome
+            featuretypes {list} -- feature types
+
+        Returns:
+            int -- the length; 0 if there are no such features
+        """
+
+        key = (seqid, tuple(featuretypes))
+        if key not in self.max_lengths:
+            c = self.database.conn.execute(
+                "SELECT max(end - start) FROM features WHERE seqid = ? AND "
+                "featuretype IN ({})".format(", ".join("?" for _ in
+                                                       featuretypes)),
+                [seqid] + list(featuretypes))
+            self.max_lengths[key] = c.fetchone()[0] or 0
+        return self.max_lengths[key]
+
+    def nearest_gene_index(self):
+        """Returns the NearestGeneIndex of the database, which is built on\
+            the first call
+
+        Returns:
+            NearestGeneIndex -- the index
+        """
+
+        if self._nearest_genes is None:
+            from agouti_pkg.nearest_gene import NearestGeneIndex  # NumPy
+            self._nearest_genes = NearestGeneIndex.from_database(self)
+        return self._nearest_genes
+
+    def overlap_index(self, featuretypes):
+        """Returns the OverlapIndex of the given feature types, which is\
+            loaded (or built) on the first call
+
+        Arguments:
+            featuretypes {list} -- feature types to be reported
+
+        Returns:
+            OverlapIndex -- the index
+        """
+
+        key = tuple(featuretypes)
+        if key not in self._overlap_indexes:
+            from agouti_pkg.overlap_index import load_index  # needs NumPy
+            self._overlap_indexes[key] = load_index(self, featuretypes)
+        return self._overlap_indexes[key]
+
+    def get_feature(self, id):
+        """Returns the feature with the given id, prefetched or read from the\
+            database
+
+        Arguments:
+            id {str} -- feature id
+
+        Raises:
+            FeatureNotFoundError -- if there is no such feature
+
+        Returns:
+            Feature -- Feature object
+        """
+
+        feature = self.features.get(id)
+        if feature is None:
+            feature = self.database[id]
+        return feature
+
+    def prefetch(self, ids, featuretypes_from_db):
+        """Reads features with the given ids, together with their levels,\
+            level-1 ancestors and transcript models, with a few queries per\
+            PREFETCH_CHUNK ids. Subsequent get_feature(), feature_level(),\
+            level1_parent_id() and transcript_model() calls for these ids\
+            do not query the database.
+
+        Arguments:
+            ids {iterable} -- feature ids
+            featuretypes_from_db {list} -- list of feature types from the\
+                database
+        """
+
+        conn = self.database.conn
+        ids = [i for i in set(ids) if i not in self.features]
+        for k in range(0, len(ids), PREFETCH_CHUNK):
+            chunk = ids[k:k + PREFETCH_CHUNK]
+            placeholders = ", ".join("?" for _ in chunk)
+            for row in conn.execute("{} WHERE id IN ({})".format(
+                    constants._SELECT, placeholders), chunk):
+                self.features[row["id"]] = \
+                    self.database._feature_returner(**row)
+
+            if self.has_feature_levels:
+                query = "SELECT id, level FROM feature_levels WHERE id IN ({})"
+            else:
+                query = FEATURE_LEVELS_SQL.format(
+                    where="WHERE features.id IN ({})")
+            for row in conn.execute(query.format(placeholders), chunk):
+                self.levels[row[0]] = row[1]
+
+            if self.has_level1_parents:
+                self.level1_parents.update((i, i) for i in chunk)
+                self.level1_parents.update(tuple(row) for row in conn.execute(
+                    "SELECT id, parent FROM level1_parents WHERE id IN ({})"
+                    .format(placeholders), chunk))
+
+            self.transcript_models.update((i, NO_TRANSCRIPT_MODEL)
+                                          for i in chunk)
+            if self.has_transcript_models:
+                for row in conn.execute(
+                        "SELECT id, five_prime_utr_length, cds_length, "
+                        "three_prime_utr_length, cds_start FROM "
+                        "transcript_models WHERE id IN ({})".format(
+                            placeholders), chunk):
+                    self.transcript_models[row[0]] = (tuple(row[1:4]), row[4])
+            else:
+                for transcript_id, transcript, children in \
+                        iter_transcript_children(conn, chunk):
+                    self.transcript_models[transcript_id] = transcript_model(
+                        transcript, children, featuretypes_from_db)
+
+    def feature_level(self, feature):
+        """Returns the level of the feature (1 for genes, 2 for transcripts,\
+            etc.). The level is read from the feature_levels table or, for\
+            older databases, computed from the relations table.
+
+        Arguments:
+            feature {Feature} -- Feature object
+
+        Returns:
+            int -- level
+        """
+
+        level = self.levels.get(feature.id)
+        if level is None:
+            if self.has_feature_levels:
+                query = "SELECT level FROM feature_levels WHERE id = ?"
+            else:
+                query = FEATURE_LEVELS_SQL.format(
+                    where="WHERE features.id = ?")
+            row = self.database.conn.execute(query, (feature.id,)).fetchone()
+            level = row[-1] if row is not None else 1
+            self.levels[feature.id] = level
+        return level
+
+    def level1_parent_id(self, feature):
+        """Returns id of the level-1 ancestor (e.g. gene) of the feature.\
+            The ancestor is read from the level1_parents table or, for older\
+            databases, found with FeatureDB.parents() queries. Features\
+            without such ancestor are their own level-1 parents.
+
+        Arguments:
+            feature {Feature} -- Feature object
+
+        Returns:
+            str -- id of the level-1 ancestor
+        """
+
+        parent = self.level1_parents.get(feature.id)
+        if parent is None:
+            if self.has_level1_parents:
+                row = self.database.conn.execute(
+                    "SELECT parent FROM level1_parents WHERE id = ?",
+                    (feature.id,)).fetchone()
+                parent = row[0] if row is not None else feature.id
+            else:
+                parent = self._find_level1_parent(feature)
+            self.level1_parents[feature.id] = parent
+        return parent
+
+    def transcript_model(self, transcript_id, featuretypes_from_db):
+        """Returns lengths of UTRs and CDS and the CDS start of the transcript\
+            (see miscallaneous.transcript_model). The model is read from the\
+            transcript_models table or, for older databases, computed from\
+            the children of the transcript.
+
+        Arguments:
+            transcript_id {str} -- id of the transcript
+            featuretypes_from_db {list} -- list of feature types from the\
+                database (not needed if the model is stored)
+
+        Returns:
+            tuple -- tuple of (5' utr len, cds len, 3' utr len), CDS start
+        """
+
+        model = self.transcript_models.get(transcript_id)
+        if model is None:
+            model = NO_TRANSCRIPT_MODEL
+            if self.has_transcript_models:
+                row = self.database.conn.execute(
+                    "SELECT five_prime_utr_length, cds_length, "
+                    "three_prime_utr_length, cds_start FROM "
+                    "transcript_models WHERE id = ?",
+                    (transcript_id,)).fetchone()
+                if row is not None:
+                    model = (tuple(row[:3]), row[3])
+            else:
+                for _, transcript, children in iter_transcript_children(
+                        self.database.conn, [transcript_id]):
+                    model = transcript_model(transcript, children,
+                                             featuretypes_from_db)
+            self.transcript_models[transcript_id] = model
+        return model
+
+    def _find_level1_parent(self, feature):
+        """Finds id of the level-1 ancestor of the feature with\
+            FeatureDB.parents() queries
+
+        Arguments:
+            feature {Feature} -- Feature object
+
+        Returns:
+            str -- id of the level-1 ancestor
+        """
+
+        for p in self.database.parents(feature):
+            grandparents = list(self.database.parents(p))
+            if len(grandparents) == 0 or (
+                    len(grandparents) == 1 and
+                    grandparents[0].featuretype == p.featuretype):
+                return p.id
+        return feature.id
+
+    def overlapping_children_featuretypes(self, feature, region,
+                                          featuretypes, strand=None):
+        """Returns feature types of the children (at any level) of the\
+            feature, which overlap the region. Children of the same feature\
+            type as the feature are omitted, as in get_children().
+
+        Arguments:
+            feature {Feature} -- parent Feature
+            region {tuple} -- chromosome, start and end coordinates
+            featuretypes {list} -- children of only these featuretypes\
+                are considered
+
+        Keyword Arguments:
+            strand {str} -- consider only children on this strand\
+                (default: {None})
+
+        Returns:
+            set -- feature types
+        """
+
+        featuretypes = list(featuretypes)
+        query = ("SELECT DISTINCT features.featuretype FROM relations "
+                 "JOIN features ON features.id = relations.child "
+                 "WHERE relations.parent = ? AND features.featuretype != ? "
+                 "AND features.seqid = ? AND features.start < ? "
+                 "AND features.end > ? AND features.featuretype IN ({})"
+                 .format(", ".join("?" for _ in featuretypes)))
+        params = [feature.id, feature.featuretype, region[0], region[2],
+                  region[1]] + featuretypes
+        if strand is not None:
+            query += " AND features.strand = ?"
+            params.append(strand)
+        return set(row[0] for row in self.database.conn.execute(query,
+                                                                params))
+
     def get_children(self, parent, ids=False, featuretypes=(), level=None):
         """Get children or children ids of the given 'parent'
 
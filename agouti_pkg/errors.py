@@ -0,0 +1,10 @@
+class AgoutiError(ValueError):
+    """The input data or the options cannot be used. The message describes\
+        the reason; agouti reports it on stderr and exits, while the\
+        library (see annotator.Annotator) raises it to the caller."""
+
+
+class InputFormatError(AgoutiError):
+    """The input intervals have the wrong format. Raised by the readers\
+        (see read_input) when the malformed line is parsed, which may be\
+        after a part of the output has been written."""
@@ -144,4 +144,5 @@ ignore_url_escape_characters = False
 # these keyword args are used by iterators.
 _iterator_kwargs = (
     'data',
-    'checklines', 'transform', 'force_dialect_check', 'dialect', 'from_string')
+    'checklines', 'transform', 'force_dialect_check', 'dialect', 'from_string',
+    'processes')
@@ -1,7 +1,6 @@
 import copy
 import warnings
 import collections
-import tempfile
 import sys
 import os
 import sqlite3
@@ -9,7 +8,6 @@ import agouti_pkg.six
 from textwrap import dedent
 from agouti_pkg.gffutils import constants
 from agouti_pkg.gffutils import version
-from agouti_pkg.gffutils import bins
 from agouti_pkg.gffutils import helpers
 from agouti_pkg.gffutils import feature
 from agouti_pkg.gffutils import interface
@@ -47,6 +45,9 @@ def deprecation_handler(kwargs):
 
 
 class _DBCreator(object):
+    # number of features inserted with a single executemany() call
+    _batch_size = 10000
+
     def __init__(self, data, dbfn, force=False, verbose=False, id_spec=None,
                  merge_strategy='merge', checklines=10, transform=None,
                  force_dialect_check=False, from_string=False, dialect=None,
@@ -98,6 +99,9 @@ class _DBCreator(object):
         self.disable_infer_transcripts = disable_infer_transcripts
 
         self._autoincrements = collections.defaultdict(int)
+        # attribute keys of each feature type, collected while the lines are
+        # parsed (in the order of the first occurrence of the feature type)
+        self.attribute_keys = {}
         if force:
             if os.path.exists(dbfn):
                 os.unlink(dbfn)
@@ -126,6 +130,15 @@ class _DBCreator(object):
         )
 
 
+    def _collect_attribute_keys(self, feature):
+        """
+        Adds attribute keys of the feature to self.attribute_keys.
+        """
+        keys = self.attribute_keys.get(feature.featuretype)
+        if keys is None:
+            keys = self.attribute_keys[feature.featuretype] = set()
+        keys.update(feature.attributes.keys())
+
     def set_verbose(self, verbose=None):
         if verbose == 'debug':
             logger.setLevel(logging.DEBUG)
@@ -395,6 +408,93 @@ class _DBCreator(object):
                 feature.Feature(dialect=self.iterator.dialect, **i))
         return list(set(candidates))
 
+    def _start_batches(self):
+        """
+        Prepares the bulk load of features and relations.  IDs already in the
+        database are remembered, so that ID collisions are detected up front
+        rather than by a failed INSERT.
+        """
+        self._seen_ids = set(
+            row[0] for row in self.conn.execute('SELECT id FROM features'))
+        self._features_batch = []
+        # dict rather than set: deduplicated, but in the order of the file
+        self._relations_batch = {}
+
+    def _add_feature(self, f, cursor, merge=None):
+        """
+        Adds a feature to the current batch.  If its ID has already been used,
+        the batch is written and the feature is passed to `merge` (by default,
+        the merge strategy is applied).
+        """
+        if f.id in self._seen_ids:
+            # merging needs the earlier features in the database
+            self._flush_batches(cursor)
+            (merge or self._merge_duplicate)(f, cursor)
+            return
+        self._seen_ids.add(f.id)
+        self._features_batch.append(f.astuple())
+        if len(self._features_batch) >= self._batch_size:
+            self._flush_batches(cursor)
+
+    def _add_relations(self, relations):
+        """
+        Adds (parent, child, level) tuples to the current batch.
+        """
+        for relation in relations:
+            self._relations_batch[relation] = None
+
+    def _flush_batches(self, cursor):
+        """
+        Writes the current batches of features and relations.
+        """
+        cursor.executemany(constants._INSERT, self._features_batch)
+        # Note the IGNORE, so relationships defined many times in the file
+        # (e.g., the transcript-gene relation on pretty much every line in
+        # a GTF) will only be included once.
+        cursor.executemany(
+            '''
+            INSERT OR IGNORE INTO relations (parent, child, level)
+            VALUES (?, ?, ?)
+            ''', list(self._relations_batch))
+        self._features_batch = []
+        self._relations_batch = {}
+
+    def _merge_duplicate(self, f, cursor):
+        """
+        Applies the merge strategy to a feature whose ID is already in the
+        database.
+        """
+        fixed, final_strategy = self._do_merge(f, self.merge_strategy)
+        if final_strategy == 'merge':
+            cursor.execute(
+                '''
+                UPDATE features SET attributes = ?
+                WHERE id = ?
+                ''', (helpers._jsonify(fixed.attributes),
+                      fixed.id))
+
+            # For any additional fields we're merging, update those as
+            # well.
+            if self.force_merge_fields:
+                _set_clause = ', '.join(
+                    ['%s = ?' % field
+                     for field in self.force_merge_fields])
+                values = [
+                    getattr(fixed, field)
+                    for field in self.force_merge_fields] + [fixed.id]
+                cursor.execute(
+                    '''
+                    UPDATE features SET %s
+                    WHERE id = ?
+                    ''' % _set_clause, tuple(values))
+
+        elif final_strategy == 'replace':
+            self._replace(f, cursor)
+
+        elif final_strategy == 'create_unique':
+            self._insert(f, cursor)
+            self._seen_ids.add(f.id)
+
     def _populate_from_lines(self, lines):
         raise NotImplementedError
 
@@ -559,13 +659,10 @@ class _GFFDBCreator(_DBCreator):
         msg = ("Populating features table and first-order relations: "
                "%d features\r")
 
-        # c.executemany() was not as much of an improvement as I had expected.
-        #
-        # Compared to a benchmark of doing each insert separately:
-        # executemany using a list of dicts to iterate over is ~15% slower
-        # executemany using a list of tuples to iterate over is ~8% faster
+        # Features and relations are inserted in batches with executemany();
+        # only features with an already used ID are handled one at a time.
+        self._start_batches()
         features_seen = None
-        _features, _relations = [], []
         for i, f in enumerate(lines):
             features_seen = i
 
@@ -576,51 +673,14 @@ class _GFFDBCreator(_DBCreator):
                     sys.stderr.write(msg % i)
                     sys.stderr.flush()
 
-            # TODO: handle ID creation here...should be combined with the
-            # INSERT below (that is, don't IGNORE below but catch the error and
-            # re-try with a new ID).  However, is this doable with an
-            # execute-many?
+            self._collect_attribute_keys(f)
             f.id = self._id_handler(f)
-            try:
-                self._insert(f, c)
-            except sqlite3.IntegrityError:
-                fixed, final_strategy = self._do_merge(f, self.merge_strategy)
-                if final_strategy == 'merge':
-                    c.execute(
-                        '''
-                        UPDATE features SET attributes = ?
-                        WHERE id = ?
-                        ''', (helpers._jsonify(fixed.attributes),
-                              fixed.id))
-
-                    # For any additional fields we're merging, update those as
-                    # well.
-                    if self.force_merge_fields:
-                        _set_clause = ', '.join(
-                            ['%s = ?' % field
-                             for field in self.force_merge_fields])
-                        values = [
-                            getattr(fixed, field)
-                            for field in self.force_merge_fields] + [fixed.id]
-                        c.execute(
-                            '''
-                            UPDATE features SET %s
-                            WHERE id = ?
-                            ''' % _set_clause, tuple(values))
-
-                elif final_strategy == 'replace':
-                    self._replace(f, c)
-
-                elif final_strategy == 'create_unique':
-                    self._insert(f, c)
+            self._add_feature(f, c)
 
             if 'Parent' in f.attributes:
-                for parent in f.attributes['Parent']:
-                    c.execute(
-                        '''
-                        INSERT OR IGNORE INTO relations VALUES
-                        (?, ?, 1)
-                        ''', (parent, f.id))
+                self._add_relations(
+                    (parent, f.id, 1) for parent in f.attributes['Parent'])
+        self._flush_batches(c)
         if features_seen is None:
             raise ValueError("No lines parsed -- was an empty file provided?")
 
@@ -631,49 +691,24 @@ class _GFFDBCreator(_DBCreator):
     def _update_relations(self):
         logger.info("Updating relations")
         c = self.conn.cursor()
-        c2 = self.conn.cursor()
-        c3 = self.conn.cursor()
-
-        # TODO: pre-compute indexes?
-        # c.execute('CREATE INDEX ids ON features (id)')
-        # c.execute('CREATE INDEX parentindex ON relations (parent)')
-        # c.execute('CREATE INDEX childindex ON relations (child)')
-        # self.conn.commit()
-
-        if isinstance(self._keep_tempfiles, agouti_pkg.six.string_types):
-            suffix = self._keep_tempfiles
-        else:
-            suffix = '.gffutils'
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix).name
-        fout = open(tmp, 'w')
 
-        # Here we look for "grandchildren" -- for each ID, get the child
-        # (parenthetical subquery below); then for each of those get *its*
-        # child (main query below).
-        #
-        # Results are written to temp file so that we don't read and write at
-        # the same time, which would slow things down considerably.
-
-        c.execute('SELECT id FROM features')
-        for parent in c:
-            c2.execute('''
-                       SELECT child FROM relations WHERE parent IN
-                       (SELECT child FROM relations WHERE parent = ?)
-                       ''', tuple(parent))
-            for grandchild in c2:
-                fout.write('\t'.join((parent[0], grandchild[0])) + '\n')
-        fout.close()
-
-        def relations_generator():
-            for line in open(fout.name):
-                parent, child = line.strip().split('\t')
-                yield dict(parent=parent, child=child, level=2)
-
-        c.executemany(
+        # Here we look for "grandchildren" -- the children of the children of
+        # each feature -- in a single set-based query rather than one query
+        # per feature.  Both joins look up children by parent, which is the
+        # leading column of the relations primary key, so they are index
+        # searches.  SQLite materializes the SELECT before inserting, so
+        # reading and writing the relations table at once is fine.  The ORDER
+        # BY is the order in which the per-feature queries visited the rows.
+        c.execute(
             '''
-            INSERT OR IGNORE INTO relations VALUES
-            (:parent, :child, :level)
-            ''', relations_generator())
+            INSERT OR IGNORE INTO relations (parent, child, level)
+            SELECT r1.parent, r2.child, 2
+            FROM features
+            JOIN relations AS r1 ON r1.parent = features.id
+            JOIN relations AS r2 ON r2.parent = r1.child
+            WHERE r1.level = 1 AND r2.level = 1
+            ORDER BY r1.parent, r1.child, r2.child
+            ''')
 
         # TODO: Index creation.  Which ones affect performance?
         c.execute("DROP INDEX IF EXISTS binindex")
@@ -681,9 +716,6 @@ class _GFFDBCreator(_DBCreator):
 
         self.conn.commit()
 
-        if not self._keep_tempfiles:
-            os.unlink(fout.name)
-
 
 class _GTFDBCreator(_DBCreator):
     def __init__(self, *args, **kwargs):
@@ -702,6 +734,7 @@ class _GTFDBCreator(_DBCreator):
         )
 
         c = self.conn.cursor()
+        self._start_batches()
 
         # Only check this many features to see if it's a gene or transcript and
         # issue the appropriate warning.
@@ -741,38 +774,11 @@ class _GTFDBCreator(_DBCreator):
                     sys.stderr.write(msg % i)
                     sys.stderr.flush()
 
+            self._collect_attribute_keys(f)
             f.id = self._id_handler(f)
 
             # Insert the feature itself...
-            try:
-                self._insert(f, c)
-            except sqlite3.IntegrityError:
-                fixed, final_strategy = self._do_merge(f, self.merge_strategy)
-                if final_strategy == 'merge':
-                    c.execute(
-                        '''
-                        UPDATE features SET attributes = ?
-                        WHERE id = ?
-                        ''', (helpers._jsonify(fixed.attributes),
-                              fixed.id))
-                    # For any additional fields we're merging, update those as
-                    # well.
-                    if self.force_merge_fields:
-                        _set_clause = ', '.join(
-                            ['%s = ?' % field
-                             for field in self.force_merge_fields])
-                        values = [getattr(fixed, field)
-                                  for field in self.force_merge_fields]\
-                            + [fixed.id]
-                        c.execute(
-                            '''
-                            UPDATE features SET %s
-                            WHERE id = ?
-                            ''' % _set_clause, values)
-                elif final_strategy == 'replace':
-                    self._replace(f, c)
-                elif final_strategy == 'create_unique':
-                    self._insert(f, c)
+            self._add_feature(f, c)
 
             # For an on-spec GTF file,
             # self.transcript_key = "transcript_id"
@@ -791,17 +797,9 @@ class _GTFDBCreator(_DBCreator):
                     relations.append((grandparent, f.id, 2))
                     if parent is not None:
                         relations.append((grandparent, parent, 1))
+            self._add_relations(relations)
 
-            # Note the IGNORE, so relationships defined many times in the file
-            # (e.g., the transcript-gene relation on pretty much every line in
-            # a GTF) will only be included once.
-            c.executemany(
-                '''
-                INSERT OR IGNORE INTO relations (parent, child, level)
-                VALUES (?, ?, ?)
-                ''', relations
-            )
-
+        self._flush_batches(c)
         if lines_seen == 0:
             raise ValueError("No lines parsed -- was an empty file provided?")
         logger.info('Committing changes')
@@ -814,9 +812,7 @@ class _GTFDBCreator(_DBCreator):
         if self.disable_infer_genes and self.disable_infer_transcripts:
             return
 
-        # TODO: do any indexes speed this up?
         c = self.conn.cursor()
-        c2 = self.conn.cursor()
 
         logger.info("Creating relations(parent) index")
         c.execute('DROP INDEX IF EXISTS relationsparent')
@@ -831,17 +827,21 @@ class _GTFDBCreator(_DBCreator):
             msg = 'gene'
         elif self.disable_infer_genes:
             msg = 'transcript'
-        logger.info('Inferring %s extents '
-                    'and writing to tempfile' % msg)
+        logger.info('Inferring %s extents' % msg)
 
-        if isinstance(self._keep_tempfiles, agouti_pkg.six.string_types):
-            suffix = self._keep_tempfiles
-        else:
-            suffix = '.gffutils'
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix).name
-        fout = open(tmp, 'w')
-
-        self._tmpfile = tmp
+        # The extent of every transcript and gene is computed in a single
+        # pass: the subfeatures (e.g., exons) are grouped by their parents,
+        # which are transcripts (level 1) and genes (level 2).
+        c.execute(
+            '''
+            SELECT relations.parent, MIN(start), MAX(end), strand, seqid
+            FROM features
+            JOIN relations ON
+            features.id = relations.child
+            WHERE featuretype == ?
+            GROUP BY relations.parent
+            ''', (self.subfeature,))
+        extents = dict((row[0], tuple(row[1:])) for row in c)
 
         # This takes some explanation...
         #
@@ -887,130 +887,73 @@ class _GTFDBCreator(_DBCreator):
             ORDER BY relations.parent
             ''', (self.subfeature,))
 
-        # Now we iterate through those results (using a new cursor) to infer
-        # the extent of transcripts and/or genes.
+        # Now we iterate through those results to create the transcripts
+        # and/or genes.  The query is read in full first, as the same
+        # connection is used to insert the features.
+        pairs = c.fetchall()
 
+        # Drop the indexes so the inserts are faster
+        c.execute('DROP INDEX IF EXISTS relationsparent')
+        c.execute('DROP INDEX IF EXISTS relationschild')
+
+        # Insert the just-inferred transcripts and genes.  TODO: should we
+        # *always* use "merge" here for the merge_strategy?
+        logger.info("Importing inferred features into db")
+        self._start_batches()
         last_gene_id = None
-        n_features = 0
-        for transcript_id, gene_id in c:
+        for transcript_id, gene_id in pairs:
 
             if not self.disable_infer_transcripts:
-                # transcript extent
-                c2.execute(
-                    '''
-                    SELECT MIN(start), MAX(end), strand, seqid
-                    FROM features
-                    JOIN relations ON
-                    features.id = relations.child
-                    WHERE parent = ? AND featuretype == ?
-                    ''', (transcript_id, self.subfeature))
-                transcript_start, transcript_end, strand, seqid = c2.fetchone()
-                transcript_attributes = {
-                    self.transcript_key: [transcript_id],
-                    self.gene_key: [gene_id]
-                }
-                transcript_bin = bins.bins(
-                    transcript_start, transcript_end, one=True)
-
-                # Write out to file; we'll be reading it back in shortly.  Omit
-                # score, frame, source, and extra since they will always have
-                # the same default values (".", ".", "gffutils_derived", and []
-                # respectively)
-
-                fout.write('\t'.join(map(str, [
-                    transcript_id,
-                    seqid,
-                    transcript_start,
-                    transcript_end,
-                    strand,
-                    'transcript',
-                    transcript_bin,
-                    helpers._jsonify(transcript_attributes)
-                ])) + '\n')
-
-                n_features += 1
+                self._add_feature(
+                    self._derived_feature(
+                        'transcript', extents[transcript_id],
+                        {self.transcript_key: [transcript_id],
+                         self.gene_key: [gene_id]}),
+                    c, self._merge_derived)
 
             if not self.disable_infer_genes:
                 # Infer gene extent, but only if we haven't done so already
                 if gene_id != last_gene_id:
-                    c2.execute(
-                        '''
-                        SELECT MIN(start), MAX(end), strand, seqid
-                        FROM features
-                        JOIN relations ON
-                        features.id = relations.child
-                        WHERE parent = ? AND featuretype == ?
-                        ''', (gene_id, self.subfeature))
-                    gene_start, gene_end, strand, seqid = c2.fetchone()
-                    gene_attributes = {self.gene_key: [gene_id]}
-                    gene_bin = bins.bins(gene_start, gene_end, one=True)
-
-                    fout.write('\t'.join(map(str, [
-                        gene_id,
-                        seqid,
-                        gene_start,
-                        gene_end,
-                        strand,
-                        'gene',
-                        gene_bin,
-                        helpers._jsonify(gene_attributes)
-                    ])) + '\n')
+                    self._add_feature(
+                        self._derived_feature(
+                            'gene', extents[gene_id],
+                            {self.gene_key: [gene_id]}),
+                        c, self._merge_derived)
 
                 last_gene_id = gene_id
-                n_features += 1
-
-        fout.close()
-
-        def derived_feature_generator():
-            """
-            Generator of items from the file that was just created...
-            """
-            keys = ['parent', 'seqid', 'start', 'end', 'strand',
-                    'featuretype', 'bin', 'attributes']
-            for line in open(fout.name):
-                d = dict(list(zip(keys, line.strip().split('\t'))))
-                d.pop('parent')
-                d['score'] = '.'
-                d['source'] = 'gffutils_derived'
-                d['frame'] = '.'
-                d['extra'] = []
-                d['attributes'] = helpers._unjsonify(d['attributes'])
-                f = feature.Feature(**d)
-                f.id = self._id_handler(f)
-                yield f
-
-        # Drop the indexes so the inserts are faster
-        c.execute('DROP INDEX IF EXISTS relationsparent')
-        c.execute('DROP INDEX IF EXISTS relationschild')
-
-        # Insert the just-inferred transcripts and genes.  TODO: should we
-        # *always* use "merge" here for the merge_strategy?
-        logger.info("Importing inferred features into db")
-        last_perc = None
-        for i, f in enumerate(derived_feature_generator()):
-            perc = int(i / float(n_features) * 100)
-            if perc != last_perc:
-                sys.stderr.write('%s of %s (%s%%)\r' % (i, n_features, perc))
-                sys.stderr.flush()
-            last_perc = perc
-            try:
-                self._insert(f, c)
-            except sqlite3.IntegrityError:
-                fixed, final_strategy = self._do_merge(f, 'merge')
-                c.execute(
-                    '''
-                    UPDATE features SET attributes = ?
-                    WHERE id = ?
-                    ''', (helpers._jsonify(fixed.attributes),
-                          fixed.id))
+        self._flush_batches(c)
 
         logger.info("Committing changes")
         self.conn.commit()
-        if not self._keep_tempfiles:
-            os.unlink(fout.name)
 
         # TODO: recreate indexes?
 
+    def _derived_feature(self, featuretype, extent, attributes):
+        """
+        Creates an inferred transcript or gene.  Score, frame, source, and
+        extra always have the same default values (".", ".",
+        "gffutils_derived", and [] respectively).
+        """
+        start, end, strand, seqid = extent
+        f = feature.Feature(
+            seqid=seqid, source='gffutils_derived', featuretype=featuretype,
+            start=start, end=end, score='.', strand=strand, frame='.',
+            attributes=attributes, extra=[])
+        f.id = self._id_handler(f)
+        return f
+
+    def _merge_derived(self, f, cursor):
+        """
+        Merges an inferred feature into the feature with the same ID.
+        """
+        fixed, final_strategy = self._do_merge(f, 'merge')
+        cursor.execute(
+            '''
+            UPDATE features SET attributes = ?
+            WHERE id = ?
+            ''', (helpers._jsonify(fixed.attributes),
+                  fixed.id))
+
 
 def create_db(data, dbfn, id_spec=None, force=False, verbose=False,
               checklines=10, merge_strategy='error', transform=None,
@@ -1021,7 +964,7 @@ def create_db(data, dbfn, id_spec=None, force=False, verbose=False,
               pragmas=constants.default_pragmas, sort_attribute_values=False,
               dialect=None, _keep_tempfiles=False, infer_gene_extent=True,
               disable_infer_genes=False, disable_infer_transcripts=False,
-              **kwargs):
+              processes=1, **kwargs):
     """
     Create a database from a GFF or GTF file.
 
@@ -1222,11 +1165,15 @@ def create_db(data, dbfn, id_spec=None, force=False, verbose=False,
         can get time-consuming for large numbers of features.
 
     _keep_tempfiles : bool or string
-        False by default to clean up intermediate tempfiles created during GTF
-        import.  If True, then keep these tempfile for testing or debugging.
-        If string, then keep the tempfile for testing, but also use the string
-        as the suffix fo the tempfile. This can be useful for testing in
-        parallel environments.
+        Ignored; kept for compatibility.  Intermediate tempfiles are no longer
+        created during import.
+
+    processes : int
+        If greater than 1 and `data` is a filename, the file is read by a
+        separate thread and its lines are parsed by this many worker processes,
+        while the features are inserted into the database.  `transform` must
+        then be picklable (e.g., a module-level function) if the worker
+        processes are not forked.
 
     Returns
     -------
@@ -1261,6 +1208,10 @@ def create_db(data, dbfn, id_spec=None, force=False, verbose=False,
     kwargs['data'] = iterator._iter
     kwargs['directives'] = iterator.directives
 
+    # The pipelined iterator has transformed the features already
+    if isinstance(iterator, iterators._PipelinedFileIterator):
+        kwargs['transform'] = None
+
     # Since we've already checked lines, we don't want to do it again
     kwargs['checklines'] = 0
 
@@ -1298,5 +1249,7 @@ def create_db(data, dbfn, id_spec=None, force=False, verbose=False,
                                  pragmas=pragmas,
                                  sort_attribute_values=sort_attribute_values,
                                  text_factory=text_factory)
+    # feature types and their attribute keys, as found in the input lines
+    db.attribute_keys = c.attribute_keys
 
     return db
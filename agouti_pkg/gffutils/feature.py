@@ -14,6 +14,11 @@ _position_lookup = dict(enumerate(['seqid', 'source', 'featuretype', 'start',
 
 
 class Feature(object):
+    # JSON of the attributes and extra fields, set on the features parsed by
+    # the worker processes of iterators._PipelinedFileIterator and used by
+    # astuple() (these features are inserted as parsed)
+    _json_fields = None
+
     def __init__(self, seqid=".", source=".", featuretype=".",
                  start=".", end=".", score=".", strand=".", frame=".",
                  attributes=None, extra=None, bin=None, id=None, dialect=None,
@@ -306,6 +311,11 @@ class Feature(object):
         Tuple
         """
         if not encoding:
+            if self._json_fields is not None:
+                return (
+                    self.id, self.seqid, self.source, self.featuretype,
+                    self.start, self.end, self.score, self.strand, self.frame
+                ) + self._json_fields + (self.calc_bin(),)
             return (
                 self.id, self.seqid, self.source, self.featuretype, self.start,
                 self.end, self.score, self.strand, self.frame,
@@ -11,12 +11,16 @@ important for figuring out how to construct the database.
 import os
 import tempfile
 import itertools
-from agouti_pkg.gffutils.feature import feature_from_line
+import collections
+import multiprocessing
+import threading
+import agouti_pkg.six.moves.queue as queue
+from agouti_pkg.gffutils.feature import feature_from_line, Feature
+from agouti_pkg.gffutils.attributes import dict_class
 from agouti_pkg.gffutils.interface import FeatureDB
 from agouti_pkg.gffutils import helpers
 from textwrap import dedent
 import agouti_pkg.six
-from agouti_pkg.six.moves.urllib.request import urlopen
 if agouti_pkg.six.PY3:
     from urllib import parse as urlparse
 else:
@@ -145,11 +149,224 @@ class _FileIterator(_BaseIterator):
             yield feature_from_line(line, dialect=self.dialect)
 
 
+# Size of the blocks of the file parsed by the worker processes of
+# _PipelinedFileIterator, in bytes
+PIPELINE_BLOCK_SIZE = 1 << 20
+
+# Blocks read ahead or being parsed, per worker process
+PIPELINE_BLOCKS_PER_PROCESS = 4
+
+_pipeline_worker = {}  # state of the worker process, set by _init_pipeline
+
+
+def _init_pipeline(transform):
+    """
+    Initializer of the worker processes of _PipelinedFileIterator.
+    """
+    _pipeline_worker['transform'] = transform
+
+
+def _split_lines(block):
+    """
+    Decodes a block of the file and splits it into lines (universal newlines,
+    as when a plain text file is opened).
+    """
+    text = block.decode('utf-8')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text.split('\n')
+
+
+def _parse_block(block, dialect):
+    """
+    Parses a block of lines in a worker process.  Features are transformed
+    here, and their attributes and extra fields are encoded as JSON, so that
+    the consumer only has to insert them.
+
+    Returns
+    -------
+    Tuple of the list of features (each one a tuple of fields, see
+    _PipelinedFileIterator._feature), the list of directives, and whether the
+    end of the features (a FASTA section) was reached.
+    """
+    transform = _pipeline_worker['transform']
+    features, directives = [], []
+    for line in _split_lines(block):
+        if line == '##FASTA' or line.startswith('>'):
+            return features, directives, True
+
+        if line.startswith('##'):
+            directives.append(line[2:])
+            continue
+
+        if line.startswith(('#')) or len(line) == 0:
+            continue
+
+        f = feature_from_line(line, dialect=dialect)
+        if transform:
+            f = transform(f)
+            if not f:
+                continue
+        attributes = f.attributes
+        if isinstance(attributes, dict_class):
+            attributes = attributes._d
+        features.append((
+            f.seqid, f.source, f.featuretype, f.start, f.end, f.score,
+            f.strand, f.frame, attributes, f.extra, f.bin,
+            (helpers._jsonify(f.attributes), helpers._jsonify(f.extra))))
+    return features, directives, False
+
+
+class _PipelinedFileIterator(_FileIterator):
+    """
+    Subclass for iterating over features provided as a filename, parsing the
+    lines in parallel.  A reader thread decompresses the file and splits it
+    into blocks of lines, a pool of `processes` worker processes parses the
+    blocks (see _parse_block), and the features are yielded in the order of
+    the file.  The first `checklines` features, from which the dialect is
+    inferred, are parsed in this process.
+
+    The transform is applied while parsing, so the consumer must not apply it
+    again.
+    """
+    def __init__(self, data, processes=2, **kwargs):
+        self.processes = processes
+        super(_PipelinedFileIterator, self).__init__(data, **kwargs)
+
+    def __iter__(self):
+        # the transform has been applied by _custom_iter
+        for i in self._iter:
+            i.dialect = self.dialect
+            yield i
+
+    def open_function(self, data):
+        data = os.path.expanduser(data)
+        if data.endswith('.gz'):
+            import gzip
+            return gzip.open(data)
+        return open(data, 'rb')
+
+    def _read_blocks(self, blocks, stop):
+        """
+        Body of the reader thread: puts blocks of whole lines into the
+        `blocks` queue, followed by None (or by the exception raised while
+        reading).
+        """
+        def put(item):
+            # gives up if the consumer has stopped
+            while not stop.is_set():
+                try:
+                    blocks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            with self.open_function(self.data) as handle:
+                rest = b''
+                while True:
+                    chunk = handle.read(PIPELINE_BLOCK_SIZE)
+                    if not chunk:
+                        break
+                    chunk = rest + chunk
+                    end = chunk.rfind(b'\n') + 1
+                    rest = chunk[end:]
+                    if end and not put(chunk[:end]):
+                        return
+            if rest and not put(rest):
+                return
+            put(None)
+        except Exception as e:  # re-raised by the consumer
+            put(e)
+
+    def _feature(self, fields):
+        """
+        Creates a Feature from the fields returned by _parse_block.
+        """
+        (seqid, source, featuretype, start, end, score, strand, frame,
+         attributes, extra, bin, json_fields) = fields
+        _attributes = dict_class()
+        _attributes._d = attributes
+        f = Feature(seqid, source, featuretype, start, end, score, strand,
+                    frame, _attributes, extra, bin=bin, dialect=self.dialect)
+        f._json_fields = json_fields
+        return f
+
+    def _custom_iter(self):
+        max_pending = self.processes * PIPELINE_BLOCKS_PER_PROCESS
+        blocks = queue.Queue(maxsize=max_pending)
+        stop = threading.Event()
+        pool = multiprocessing.Pool(self.processes,
+                                    initializer=_init_pipeline,
+                                    initargs=(self.transform,))
+        reader = threading.Thread(target=self._read_blocks,
+                                  args=(blocks, stop), daemon=True)
+        reader.start()
+
+        def next_block():
+            block = blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            return block
+
+        try:
+            # The first features are parsed here, one by one: the dialect
+            # used by the workers is inferred from them (see
+            # _BaseIterator.__init__).
+            valid_lines = 0
+            block = next_block()
+            while block is not None and valid_lines < self.checklines:
+                lines = _split_lines(block)
+                block = None
+                for i, line in enumerate(lines):
+                    if valid_lines == self.checklines:
+                        block = '\n'.join(lines[i:]).encode('utf-8')
+                        break
+                    if line == '##FASTA' or line.startswith('>'):
+                        return
+                    if line.startswith('##'):
+                        self._directive_handler(line)
+                        continue
+                    if line.startswith(('#')) or len(line) == 0:
+                        continue
+                    valid_lines += 1
+                    f = feature_from_line(line, dialect=self.dialect)
+                    if self.transform:
+                        f = self.transform(f)
+                        if not f:
+                            continue
+                    yield f
+                if block is None:
+                    block = next_block()
+
+            # The rest of the file is parsed by the workers; results are
+            # consumed in the order of the blocks.
+            pending = collections.deque()
+            while block is not None or pending:
+                if block is not None:
+                    pending.append(pool.apply_async(
+                        _parse_block, (block, self.dialect)))
+                    block = next_block()
+                    if len(pending) < max_pending and block is not None:
+                        continue
+                features, directives, end = pending.popleft().get()
+                self.directives.extend(directives)
+                for fields in features:
+                    yield self._feature(fields)
+                if end:
+                    return
+        finally:
+            stop.set()
+            pool.terminate()
+
+
 class _UrlIterator(_FileIterator):
     """
     Subclass for iterating over features provided as a URL
     """
     def open_function(self, data):
+        from agouti_pkg.six.moves.urllib.request import urlopen
         response = urlopen(data)
 
         # ideas from
@@ -227,7 +444,8 @@ def is_url(url):
 
 
 def DataIterator(data, checklines=10, transform=None,
-                 force_dialect_check=False, from_string=False, **kwargs):
+                 force_dialect_check=False, from_string=False, processes=1,
+                 **kwargs):
     """
     Iterate over features, no matter how they are provided.
 
@@ -259,6 +477,10 @@ def DataIterator(data, checklines=10, transform=None,
         Provide the dialect, which will override auto-detected dialects.  If
         provided, you should probably also use `force_dialect_check=False` and
         `checklines=0` but this is not enforced.
+
+    processes : int
+        If greater than 1 and `data` is a filename, the lines are parsed by
+        this many worker processes (see _PipelinedFileIterator).
     """
 
     _kwargs = dict(data=data, checklines=checklines, transform=transform,
@@ -268,6 +490,9 @@ def DataIterator(data, checklines=10, transform=None,
             return _StringIterator(**_kwargs)
         else:
             if os.path.exists(data):
+                if processes > 1:
+                    return _PipelinedFileIterator(processes=processes,
+                                                  **_kwargs)
                 return _FileIterator(**_kwargs)
             elif is_url(data):
                 return _UrlIterator(**_kwargs)
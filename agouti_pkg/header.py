@@ -1,11 +1,11 @@
-from agouti_pkg.read_input import read_header_line
+from agouti_pkg.read_input import parse_header_line
 
 
-def prepare_bed_header(bed_file, custom, transcriptomic, num_of_bed_fields, sep, header_line_num):
+def prepare_bed_header(header_line, custom, transcriptomic, num_of_bed_fields, sep, header_line_num):
     """Prepares part of the header for the features from BED line
 
     Arguments:
-        bed_file {str} -- name or path of the input file
+        header_line {str} -- the last header line of the input file
         custom {str} -- custom file format description - as in --custom arg
         transcriptomic {bool} -- args.transcriptomic
         num_of_bed_fields {int} -- number of columns in the input file
@@ -15,7 +15,7 @@ def prepare_bed_header(bed_file, custom, transcriptomic, num_of_bed_fields, sep,
         [str] -- bed header of the output file
     """
 
-    rhl = read_header_line(bed_file, custom, sep, header_line_num)
+    rhl = parse_header_line(header_line, custom, sep, header_line_num)
     bed_header = ""
 
     if custom != "BED":
@@ -73,7 +73,8 @@ def prepare_bed_header(bed_file, custom, transcriptomic, num_of_bed_fields, sep,
     return bed_header
 
 
-def prepare_header(db, attributes_and_features, args, num_of_bed_fields, header_line_num):
+def prepare_header(db, attributes_and_features, args, num_of_bed_fields, header_line_num,
+                   header_line=None):
     """Prepare header for the output file
 
     Arguments:
@@ -83,6 +84,10 @@ def prepare_header(db, attributes_and_features, args, num_of_bed_fields, header_
         args {argparse} -- parsed command line argument using argparse
         num_of_bed_fields {int} -- number of columns in the input file
 
+    Keyword Arguments:
+        header_line {str} -- the last header line of the input file, as\
+            returned by the input readers (default: {None})
+
     Returns:
         tuple -- header of the output file, attributes choosen by the user to\
             be annotated and present in the database,\
@@ -108,7 +113,7 @@ def prepare_header(db, attributes_and_features, args, num_of_bed_fields, header_
     attributes_choosen_by_user = sorted(attributes_choosen_by_user)
     intersection = list(intersection)
     intersection.sort()
-    bed_header = prepare_bed_header(args.bed, args.custom, args.transcriptomic,
+    bed_header = prepare_bed_header(header_line, args.custom, args.transcriptomic,
                                     num_of_bed_fields, args.sep, header_line_num)
 
     if (args.level == 1):
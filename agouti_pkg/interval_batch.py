@@ -0,0 +1,243 @@
+import numpy as np
+from agouti_pkg.processing_product import ProcessingProduct
+
+
+COORDS_OUTSIDE_TRANSCRIPT = ("No", "just_one", "both")
+# values of ProcessingProduct.check_overlapping_feature__position, in the
+# order in which the conditions are checked
+RELATIVE_LOCATIONS = ("downstream", "upstream", "5 prime", "middle",
+                      "3 prime", "whole", "full")
+
+
+class IntervalBatch(object):
+    """Batch of input intervals stored column-wise. Coordinates, strands,\
+        chromosomes and positions of the intervals with respect to the\
+        transcript boundaries are kept in NumPy arrays (strings as codes of\
+        categories). Lines of the input file are not copied if the file is\
+        memory-mapped; only their offsets and lengths are kept. Rows can be\
+        accessed as ProcessingProduct objects, which are created on demand."""
+
+    def __init__(self, seqids, seqid_codes, starts, ends, strands,
+                 strand_codes, outside_codes, names, scores, source, offsets,
+                 lengths, lines=None, encoding="utf-8"):
+        """
+        Arguments:
+            seqids {list} -- chromosome names; position is the chromosome code
+            seqid_codes {numpy.ndarray} -- chromosome codes
+            starts {numpy.ndarray} -- start coordinates (1-based)
+            ends {numpy.ndarray} -- end coordinates
+            strands {list} -- strands; position is the strand code
+            strand_codes {numpy.ndarray} -- strand codes
+            outside_codes {numpy.ndarray} -- positions of the\
+                COORDS_OUTSIDE_TRANSCRIPT values
+            names {list} -- names of the intervals
+            scores {list} -- scores of the intervals
+            source {mmap.mmap} -- memory-mapped input file (or None)
+            offsets {numpy.ndarray} -- offsets of the lines in the source
+            lengths {numpy.ndarray} -- lengths of the lines in the source
+
+        Keyword Arguments:
+            lines {list} -- copies of the lines that are not read from the\
+                source (None at the positions of the other lines); None if\
+                all the lines are read from the source (default: {None})
+            encoding {str} -- encoding of the source (default: {"utf-8"})
+        """
+
+        self.seqids = seqids
+        self.seqid_codes = seqid_codes
+        self.starts = starts
+        self.ends = ends
+        self.strands = strands
+        self.strand_codes = strand_codes
+        self.outside_codes = outside_codes
+        self.names = names
+        self.scores = scores
+        self.source = source
+        self.offsets = offsets
+        self.lengths = lengths
+        self.lines = lines
+        self.encoding = encoding
+
+    @classmethod
+    def from_records(cls, records, source=None, encoding="utf-8"):
+        """Builds the batch from the records of the input readers
+
+        Arguments:
+            records {iterable} -- tuples of ProcessingProduct and span, i.e.\
+                (offset, length) of its line in the source; if span is\
+                None, the line is taken from ProcessingProduct.bed_line
+
+        Keyword Arguments:
+            source {mmap.mmap} -- memory-mapped input file (default: {None})
+            encoding {str} -- encoding of the source (default: {"utf-8"})
+
+        Returns:
+            IntervalBatch -- the batch
+        """
+
+        seqids, strands = {}, {}
+        outside = {o: i for i, o in enumerate(COORDS_OUTSIDE_TRANSCRIPT)}
+        columns = ([], [], [], [], [], [], [], [], [], [])
+        copied = False
+        for p, span in records:
+            columns[0].append(seqids.setdefault(p.coordinates[0],
+                                                len(seqids)))
+            columns[1].append(p.coordinates[1])
+            columns[2].append(p.coordinates[2])
+            columns[3].append(strands.setdefault(p.strand, len(strands)))
+            columns[4].append(outside[p.coords_outside_transcript])
+            columns[5].append(p.processing_product)
+            columns[6].append(p.score)
+            if span is None:
+                span, copied = (0, 0), True
+            columns[7].append(span[0])
+            columns[8].append(span[1])
+            columns[9].append(p.bed_line)
+
+        return cls(list(seqids), np.array(columns[0], dtype=np.int32),
+                   np.array(columns[1], dtype=np.int64),
+                   np.array(columns[2], dtype=np.int64), list(strands),
+                   np.array(columns[3], dtype=np.int16),
+                   np.array(columns[4], dtype=np.int8), columns[5],
+                   columns[6], source, np.array(columns[7], dtype=np.int64),
+                   np.array(columns[8], dtype=np.int64),
+                   columns[9] if copied else None, encoding)
+
+    @classmethod
+    def from_products(cls, products):
+        """Builds the batch from ProcessingProduct objects
+
+        Arguments:
+            products {iterable} -- ProcessingProduct objects
+
+        Returns:
+            IntervalBatch -- the batch
+        """
+
+        return cls.from_records((p, None) for p in products)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        """Returns the i-th interval as a ProcessingProduct object
+
+        Arguments:
+            i {int} -- position of the interval in the batch
+
+        Returns:
+            ProcessingProduct -- the interval
+        """
+
+        return ProcessingProduct(
+            (self.seqids[self.seqid_codes[i]], int(self.starts[i]),
+             int(self.ends[i])), self.names[i], self.scores[i],
+            self.strands[self.strand_codes[i]], self.bed_line(i), 1,
+            COORDS_OUTSIDE_TRANSCRIPT[self.outside_codes[i]])
+
+    def __iter__(self):
+        for i, (code, start, end, strand, outside) in enumerate(zip(
+                self.seqid_codes.tolist(), self.starts.tolist(),
+                self.ends.tolist(), self.strand_codes.tolist(),
+                self.outside_codes.tolist())):
+            yield ProcessingProduct((self.seqids[code], start, end),
+                                    self.names[i], self.scores[i],
+                                    self.strands[strand], self.bed_line(i),
+                                    1, COORDS_OUTSIDE_TRANSCRIPT[outside])
+
+    def bed_line(self, i):
+        """Returns the line of the input file describing the i-th interval.\
+            Lines of the memory-mapped file are decoded only when needed.
+
+        Arguments:
+            i {int} -- position of the interval in the batch
+
+        Returns:
+            str -- line of the input file
+        """
+
+        if self.lines is not None and self.lines[i] is not None:
+            return self.lines[i]
+        offset = int(self.offsets[i])
+        return self.source[offset:offset + int(self.lengths[i])].decode(
+            self.encoding)
+
+    def take(self, indices):
+        """Returns a new batch with the selected intervals. Lines are copied,\
+            so that the batch can be sent to other processes.
+
+        Arguments:
+            indices {list} -- positions of the intervals in the batch
+
+        Returns:
+            IntervalBatch -- the selected intervals, in the order of indices
+        """
+
+        indices = np.asarray(indices, dtype=np.int64)
+        positions = indices.tolist()
+        zeros = np.zeros(len(positions), dtype=np.int64)
+        return IntervalBatch(self.seqids, self.seqid_codes[indices],
+                             self.starts[indices], self.ends[indices],
+                             self.strands, self.strand_codes[indices],
+                             self.outside_codes[indices],
+                             [self.names[i] for i in positions],
+                             [self.scores[i] for i in positions], None,
+                             zeros, zeros,
+                             [self.bed_line(i) for i in positions])
+
+    def is_sorted(self):
+        """Checks whether the intervals are sorted by (seqid, start), i.e.\
+            all intervals from the same chromosome form a single block and\
+            their start coordinates do not decrease within the block (see\
+            sweep.is_sorted)
+
+        Returns:
+            bool -- True if the intervals are sorted
+        """
+
+        if len(self) < 2:
+            return True
+        codes = self.seqid_codes
+        same = codes[1:] == codes[:-1]
+        blocks = np.concatenate((codes[:1], codes[1:][~same]))
+        if len(np.unique(blocks)) != len(blocks):
+            return False
+        return not np.any(self.starts[1:][same] < self.starts[:-1][same])
+
+    def relative_locations(self, feature_lengths, offset=0):
+        """Checks in which part of the overlapping features lie the\
+            intervals. Vectorized version of\
+            ProcessingProduct.check_overlapping_feature__position.
+
+        Arguments:
+            feature_lengths {iterable} -- length of the overlapping feature\
+                of each interval
+
+        Keyword Arguments:
+            offset {int} -- offset option (see help) (default: {0})
+
+        Returns:
+            list -- localization within overlapping feature of each interval
+        """
+
+        if not len(self):
+            return []
+        start = np.minimum(self.starts, self.ends)
+        end = np.maximum(self.starts, self.ends)
+        length = np.asarray(feature_lengths, dtype=np.int64)
+        pp_length = self.ends - self.starts
+        feature_start = offset if offset else 0
+        q1 = feature_start + (0.25 * length)
+        q2 = feature_start + (0.5 * length)
+        q3 = feature_start + (0.75 * length)
+        both = self.outside_codes == COORDS_OUTSIDE_TRANSCRIPT.index("both")
+
+        conditions = [(start > length) & (end > length),
+                      both,
+                      (start < q1) & (end < q2),
+                      (start > q1) & (end < q3),
+                      (start > q2) & (end > q3),
+                      (start < q1) & (end > q3) & (pp_length < 0.9 * length),
+                      (start < q1) & (end > q3) & (pp_length >= 0.9 * length)]
+        return np.select(conditions, RELATIVE_LOCATIONS,
+                         default="other").tolist()
@@ -1,43 +1,179 @@
 from operator import attrgetter
 from agouti_pkg.sequence_ontology import *
-from io import StringIO
-import pandas as pd
+import re
 from agouti_pkg.eprint import eprint
 
 
+# values read as missing (NaN) by pandas.read_csv, which was used to compute
+# the statistics before
+NA_VALUES = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN",
+             "-nan", "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN",
+             "None", "n/a", "nan", "null"}
+TRUE_VALUES = {"True", "TRUE", "true"}
+FALSE_VALUES = {"False", "FALSE", "false"}
+INT_PATTERN = re.compile(r"^\s*[+-]?\d+\s*$")
+FLOAT_PATTERN = re.compile(r"^\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*$|"
+                           r"^\s*[+-]?(inf|infinity)\s*$", re.IGNORECASE)
+
+
+def deduplicate_column_names(names):
+    """Renames duplicated column names to name.1, name.2, etc., the same way\
+        as pandas.read_csv does
+
+    Arguments:
+        names {list} -- column names
+
+    Returns:
+        list -- unique column names
+    """
+
+    names = ["Unnamed: {}".format(i) if name == "" else name
+             for i, name in enumerate(names)]
+    counts = {}
+    for i, name in enumerate(names):
+        cur_count = counts.get(name, 0)
+        if cur_count > 0:
+            while cur_count > 0:
+                counts[names[i]] = cur_count + 1
+                name = "{}.{}".format(names[i], cur_count)
+                if name in names:
+                    cur_count += 1
+                else:
+                    cur_count = counts.get(name, 0)
+            names[i] = name
+        counts[name] = cur_count + 1
+    return names
+
+
+def format_column_values(counts):
+    """Converts counts of raw values of a column into counts of the values\
+        displayed in the statistics. As with pandas.read_csv, the column is\
+        converted to integers, floats or booleans if all its values can be,\
+        while strings are stripped. Missing values are reported as 'nan'.
+
+    Arguments:
+        counts {dict} -- raw value (None if missing), count; in the order of\
+            the first occurrence
+
+    Returns:
+        list -- tuples of displayed value and count, sorted by count
+    """
+
+    values = [v for v in counts if v is not None and v not in NA_VALUES]
+    missing = len(values) != len(counts)
+    if all(INT_PATTERN.match(v) for v in values):
+        if missing:  # integer columns with missing values become floats
+            convert = lambda v: repr(float(int(v)))
+        else:
+            convert = lambda v: str(int(v))
+    elif all(FLOAT_PATTERN.match(v) for v in values):
+        convert = lambda v: repr(float(v))
+    elif all(v in TRUE_VALUES or v in FALSE_VALUES for v in values):
+        convert = lambda v: str(v in TRUE_VALUES)
+    else:
+        convert = lambda v: v.strip()
+
+    displayed = {}
+    for value, count in counts.items():
+        if value is None or value in NA_VALUES:
+            key = "nan"
+        else:
+            key = convert(value)
+        displayed[key] = displayed.get(key, 0) + count
+    return sorted(displayed.items(), key=lambda item: -item[1])
+
+
+class StatisticsAccumulator(object):
+    """Counts values of the annotated columns while the output is produced.\
+        Only the counts are kept in memory, not the output itself."""
+
+    def __init__(self):
+        self.columns = None  # names of the selected columns
+        self.positions = []  # positions of the selected columns
+        self.counts = []  # raw value counts of each selected column
+
+    def add(self, text):
+        """Updates the counts with lines of the output. The first line is\
+            the header.
+
+        Arguments:
+            text {str} -- one or more lines of the output
+        """
+
+        for line in text.split("\n"):
+            if not line.strip(" "):
+                continue
+            fields = line.split("\t")
+            if self.columns is None:
+                self._select_columns(fields)
+                continue
+            for position, counts in zip(self.positions, self.counts):
+                value = fields[position] if position < len(fields) else None
+                counts[value] = counts.get(value, 0) + 1
+
+    def add_fields(self, lines):
+        """Updates the counts with lines of the output split into columns,\
+            so that the lines do not have to be built. The header must be\
+            added first (see add).
+
+        Arguments:
+            lines {iterable} -- tuples of the input line and the list of the\
+                following columns (see output_processing.record_fields)
+        """
+
+        for bed, fields in lines:
+            prefix = bed.count("\t") + 1
+            for position, counts in zip(self.positions, self.counts):
+                i = position - prefix
+                if i < 0:
+                    value = bed.split("\t")[position]
+                else:
+                    value = fields[i] if i < len(fields) else None
+                counts[value] = counts.get(value, 0) + 1
+
+    def _select_columns(self, header):
+        """Selects columns for which statistics will be calculated
+
+        Arguments:
+            header {list} -- column names
+        """
+
+        columns = deduplicate_column_names(header)
+        #check the index of the first column for which stats will be calculated
+        for i in range(0, len(columns)):
+            if columns[i].startswith("annotated_") and not columns[i+1].startswith("annotated_"):
+                n = i+1
+                break
+        self.positions = list(range(n, len(columns)))
+        if "annotated_featuretype" in columns:
+            self.positions.append(columns.index("annotated_featuretype"))
+        self.columns = [columns[i] for i in self.positions]
+        self.counts = [{} for _ in self.positions]
+
+    def report(self):
+        """Displays the statistics on stderr
+        """
+
+        eprint("##"*10)
+        eprint("##STATISTICS")
+        eprint("##"*10)
+        for col, counts in zip(self.columns or [], self.counts):
+            output = []
+            for key, value in format_column_values(counts):
+                output.append(f"'{key}' - {value}")
+            eprint(f"# statistics for the '{col}' column: {'; '.join(output)}")
+
+
 def statistics(agouti_output : str):
     """Create statistics based on the agouti output
 
     Args:
         agouti_output (str): output of the agouti software
     """
-    
-    output = StringIO(agouti_output)
-    df = pd.read_csv(output, sep="\t", index_col=False) 
-    
-    columns = df.columns
-    
-    #check the index of the first column for which stats will be calculated
-    for i in range(0, len(columns)):
-        if columns[i].startswith("annotated_") and not columns[i+1].startswith("annotated_"):
-            n = i+1
-            break
-    cols = list(columns[n:])
-    if "annotated_featuretype" in columns:
-        cols.append("annotated_featuretype")
-    eprint("##"*10)
-    eprint("##STATISTICS")
-    eprint("##"*10)
-    for col in cols:
-        try:
-            df[col] = df[col].str.strip()
-        except AttributeError:
-            pass
-        output = []
-        col_stats = df[col].value_counts(dropna=False).to_dict()
-        for key, value in col_stats.items():
-            output.append(f"'{key}' - {value}")
-        eprint(f"# statistics for the '{col}' column: {'; '.join(output)}")
+
+    accumulator = StatisticsAccumulator()
+    accumulator.add(agouti_output)
+    accumulator.report()
 
 
 def sum_features_length(features):
@@ -73,15 +209,10 @@ def get_level1_parent(db, child, id=False):
         Feature -- child Feature or id if id parameter is set to True
     """
 
-    for p in db.database.parents(child):
-        p_parents = db.database.parents(p)
-        if sum(1 for a in db.database.parents(p)) == 0:
-            return p.id if id else p
-        elif sum(1 for c in db.database.parents(p)) == 1:
-            for a in db.database.parents(p):
-                if p.featuretype == a.featuretype:
-                    return p.id if id else p
-    return child.id if id else child
+    parent_id = db.level1_parent_id(child)
+    if id:
+        return parent_id
+    return child if parent_id == child.id else db.database[parent_id]
 
 
 def completly_within(start, end, feature):
@@ -158,47 +289,65 @@ def distinguish_UTRs(utr, cds):
     return (five_primes, three_primes)
 
 
-def get_exons(feature, db):
+def select_children(children, featuretypes):
+    """Selects children of given feature types from the list of children.\
+        As in Database.get_children(), all children are returned if no\
+        feature types are given.
+
+    Arguments:
+        children {list} -- level-1 children of a transcript
+        featuretypes {iterable} -- feature types
+
+    Returns:
+        list -- list of children
+    """
+
+    featuretypes = set(featuretypes)
+    if len(featuretypes):
+        return [c for c in children if c.featuretype in featuretypes]
+    return list(children)
+
+
+def get_exons(children):
     """Returns exons of a given transcript.
 
     Arguments:
-        feature {Feature} -- transcript
-        db {modules.database.Database} -- Database object
+        children {list} -- level-1 children of the transcript
 
     Returns:
         list -- list of exons
     """
 
-    utr5_children = db.get_children(feature, featuretypes=["exon"], level=1)
-    exons_children = db.get_children(feature, featuretypes=["exon"], level=1)
-    return list(exons_children)
+    return select_children(children, ["exon"])
 
 
-def get_cds(feature, featuretypes_from_db, db):
+def get_cds(children, featuretypes_from_db):
     """Returns CDS of a given transcript
 
     Arguments:
-        feature {Feature} -- transcript
+        children {list} -- level-1 children of the transcript
         featuretypes_from_db {list} -- list of feature types from the database
-        db {modules.database.Database} -- Database object
 
     Returns:
-        tuple -- tuple of CDS
+        list -- list of CDS
     """
 
     synonyms = cds_synonyms
     intersection = set(synonyms) & set(featuretypes_from_db)
-    children = db.get_children(feature, featuretypes=intersection, level=1)
-    return children
+    return select_children(children, intersection)
 
 
-def get_three_prime_UTRs(feature, featuretypes_from_db, db):
+def get_three_prime_UTRs(feature, children, featuretypes_from_db, cds=None):
     """Returns 3' UTR regions of a given transcript
 
     Arguments:
         feature {Feature} -- transcript
+        children {list} -- level-1 children of the transcript
         featuretypes_from_db {list} -- list of feature types from the database
-        db {modules.database.Database} -- Database object
+
+    Keyword Arguments:
+        cds {list} -- CDS of the transcript, found with get_cds() if None\
+            (default: {None})
 
     Returns:
         list -- list of 3 prime UTRs. Usually of length equal to 1
@@ -206,11 +355,11 @@ def get_three_prime_UTRs(feature, featuretypes_from_db, db):
 
     synonyms = [three_prime_UTR_synonyms, UTR_synonyms]
     intersection = set(synonyms[0]) & set(featuretypes_from_db)
-    utr3_children = db.get_children(feature, featuretypes=intersection,
-                                    level=1)
+    utr3_children = select_children(children, intersection)
     intersection = set(synonyms[1]) & set(featuretypes_from_db)
-    utr_children = db.get_children(feature, featuretypes=intersection, level=1)
-    cds = get_cds(feature, featuretypes_from_db, db)
+    utr_children = select_children(children, intersection)
+    if cds is None:
+        cds = get_cds(children, featuretypes_from_db)
     five_primes, three_primes = [], []
     if len(utr_children) and len(cds) and len(intersection):
         five_primes, three_primes = distinguish_UTRs(utr_children, cds)
@@ -229,13 +378,17 @@ def get_three_prime_UTRs(feature, featuretypes_from_db, db):
     return result_list
 
 
-def get_five_prime_UTRs(feature, featuretypes_from_db, db):
+def get_five_prime_UTRs(feature, children, featuretypes_from_db, cds=None):
     """Returns 5' UTR regions of a given transcript
 
     Arguments:
         feature {Feature} -- transcript
+        children {list} -- level-1 children of the transcript
         featuretypes_from_db {list} -- list of feature types from the database
-        db {modules.database.Database} -- Database object
+
+    Keyword Arguments:
+        cds {list} -- CDS of the transcript, found with get_cds() if None\
+            (default: {None})
 
     Returns:
         list -- list of 3 prime UTRs. Usually of length equal to 1
@@ -243,11 +396,11 @@ def get_five_prime_UTRs(feature, featuretypes_from_db, db):
 
     synonyms = [five_prime_UTR_synonyms, UTR_synonyms]
     intersection = set(synonyms[0]) & set(featuretypes_from_db)
-    utr5_children = db.get_children(
-        feature, featuretypes=intersection, level=1)
+    utr5_children = select_children(children, intersection)
     intersection = set(synonyms[1]) & set(featuretypes_from_db)
-    utr_children = db.get_children(feature, featuretypes=intersection, level=1)
-    cds = get_cds(feature, featuretypes_from_db, db)
+    utr_children = select_children(children, intersection)
+    if cds is None:
+        cds = get_cds(children, featuretypes_from_db)
 
     five_primes, three_primes = [], []
     if len(utr_children) and len(cds) and len(intersection):
@@ -267,6 +420,61 @@ def get_five_prime_UTRs(feature, featuretypes_from_db, db):
     return result_list
 
 
+def transcript_model(feature, children, featuretypes_from_db):
+    """Computes lengths of UTRs and CDS of a given transcript
+
+    Arguments:
+        feature {Feature} -- transcript
+        children {list} -- level-1 children of the transcript, other than\
+            of the transcript feature type
+        featuretypes_from_db {list} -- list of feature types from the database
+
+    Returns:
+        tuple -- first element is tuple of (5' utr len, cds len ,\
+                 3' utr len), second is start coordinate of CDS within\
+                 transcript
+    """
+
+    featuretypes_from_db = list(featuretypes_from_db)
+    cds = get_cds(children, featuretypes_from_db)
+    three_prime_UTRs = get_three_prime_UTRs(feature, children,
+                                            featuretypes_from_db, cds)
+    five_prime_UTRs = get_five_prime_UTRs(feature, children,
+                                          featuretypes_from_db, cds)
+    exons = get_exons(children)
+    five_prime_utr_len = sum_features_length(five_prime_UTRs)
+    three_prime_utr_len = sum_features_length(three_prime_UTRs)
+    transcript_length = sum_features_length(exons)
+    cds_len = transcript_length - five_prime_utr_len - three_prime_utr_len
+
+    if len(cds) == 0:
+        cds_start = None
+    else:
+        cds_start = min(cds, key=attrgetter('start')).start
+
+    if (sum([cds_len, three_prime_utr_len, five_prime_utr_len]) !=
+       transcript_length and len(cds)):
+
+        left_side_of_cds_len = 0
+        for exon in exons:
+            if (cds_start >= exon.end):
+                left_side_of_cds_len += exon.end - exon.start
+            elif (cds_start < exon.end and cds_start > exon.start):
+                left_side_of_cds_len += cds_start - exon.start
+
+        five_prime_utr_len = left_side_of_cds_len
+        three_prime_utr_len = (transcript_length - five_prime_utr_len
+                               - cds_len)
+
+    lengths_tuple = (five_prime_utr_len, cds_len,
+                     three_prime_utr_len)
+
+    if lengths_tuple == (0, 0, 0):
+        lengths_tuple = (0, transcript_length, 0)
+
+    return lengths_tuple, cds_start
+
+
 def handle_negative_coordinates(start, end):
     """Checks if coordinates are outside transcript boundaries
 
@@ -305,11 +513,7 @@ def infer_feature_level(feature, db):
         int -- level
     """
 
-    level = 1
-    for parent in db.database.parents(feature):
-        if (parent.featuretype != feature.featuretype):
-            level = level + 1
-    return level
+    return db.feature_level(feature)
 
 
 def completly_within_positive_coordinates(lengths_dict, feature,
@@ -410,75 +614,109 @@ def check_position_within_transcript(args, lengths, num, processing_product):
             return False
 
 
-def find_closest_gene(database, processing_product):
-    """Find the closest gene to the processing_product
+def closest_genes(database, processing_product):
+    """Find the closest genes upstream and downstream of the\
+        processing_product
 
     Arguments:
         database {Database} -- Database object
         processing_product {ProcessingProduct} -- ProcessingProduct object
 
     Returns:
-        [str] -- string to display in the output file
+        tuple -- upstream gene ID, distance to the upstream gene, downstream\
+            gene ID, distance to the downstream gene (None if there is no gene)
     """
 
-    f1 = ", ".join(add_quotation_marks(list(database.features_at_1_level)))
-    if "-" not in processing_product.strand:
+    return batch_closest_genes(database, [processing_product])[0]
 
-        upstream = database.database.execute(
-            'SELECT max(end), id from features where seqid == "{}" AND \
-            featuretype IN ({}) AND end <= {}'.format(
-                processing_product.coordinates[0], f1,
-                processing_product.coordinates[1]))
 
-        downstream = database.database.execute(
-            'SELECT min(start), id from features where seqid == "{}" AND \
-            featuretype IN ({}) AND start >= {}'.format(
-                processing_product.coordinates[0], f1,
-                processing_product.coordinates[2]))
+def batch_closest_genes(database, processing_products):
+    """Find the closest genes upstream and downstream of each\
+        processing_product. The genes of all intervals from the same\
+        chromosome are found with a single NearestGeneIndex.closest() call.
 
-    else:
-        downstream = database.database.execute(
-            'SELECT max(end), id from features where seqid == "{}" AND \
-            featuretype IN ({}) AND end <= {}'.format(
-                processing_product.coordinates[0], f1,
-                processing_product.coordinates[1]))
-
-        upstream = database.database.execute(
-            'SELECT min(start), id from features where seqid == "{}" AND \
-            featuretype IN ({}) AND start >= {}'.format(
-                processing_product.coordinates[0], f1,
-                processing_product.coordinates[2]))
+    Arguments:
+        database {Database} -- Database object
+        processing_products {list} -- ProcessingProduct objects
 
-    values = []
+    Returns:
+        list -- tuple for each processing_product (see closest_genes)
+    """
 
-    for i in upstream.fetchone():
-        values.append(i)
+    index = database.nearest_gene_index()
+    chromosomes = {}
+    for i, processing_product in enumerate(processing_products):
+        chromosomes.setdefault(processing_product.coordinates[0],
+                               []).append(i)
+    genes = [None] * len(processing_products)
+    for seqid, indices in chromosomes.items():
+        products = [processing_products[i] for i in indices]
+        found = index.closest(seqid, [p.coordinates[1] for p in products],
+                              [p.coordinates[2] for p in products])
+        for i, processing_product, values in zip(indices, products, found):
+            genes[i] = _oriented_closest_genes(processing_product, values)
+    return genes
+
+
+def _oriented_closest_genes(processing_product, values):
+    """Converts the genes found with NearestGeneIndex.closest() into the\
+        upstream and downstream genes of the processing_product, with the\
+        distances (see closest_genes)
+    """
 
-    for i in downstream.fetchone():
-        values.append(i)
+    if "-" in processing_product.strand:
+        # genes downstream end before the interval, upstream start after it
+        values = values[2:] + values[:2]
 
     if "-" not in processing_product.strand:
 
-        return "closest gene upstream: {} - distance {} bp; closest gene downstream: {} - distance {} bp".format(values[1], processing_product.coordinates[1] -
-                         values[0] if values[0] is not None else None,
-                         values[3], values[2] -
-                         processing_product.coordinates[2]
-                         if values[2] is not None else None)
+        return (values[1], processing_product.coordinates[1] -
+                values[0] if values[0] is not None else None,
+                values[3], values[2] - processing_product.coordinates[2]
+                if values[2] is not None else None)
     else:
 
-        return "closest gene upstream: {} - distance {} bp; closest gene downstream: {} - distance {} bp".format(values[1], values[0]-processing_product.coordinates[2]
-                         if values[0] is not None else None, values[3],
-                         processing_product.coordinates[1] - values[2]
-                         if values[2] is not None else None)
+        return (values[1], values[0]-processing_product.coordinates[2]
+                if values[0] is not None else None, values[3],
+                processing_product.coordinates[1] - values[2]
+                if values[2] is not None else None)
 
 
-def filter_overlapping_features(attributes_and_features, args, db, feature,
-                                overlapping_features, header_features,
-                                header_attr, processing_product=None,
-                                lengths=None):
+def format_closest_genes(genes):
+    """Formats the closest genes (see closest_genes) to be displayed in the\
+        output file
+
+    Arguments:
+        genes {tuple} -- upstream gene ID, its distance, downstream gene ID,\
+            its distance
+
+    Returns:
+        [str] -- string to display in the output file
+    """
+
+    return "closest gene upstream: {} - distance {} bp; closest gene downstream: {} - distance {} bp".format(*genes)
+
+
+def find_closest_gene(database, processing_product):
+    """Find the closest gene to the processing_product
+
+    Arguments:
+        database {Database} -- Database object
+        processing_product {ProcessingProduct} -- ProcessingProduct object
+
+    Returns:
+        [str] -- string to display in the output file
+    """
+
+    return format_closest_genes(closest_genes(database, processing_product))
+
+
+def overlapping_feature_values(attributes_and_features, args, db, feature,
+                               processing_product, header_features,
+                               header_attr, lengths=None):
     """Filter overlapping features so that they meet criteria specified by\
         user.
-       Parse the results to be displayed in the output file.
+       Collects values of the feature and attribute columns.
 
     Arguments:
         attributes_and_features {dict} -- dictionary of attributes and\
@@ -486,20 +724,18 @@ def filter_overlapping_features(attributes_and_features, args, db, feature,
         args {argparse.Namespace} -- argparse command-line arguments
         db {Database} -- Database object
         feature {Feature} -- single overlapping Feature object
-        overlapping_features {list} -- list of overlapping features
+        processing_product {ProcessingProduct} -- object of the
+            ProcessingProduct class
         header_features {list} -- features present in the header
         header_attr {list} -- attributes present in the header
 
     Keyword Arguments:
-        processing_product {ProcessingProduct} -- object of the
-            ProcessingProduct class (default: {None})
         lengths {dict} -- dictionary of utr and cds lengths (default: {None})
 
     Returns:
-        str -- results to be displayed
+        dict -- value of each column from header_features and header_attr
     """
 
-    children_ids = db.get_children(feature, ids=True)
     d = {}
     position = check_position_within_transcript  # abbreviation
 
@@ -544,14 +780,15 @@ def filter_overlapping_features(attributes_and_features, args, db, feature,
                    f in cds_synonyms):
                     d[f] = "NA"
 
-    else:
-
-        for o in overlapping_features:
+    elif not args.transcriptomic:
 
-            if (o.id in children_ids and
-               o.featuretype in attributes_and_features.keys()):
+        # children of the feature overlapping the annotated interval
+        strand = processing_product.strand if args.strand_specific else None
+        for featuretype in db.overlapping_children_featuretypes(
+                feature, processing_product.coordinates,
+                attributes_and_features.keys(), strand):
 
-                d[o.featuretype] = "y"
+            d[featuretype] = "y"
 
     # attributes
     analyzed_set = set(attributes_and_features[feature.featuretype]
@@ -562,6 +799,37 @@ def filter_overlapping_features(attributes_and_features, args, db, feature,
             if attr == a:
 
                 d[attr] = ("").join(feature[attr])
+    return d
+
+
+def filter_overlapping_features(attributes_and_features, args, db, feature,
+                                processing_product, header_features,
+                                header_attr, lengths=None):
+    """Filter overlapping features so that they meet criteria specified by\
+        user.
+       Parse the results to be displayed in the output file.
+
+    Arguments:
+        attributes_and_features {dict} -- dictionary of attributes and\
+            features that need to be annotated
+        args {argparse.Namespace} -- argparse command-line arguments
+        db {Database} -- Database object
+        feature {Feature} -- single overlapping Feature object
+        processing_product {ProcessingProduct} -- object of the
+            ProcessingProduct class
+        header_features {list} -- features present in the header
+        header_attr {list} -- attributes present in the header
+
+    Keyword Arguments:
+        lengths {dict} -- dictionary of utr and cds lengths (default: {None})
+
+    Returns:
+        str -- results to be displayed
+    """
+
+    d = overlapping_feature_values(attributes_and_features, args, db, feature,
+                                   processing_product, header_features,
+                                   header_attr, lengths)
     # concatenation
     result = ""
 
@@ -0,0 +1,102 @@
+import numpy as np
+
+
+class NearestGeneIndex(object):
+    """Coordinates of the level-1 features (genes) of each chromosome kept in\
+        sorted NumPy arrays. Neighbouring genes of an interval are found with\
+        binary searches instead of database queries."""
+
+    def __init__(self, chromosomes):
+        """
+        Arguments:
+            chromosomes {dict} -- chromosome (key), tuple of four arrays\
+                (value): distinct end coordinates (sorted), ids of the genes\
+                ending there, distinct start coordinates (sorted), ids of\
+                the genes starting there
+        """
+
+        self.chromosomes = chromosomes
+
+    @classmethod
+    def from_database(cls, db):
+        """Builds the index from the features at the 1st level
+
+        Arguments:
+            db {Database} -- object of the Database class
+
+        Returns:
+            NearestGeneIndex -- the index
+        """
+
+        featuretypes = list(db.features_at_1_level)
+        rows = {}
+        if featuretypes:
+            query = ("SELECT seqid, start, end, id, featuretype, rowid FROM "
+                     "features WHERE featuretype IN ({})".format(
+                         ", ".join("?" for _ in featuretypes)))
+            for row in db.database.conn.execute(query, featuretypes):
+                rows.setdefault(row[0], []).append(tuple(row))
+
+        chromosomes = {}
+        for seqid, genes in rows.items():
+            # of the genes sharing the end (start) coordinate, the one
+            # reported by the former max(end) (min(start)) queries is kept
+            by_end = sorted((g for g in genes if g[2] is not None),
+                            key=lambda g: (g[2], g[4], g[5]))
+            by_start = sorted((g for g in genes if g[1] is not None),
+                              key=lambda g: (g[1], g[2] is not None,
+                                             g[2] or 0, g[5]))
+            ends, end_ids = cls._first_per_coordinate(by_end, 2)
+            starts, start_ids = cls._first_per_coordinate(by_start, 1)
+            chromosomes[seqid] = (ends, end_ids, starts, start_ids)
+        return cls(chromosomes)
+
+    @staticmethod
+    def _first_per_coordinate(genes, column):
+        """Keeps the first gene of each distinct coordinate
+
+        Arguments:
+            genes {list} -- gene rows sorted by the coordinate
+            column {int} -- index of the coordinate in the rows
+
+        Returns:
+            tuple -- array of distinct coordinates, list of gene ids
+        """
+
+        coordinates, ids = [], []
+        for g in genes:
+            if not coordinates or coordinates[-1] != g[column]:
+                coordinates.append(g[column])
+                ids.append(g[3])
+        return np.array(coordinates, dtype=np.int64), ids
+
+    def closest(self, seqid, starts, ends):
+        """Finds the genes closest to intervals from a single chromosome
+
+        Arguments:
+            seqid {str} -- chromosome
+            starts {iterable} -- start coordinates of the intervals
+            ends {iterable} -- end coordinates of the intervals
+
+        Returns:
+            list -- for each interval a tuple of: the largest gene end not\
+                greater than start, id of that gene, the smallest gene start\
+                not smaller than end, id of that gene (None if not found)
+        """
+
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if seqid not in self.chromosomes:
+            return [(None, None, None, None)] * len(starts)
+        gene_ends, end_ids, gene_starts, start_ids = self.chromosomes[seqid]
+        left = np.searchsorted(gene_ends, starts, side="right") - 1
+        right = np.searchsorted(gene_starts, ends, side="left")
+
+        result = []
+        for l, r in zip(left.tolist(), right.tolist()):
+            upstream = ((int(gene_ends[l]), end_ids[l]) if l >= 0
+                        else (None, None))
+            downstream = ((int(gene_starts[r]), start_ids[r])
+                          if r < len(gene_starts) else (None, None))
+            result.append(upstream + downstream)
+        return result
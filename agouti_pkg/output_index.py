@@ -0,0 +1,242 @@
+import os
+import sqlite3
+from agouti_pkg.bgzf import BgzfReader
+
+
+# The index of a BGZF-compressed output is a SQLite file stored next to it.
+# Each input interval is a record pointing to its (possibly multi-line)
+# annotation in the uncompressed output; the block table maps uncompressed
+# offsets to the compressed BGZF blocks, so a query decompresses only the
+# blocks containing the requested records.
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value INTEGER);
+CREATE TABLE blocks (compressed INTEGER, uncompressed INTEGER);
+CREATE TABLE records (seqid TEXT, start INTEGER, end INTEGER, name TEXT,
+                      offset INTEGER, length INTEGER);
+CREATE TABLE seqids (seqid TEXT PRIMARY KEY, max_length INTEGER);
+"""
+_INDEXES = """
+CREATE INDEX records_seqid_start ON records (seqid, start);
+CREATE INDEX records_name ON records (name);
+"""
+
+
+def output_index_path(output):
+    """Returns path of the index stored next to the output file
+
+    Arguments:
+        output {str} -- path of the BGZF-compressed output file
+
+    Returns:
+        str -- path of the index file
+    """
+
+    return "{}.agi".format(output)
+
+
+class OutputIndexWriter(object):
+    """Builds the index of the output while it is written. Offsets are\
+        counted in bytes of the uncompressed output, so every line written\
+        to the output must be passed to skip() or add() in the same order."""
+
+    def __init__(self, output, encoding="utf-8"):
+        """
+        Arguments:
+            output {str} -- path of the BGZF-compressed output file
+
+        Keyword Arguments:
+            encoding {str} -- encoding of the output (default: {"utf-8"})
+        """
+
+        self.path = output_index_path(output)
+        self.encoding = encoding
+        self.offset = 0  # in the uncompressed output
+        self.header_length = None
+        self.max_lengths = {}
+        self._pending = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(_SCHEMA)
+
+    def _length(self, line):
+        """Returns the number of bytes of the line (and the newline)
+        """
+
+        return (len(line) if line.isascii() else
+                len(line.encode(self.encoding))) + 1
+
+    def skip(self, line):
+        """Accounts for a line that is not indexed (e.g. the header)
+
+        Arguments:
+            line {str} -- line written to the output (without the newline)
+        """
+
+        self.offset += self._length(line)
+
+    def add(self, seqid, start, end, name, lines):
+        """Adds a record
+
+        Arguments:
+            seqid {str} -- chromosome (transcript) of the input interval
+            start {int} -- start coordinate (1-based)
+            end {int} -- end coordinate
+            name {str} -- name of the input interval
+            lines {str} -- annotation written to the output (without the\
+                final newline)
+        """
+
+        if self.header_length is None:
+            self.header_length = self.offset
+        start, end = min(start, end), max(start, end)
+        length = self._length(lines)
+        self._pending.append((seqid, start, end, name, self.offset, length))
+        self.offset += length
+        if end - start > self.max_lengths.get(seqid, -1):
+            self.max_lengths[seqid] = end - start
+        if len(self._pending) >= 100000:
+            self.flush()
+
+    def flush(self):
+        """Writes the pending records to the index
+        """
+
+        self.conn.executemany("INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)",
+                              self._pending)
+        self._pending = []
+
+    def close(self, blocks):
+        """Writes the block table and creates the indexes
+
+        Arguments:
+            blocks {list} -- (compressed offset, uncompressed offset) of\
+                each BGZF block of the output (see BgzfWriter.blocks)
+        """
+
+        self.flush()
+        if self.header_length is None:
+            self.header_length = self.offset
+        self.conn.executemany("INSERT INTO blocks VALUES (?, ?)", blocks)
+        self.conn.executemany("INSERT INTO seqids VALUES (?, ?)",
+                              self.max_lengths.items())
+        self.conn.execute("INSERT INTO meta VALUES ('header_length', ?)",
+                          (self.header_length,))
+        self.conn.executescript(_INDEXES)
+        self.conn.commit()
+        self.conn.close()
+
+    def discard(self):
+        """Closes and removes the index, e.g. when the output is incomplete
+        """
+
+        self.conn.close()
+        os.remove(self.path)
+
+
+class IndexedOutput(object):
+    """Random access to the records of an indexed BGZF output"""
+
+    def __init__(self, output):
+        """
+        Arguments:
+            output {str} -- path of the BGZF-compressed output file
+
+        Raises:
+            FileNotFoundError -- the output or its index does not exist
+        """
+
+        path = output_index_path(output)
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.conn = sqlite3.connect("file:{}?mode=ro".format(path), uri=True)
+        self.handle = open(output, "rb")
+        self.reader = BgzfReader(self.handle, self.conn.execute(
+            "SELECT compressed, uncompressed FROM blocks "
+            "ORDER BY uncompressed").fetchall())
+        self.header_length = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'header_length'").fetchone()[0]
+
+    def close(self):
+        self.handle.close()
+        self.conn.close()
+
+    def header(self):
+        """Returns the header lines of the output
+
+        Returns:
+            bytes -- the header
+        """
+
+        return self.reader.read(0, self.header_length)
+
+    def region(self, seqid, start=None, end=None):
+        """Finds records of the input intervals overlapping the region
+
+        Arguments:
+            seqid {str} -- chromosome (transcript)
+
+        Keyword Arguments:
+            start {int} -- start of the region (1-based); None for the\
+                whole chromosome (default: {None})
+            end {int} -- end of the region; None for the whole chromosome\
+                (default: {None})
+
+        Returns:
+            list -- (offset, length) of the records
+        """
+
+        if start is None:
+            return self.conn.execute(
+                "SELECT offset, length FROM records WHERE seqid = ?",
+                (seqid,)).fetchall()
+        row = self.conn.execute("SELECT max_length FROM seqids WHERE seqid = ?",
+                                (seqid,)).fetchone()
+        if row is None:
+            return []
+        # records overlapping the region start at most max_length before it
+        return self.conn.execute(
+            "SELECT offset, length FROM records WHERE seqid = ? AND start >= ? "
+            "AND start <= ? AND end >= ?",
+            (seqid, start - row[0], end, start)).fetchall()
+
+    def has_seqid(self, seqid):
+        """Checks if there are records of input intervals on the chromosome
+
+        Arguments:
+            seqid {str} -- chromosome (transcript)
+
+        Returns:
+            bool -- True if the chromosome is in the index
+        """
+
+        return self.conn.execute("SELECT 1 FROM seqids WHERE seqid = ?",
+                                 (seqid,)).fetchone() is not None
+
+    def name(self, name):
+        """Finds records of the input intervals with the given name
+
+        Arguments:
+            name {str} -- name of the input interval
+
+        Returns:
+            list -- (offset, length) of the records
+        """
+
+        return self.conn.execute(
+            "SELECT offset, length FROM records WHERE name = ?",
+            (name,)).fetchall()
+
+    def read(self, records):
+        """Reads the records from the output, in the order of the file.\
+            Records found more than once are read once.
+
+        Arguments:
+            records {iterable} -- (offset, length) of the records
+
+        Yields:
+            bytes -- annotation of each record
+        """
+
+        for offset, length in sorted(set(records)):
+            yield self.reader.read(offset, length)
@@ -1,15 +1,81 @@
 from agouti_pkg.miscallaneous import *
 
 
-def prepare_output(lengths_dict, header, args, attributes_and_features,
-                   database, processing_product, overlapping_features,
-                   region, cds_start=None):
-    """Prepares a single line of the output file. Parse ProcessingProduct\
-        objects.
+# kinds of AnnotationRecord
+FEATURE = "feature"  # feature overlapping the interval (genomic mode)
+TRANSCRIPT = "transcript"  # transcript of the interval (transcriptomic mode)
+# transcript not reported, e.g. the interval exceeds its boundaries
+# (transcriptomic mode)
+OUTSIDE_TRANSCRIPT = "outside_transcript"
+# transcript not annotated, e.g. on the "-" strand (transcriptomic mode)
+NOT_ANNOTATED = "not_annotated"
+INTERGENIC = "intergenic"  # no overlapping features (genomic mode)
+
+class AnnotationRecord(object):
+    """Annotation of an input interval with a single feature. Each output\
+        line of agouti annotate corresponds to one AnnotationRecord."""
+
+    __slots__ = ("kind", "interval", "feature_id", "gene_id", "featuretype",
+                 "seqid", "start", "end", "values", "relative_location",
+                 "closest_genes")
+
+    def __init__(self, kind, interval, feature_id=None, gene_id=None,
+                 featuretype=None, seqid=None, start=None, end=None,
+                 values=None, relative_location=None, closest_genes=None):
+        """
+        Arguments:
+            kind {str} -- FEATURE, TRANSCRIPT, OUTSIDE_TRANSCRIPT,\
+                NOT_ANNOTATED or INTERGENIC
+            interval {ProcessingProduct} -- the annotated interval
+
+        Keyword Arguments:
+            feature_id {str} -- ID of the feature (genomic mode)\
+                (default: {None})
+            gene_id {str} -- ID of the gene of the feature (--level 2)\
+                (default: {None})
+            featuretype {str} -- type of the feature (default: {None})
+            seqid {str} -- chromosome of the feature (default: {None})
+            start {int} -- start of the feature (default: {None})
+            end {int} -- end of the feature (default: {None})
+            values {dict} -- values of the feature and attribute columns\
+                (header[1] and header[2] of prepare_header) by column name:\
+                "y" if the interval overlaps a feature of the given type\
+                ("NA" if not applicable), attribute values, "." if missing\
+                (default: {None})
+            relative_location {str} -- location of the interval within the\
+                transcript (--annotate_relative_location) (default: {None})
+            closest_genes {tuple} -- upstream gene ID, its distance,\
+                downstream gene ID, its distance (INTERGENIC)\
+                (default: {None})
+        """
+
+        self.kind = kind
+        self.interval = interval
+        self.feature_id = feature_id
+        self.gene_id = gene_id
+        self.featuretype = featuretype
+        self.seqid = seqid
+        self.start = start
+        self.end = end
+        self.values = values
+        self.relative_location = relative_location
+        self.closest_genes = closest_genes
+
+    def __repr__(self):
+        return "<AnnotationRecord {} {} {}>".format(
+            self.kind, self.interval.processing_product,
+            self.feature_id or self.gene_id)
+
+
+def annotation_records(lengths_dict, header, args, attributes_and_features,
+                       database, processing_product, overlapping_features,
+                       region, cds_start=None, relative_location=None):
+    """Annotates a single ProcessingProduct with the overlapping features\
+        that meet criteria specified by user
 
     Arguments:
         lengths_dict {dict} -- 5'UTR length, CDS length, 3'UTR length
-        header {str} -- header
+        header {tuple} -- header (see prepare_header)
         args {argparse.Namespace} -- argparse command-line arguments
         attributes_and_features {dict} -- dictionary of attributes and\
             features that need to be annotated
@@ -21,184 +87,295 @@ def prepare_output(lengths_dict, header, args, attributes_and_features,
 
     Keyword Arguments:
         cds_start {int} -- start of cds coordinate (default: {None})
+        relative_location {str} -- localization within the overlapping\
+            transcript computed beforehand, see\
+            IntervalBatch.relative_locations (default: {None})
 
     Returns:
-        str -- single output line
+        list -- AnnotationRecord objects; a single record if no feature is\
+            reported. closest_genes of an INTERGENIC record is filled by\
+            add_closest_genes
     """
 
-    out = ""
+    records = []
+    # the last feature not reported in the transcriptomic mode
+    not_reported = None
+
+    for feature in overlapping_features:
+        not_reported = None
+
+        if ((feature.strand != processing_product.strand) and
+           args.strand_specific and not args.transcriptomic) or (args.transcriptomic and processing_product.strand == "-"):
+            continue
+
+        if (feature.featuretype not in attributes_and_features.keys()):
+            continue
 
-    if len(overlapping_features):  # if there are overlapping features
+        if not args.transcriptomic:
 
-        for feature in overlapping_features:
-            temp_out = "."
-            temp_result = ""
-            temp_featuretype="."
-            temp_seqid="."
-            temp_overlapping_feature_start="."
-            temp_overlapping_feature_end="."
+            if ((args.completly_within and not completly_within(
+                    region[1], region[2], feature)) or not
+                    database.feature_level(feature) ==
+                    args.level):
+                continue
+
+            gene_id = None
+            if args.level == 2:
+                gene_id = get_level1_parent(database, feature, id=True)
+            values = overlapping_feature_values(attributes_and_features,
+                                                args, database, feature,
+                                                processing_product,
+                                                header[1], header[2])
+            records.append(AnnotationRecord(
+                FEATURE, processing_product, feature.id, gene_id,
+                feature.featuretype, feature.seqid, feature.start,
+                feature.end, values))
 
-            if ((feature.strand != processing_product.strand) and
-               args.strand_specific and not args.transcriptomic) or (args.transcriptomic and processing_product.strand == "-"):
+        else:
+            comp_pos = completly_within_positive_coordinates  # abbr
+            temp = comp_pos(lengths_dict, feature, processing_product,
+                            cds_start)
+
+            if (not database.feature_level(feature) ==
+                args.level or (args.completly_within and
+                processing_product.coords_outside_transcript ==
+                "just_one") or processing_product.coords_outside_transcript ==
+                "both") or (args.completly_within and temp[0] ==
+                "just_one") or temp == "both":
+                if args.level == 2:
+                    analyzed_set = set(attributes_and_features[feature.featuretype]).intersection(feature.attributes)
+                    d = {}
+                    for attr in analyzed_set:
+                        if attr in header[2]:
+                            d[attr] = ("").join(feature[attr]).strip()
+                    not_reported = (
+                        get_level1_parent(database, feature, id=True),
+                        feature.featuretype, feature.seqid, feature.start,
+                        feature.end,
+                        {h: d.get(h, ".") for h in (header[1] + header[2])})
                 continue
 
-            if (feature.featuretype in attributes_and_features.keys()):
-
-                if not args.transcriptomic:
-
-                    if ((args.completly_within and not completly_within(
-                            region[1], region[2], feature)) or not
-                            infer_feature_level(feature, database) ==
-                            args.level):
-                        continue
-
-                    if args.level == 2:
-                        gene_id = "{}\t".format((get_level1_parent(database,
-                                                                   feature,
-                                                                   id=True)))
-                        out += "{bed}\t{featureid}\t{gene_id}\t{featuretype}\t\
-                            {overlapping_feature_start}\t\
-                            {overlapping_feature_end}\
-                            ".format(bed=processing_product.bed_line.strip(),
-                                     featureid=feature.id.strip(),
-                                     gene_id=gene_id.strip(),
-                                     featuretype=feature.featuretype.strip(),
-                                     overlapping_feature_start=feature.start,
-                                     overlapping_feature_end=feature.end)
-                    else:
-                        gene_id = ""
-                        out += "{bed}\t{featureid}\t{featuretype}\t\
-                                {overlapping_feature_start}\t\
-                                {overlapping_feature_end}\
-                                ".format(bed=processing_product.bed_line.strip(),
-                                        featureid=feature.id.strip(),
-                                        featuretype=feature.featuretype.strip(),
-                                        overlapping_feature_start=feature.start,
-                                        overlapping_feature_end=feature.end)
-
-                    
-                    out += "\t{}\n".format(
-                        filter_overlapping_features(attributes_and_features,
-                                                    args, database, feature,
-                                                    overlapping_features,
-                                                    header[1], header[2]))
-
-
-                else:
-                    comp_pos = completly_within_positive_coordinates  # abbr
-                    temp = comp_pos(lengths_dict, feature, processing_product,
-                                    cds_start)
-
-                    if (not infer_feature_level(feature, database) ==
-                        args.level or (args.completly_within and
-                        processing_product.coords_outside_transcript ==
-                        "just_one") or processing_product.coords_outside_transcript ==
-                        "both") or (args.completly_within and temp[0] ==
-                        "just_one") or temp == "both":
-                        if args.level == 2:
-                            temp_out = get_level1_parent(database, feature, id=True)
-                            temp_featuretype=feature.featuretype
-                            temp_seqid=feature.seqid
-                            temp_overlapping_feature_start=feature.start
-                            temp_overlapping_feature_end=feature.end
-                            analyzed_set = set(attributes_and_features[feature.featuretype]).intersection(feature.attributes)
-                            d = {}
-                            for a in header[2]:
-                                for attr in analyzed_set:
-                                    if attr == a:
-                                        d[attr] = ("").join(feature[attr])
-                                # concatenation
-                                temp_result = ""
-
-                            for h in (header[1] + header[2]):
-                                try:
-                                    temp_result += "{}\t".format(d[h].strip())
-                                except KeyError:
-                                    temp_result += "{}\t".format(".")
-                        continue
-
-                    if args.level == 2:
-                        gene_id = get_level1_parent(database, feature, id=True)
-                    else:
-                        gene_id = ""
-
-                    out += "{bed}\t{gene_id}\t{featuretype}\t{seqid}\t\
-                            {overlapping_feature_start}\t\
-                            {overlapping_feature_end}\
-                            ".format(bed=processing_product.bed_line.strip(),
-                                     featuretype=feature.featuretype.strip(),
-                                     gene_id=gene_id, seqid=feature.seqid.strip(),
-                                     overlapping_feature_start=feature.start,
-                                     overlapping_feature_end=feature.end)
-
-                    filt_ov = filter_overlapping_features  # abbr
-                    out += "\t{}\n".format(filt_ov(attributes_and_features,
-                                                   args, database, feature, [],
-                                                   header[1], header[2],
-                                                   processing_product, region))
-
-                    insert = processing_product.check_overlapping_feature__position(lengths_dict,
-                                                                                    feature,
-                                                                                    args.transcriptomic,
-                                                                                    args.offset)
-
-                    if (args.annotate_relative_location):
-                        out = out.rstrip()
-                        out += "\t{}\n".format(insert)
-
-    if (out == ""):
-
-        additional_fields = ""
-
-        header_lengths = (len(header[1]) + len(header[2])) if not (
-            args.annotate_relative_location) else (len(header[1]) +
-                                                len(header[2]) + 1)
-
-        if (args.transcriptomic):
-
-            feature = database.database[processing_product.coordinates[0]]
-            out += "{bed}\t{gene_id}\t{featuretype}\t{seqid}\t\
-                    {overlapping_feature_start}\t{overlapping_feature_end}\
-                    ".format(bed=processing_product.bed_line.strip(),
-                            featuretype=temp_featuretype, gene_id=temp_out, seqid=temp_seqid,
-                            overlapping_feature_start=temp_overlapping_feature_start,
-                            overlapping_feature_end=temp_overlapping_feature_end)
-
-            
-            if args.level != 2 or ((feature.strand != processing_product.strand) and
-               args.strand_specific and not args.transcriptomic) or (args.transcriptomic and processing_product.strand == "-"):
-                out += "\t{}".format(".\t.\t.")
-                for _ in range(0, len(header[2])):
-                    out += "\t."
-
-                out += "\n"
+            gene_id = None
+            if args.level == 2:
+                gene_id = get_level1_parent(database, feature, id=True)
+            values = overlapping_feature_values(attributes_and_features,
+                                                args, database, feature,
+                                                processing_product,
+                                                header[1], header[2], region)
+            location = None
+            if (args.annotate_relative_location):
+                location = relative_location
+                if location is None:
+                    location = processing_product.check_overlapping_feature__position(lengths_dict,
+                                                                                        feature,
+                                                                                        args.transcriptomic,
+                                                                                        args.offset)
+            records.append(AnnotationRecord(
+                TRANSCRIPT, processing_product, feature.id, gene_id,
+                feature.featuretype, feature.seqid, feature.start,
+                feature.end, values, location))
+
+    if len(records):
+        return records
+
+    if (args.transcriptomic):
+
+        feature = database.get_feature(processing_product.coordinates[0])
+        if args.level != 2 or ((feature.strand != processing_product.strand) and
+           args.strand_specific and not args.transcriptomic) or (args.transcriptomic and processing_product.strand == "-"):
+            kind = NOT_ANNOTATED
+        else:
+            kind = OUTSIDE_TRANSCRIPT
+
+        record = AnnotationRecord(kind, processing_product)
+        if not_reported is not None:
+            (record.gene_id, record.featuretype, record.seqid, record.start,
+             record.end, values) = not_reported
+            if kind == OUTSIDE_TRANSCRIPT:
+                record.values = values
+            if (args.annotate_relative_location):
+                if relative_location is None:
+                    relative_location = processing_product.check_overlapping_feature__position(lengths_dict, feature,
+                                                                                               args.transcriptomic, args.offset)
+                record.relative_location = relative_location
+        return [record]
+
+    # the closest genes are found later for many intervals at once (see
+    # add_closest_genes)
+    return [AnnotationRecord(INTERGENIC, processing_product)]
+
+
+def add_closest_genes(database, records):
+    """Finds the closest genes of all intergenic records at once (see\
+        batch_closest_genes)
+
+    Arguments:
+        database {Database} -- Database
+        records {list} -- lists of AnnotationRecord objects (see\
+            annotation_records); None items are skipped
+    """
+
+    intergenic = [record for product_records in records
+                  if product_records is not None
+                  for record in product_records if record.kind == INTERGENIC]
+    genes = batch_closest_genes(database,
+                                [record.interval for record in intergenic])
+    for record, closest in zip(intergenic, genes):
+        record.closest_genes = closest
+
+
+def _joined_values(values, header):
+    """Joins values of the feature and attribute columns
+    """
+
+    return "".join("{}\t".format(values[h]) for h in (header[1] + header[2]))
+
+
+def format_records(records, header, args):
+    """Formats AnnotationRecord objects of a single ProcessingProduct as\
+        lines of the output file
+
+    Arguments:
+        records {list} -- AnnotationRecord objects (see annotation_records)
+        header {tuple} -- header (see prepare_header)
+        args {argparse.Namespace} -- argparse command-line arguments
+
+    Returns:
+        str -- output lines
+    """
+
+    return "\n".join("{}\t{}".format(bed, "\t".join(fields)) for bed, fields
+                     in record_fields(records, header, args))
+
+
+def _stripped_fields(fields, leading=True):
+    """Returns the fields as they are split after joining them with tabs and\
+        stripping the whitespace (str.strip, or str.rstrip if leading is\
+        False)
+    """
+
+    fields = list(fields)
+    if leading:
+        while len(fields) > 1 and not fields[0].strip():
+            fields.pop(0)
+        fields[0] = fields[0].lstrip()
+    while len(fields) > 1 and not fields[-1].strip():
+        fields.pop()
+    fields[-1] = fields[-1].rstrip()
+    return fields
+
+
+def record_fields(records, header, args):
+    """Splits AnnotationRecord objects of a single ProcessingProduct into the\
+        columns of the output lines. This is the layout of the output:\
+        format_records joins the columns, while the statistics are counted\
+        from them without building the lines (see\
+        StatisticsAccumulator.add_fields).
+
+    Arguments:
+        records {list} -- AnnotationRecord objects (see annotation_records)
+        header {tuple} -- header (see prepare_header)
+        args {argparse.Namespace} -- argparse command-line arguments
+
+    Yields:
+        tuple -- input line, list of the following columns of the output\
+            line
+    """
+
+    # The spaces around the coordinates and the whitespace stripped from the
+    # lines come from the line continuations of the original format strings
+    # and are kept, so that the output does not change.
+    columns = header[1] + header[2]
+    for n, record in enumerate(records, 1):
+        bed = record.interval.bed_line.strip()
+
+        if record.kind == FEATURE:
+            if args.level == 2:
+                fields = [record.feature_id.strip(),
+                          str(record.gene_id).strip(),
+                          record.featuretype.strip(),
+                          " " * 28 + str(record.start),
+                          " " * 28 + str(record.end) + " " * 28]
+            else:
+                fields = [record.feature_id.strip(),
+                          record.featuretype.strip(),
+                          " " * 32 + str(record.start),
+                          " " * 32 + str(record.end) + " " * 32]
+            fields += _stripped_fields(str(record.values[h])
+                                       for h in columns)
+
+        elif record.kind == TRANSCRIPT:
+            fields = ["" if record.gene_id is None else str(record.gene_id),
+                      record.featuretype.strip(), record.seqid.strip(),
+                      " " * 28 + str(record.start),
+                      " " * 28 + str(record.end) + " " * 28]
+            fields += _stripped_fields(str(record.values[h])
+                                       for h in columns)
+            if (args.annotate_relative_location):
+                fields = _stripped_fields(fields, leading=False)
+                fields.append(str(record.relative_location))
+
+        elif record.kind in (OUTSIDE_TRANSCRIPT, NOT_ANNOTATED):
+            missing = lambda value: "." if value is None else str(value)
+            fields = [missing(record.gene_id), missing(record.featuretype),
+                      missing(record.seqid),
+                      " " * 20 + missing(record.start),
+                      missing(record.end) + " " * 20]
+            if record.kind == NOT_ANNOTATED:
+                fields += ["."] * (3 + len(header[2]))
+            elif record.values is None:
+                fields.append("")
             else:
-                out += "\t{}\n".format(temp_result)
+                fields += [str(record.values[h]) for h in columns] + [""]
 
             if (args.annotate_relative_location):
-                out = out.rstrip()
-                if not temp_featuretype == ".":
-                    out += "\t{}\n".format(
-                    processing_product.check_overlapping_feature__position(lengths_dict, feature,
-                                                                           args.transcriptomic, args.offset))
+                fields = _stripped_fields(fields, leading=False)
+                if record.featuretype is not None:
+                    fields.append(str(record.relative_location))
 
         else:
+            header_lengths = len(columns) + (
+                1 if args.annotate_relative_location else 0)
+            fields = [format_closest_genes(record.closest_genes),
+                      "intergenic", ".", " " * 20 + ".", "." + " " * 20]
+            fields += ["."] * max(0, header_lengths - 1)
 
-            for _ in range(1, header_lengths):
-                additional_fields += "\t."
+        if n == len(records):
+            fields = _stripped_fields(fields, leading=False)
+        yield bed, fields
 
-            closest_gene = find_closest_gene(database, processing_product)
-            find_closest_gene(database, processing_product)
 
-            out += "{bed}\t{featureid}\t{gene_id}\t{featuretype}\t\
-                    {overlapping_feature_start}\t{overlapping_feature_end}\
-                    {add}".format(bed=processing_product.bed_line.strip(),
-                                  featureid=closest_gene, featuretype=".",
-                                  gene_id="intergenic",
-                                  overlapping_feature_start=".",
-                                  overlapping_feature_end=".",
-                                  add=additional_fields)
+def prepare_output(lengths_dict, header, args, attributes_and_features,
+                   database, processing_product, overlapping_features,
+                   region, cds_start=None, relative_location=None):
+    """Prepares a single line of the output file. Parse ProcessingProduct\
+        objects.
 
-    return out.strip()
+    Arguments:
+        lengths_dict {dict} -- 5'UTR length, CDS length, 3'UTR length
+        header {str} -- header
+        args {argparse.Namespace} -- argparse command-line arguments
+        attributes_and_features {dict} -- dictionary of attributes and\
+            features that need to be annotated
+        database {Database} -- Database
+        processing_product {ProcessingProduct} -- object of ProcessingProduct
+            class
+        overlapping_features {list} -- list of overlapping features
+        region {tuple} -- coordinates
+
+    Keyword Arguments:
+        cds_start {int} -- start of cds coordinate (default: {None})
+        relative_location {str} -- localization within the overlapping\
+            transcript computed beforehand, see\
+            IntervalBatch.relative_locations (default: {None})
 
+    Returns:
+        str -- single output line
+    """
 
+    records = annotation_records(
+        lengths_dict, header, args, attributes_and_features, database,
+        processing_product, overlapping_features, region, cds_start,
+        relative_location)
+    add_closest_genes(database, [records])
+    return format_records(records, header, args)
@@ -0,0 +1,120 @@
+import sys
+import threading
+import queue
+
+
+DEFAULT_BUFFER_SIZE = 1 << 20  # characters kept in memory before flushing
+MAX_PENDING_CHUNKS = 8  # chunks queued for the background writer thread
+
+
+class OutputWriter(object):
+    """Buffered sink for the annotation output. Text is accumulated in\
+        memory up to 'buffer_size' characters and then written to the\
+        output stream in a single call. Optionally, the actual writes are\
+        done by a background thread, so that formatting of the next\
+        intervals overlaps with the I/O."""
+
+    def __init__(self, handle=None, buffer_size=DEFAULT_BUFFER_SIZE,
+                 threaded=False):
+        """
+        Keyword Arguments:
+            handle {file} -- output stream (default: {sys.stdout})
+            buffer_size {int} -- size of the buffer in characters\
+                (default: {DEFAULT_BUFFER_SIZE})
+            threaded {bool} -- write chunks in a background thread\
+                (default: {False})
+        """
+
+        self.handle = handle if handle is not None else sys.stdout
+        self.buffer_size = max(1, buffer_size)
+        self._buffer = []
+        self._buffered = 0
+        self._error = None
+        self._queue = None
+        self._thread = None
+        if threaded:
+            # bounded queue -> the producer waits if the writer falls behind
+            self._queue = queue.Queue(maxsize=MAX_PENDING_CHUNKS)
+            self._thread = threading.Thread(target=self._write_chunks,
+                                            daemon=True)
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_chunks(self):
+        """Body of the background writer thread
+        """
+
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            if self._error is None:
+                try:
+                    self.handle.write(chunk)
+                except Exception as e:  # re-raised in the main thread
+                    self._error = e
+
+    def _emit(self, chunk):
+        """Passes a chunk of text to the output stream or to the writer thread
+
+        Arguments:
+            chunk {str} -- text to be written
+        """
+
+        if self._queue is None:
+            self.handle.write(chunk)
+        else:
+            if self._error is not None:
+                raise self._error
+            self._queue.put(chunk)
+
+    def write(self, text):
+        """Appends text to the buffer. The buffer is flushed once it exceeds\
+            the buffer size.
+
+        Arguments:
+            text {str} -- text to be written
+        """
+
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def write_line(self, line):
+        """Appends a single line (newline character is added) to the buffer
+
+        Arguments:
+            line {str} -- line to be written
+        """
+
+        self.write(f"{line}\n")
+
+    def flush(self):
+        """Writes the buffered text
+        """
+
+        if self._buffer:
+            chunk = "".join(self._buffer)
+            self._buffer = []
+            self._buffered = 0
+            self._emit(chunk)
+
+    def close(self):
+        """Flushes the buffer, waits for the writer thread and flushes the\
+            output stream. The output stream itself is not closed.
+        """
+
+        self.flush()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            if self._error is not None:
+                raise self._error
+        self.handle.flush()
@@ -0,0 +1,456 @@
+import os
+import shutil
+import numpy as np
+from agouti_pkg.gffutils import constants
+from agouti_pkg.database import (FEATURE_LEVELS_SQL, features_fingerprint,
+                                 index_path)
+
+
+# Features are split into classes by length. Within a class, a feature
+# overlapping [start, end) must start after (start - longest feature in the
+# class), so a query is a pair of binary searches per class. Without the
+# split, a single chromosome-long feature would turn every query into a scan
+# of the whole chromosome.
+LENGTH_CLASSES = np.array([1 << 10, 1 << 14, 1 << 18, 1 << 22], dtype=np.int64)
+NUM_LENGTH_CLASSES = len(LENGTH_CLASSES) + 1
+FETCH_CHUNK = 500  # rowids per SELECT ... WHERE rowid IN (...) query
+MAX_CACHED_FEATURES = 100000
+# arrays stored in the sidecar directory written by create_db
+_NAME_ARRAYS = ("seqids", "featuretypes", "strands")
+_ARRAYS = ("starts", "ends", "rowids", "featuretype_codes", "strand_codes",
+           "levels", "bounds", "max_lengths")
+
+
+class OverlapIndex(object):
+    """In-memory overlap index of the features table. Coordinates are stored\
+        in NumPy arrays sorted by (chromosome, length class, start), which\
+        allows to find overlapping features without querying the database.\
+        Only feature row ids are kept; Feature objects are fetched (and\
+        cached) for the overlapping features only."""
+
+    def __init__(self, seqids, featuretypes, strands, starts, ends, rowids,
+                 featuretype_codes, strand_codes, levels, bounds, max_lengths):
+        """
+        Arguments:
+            seqids {list} -- chromosome names; position is the chromosome code
+            featuretypes {list} -- feature types; position is the code
+            strands {list} -- strands; position is the strand code
+            starts {numpy.ndarray} -- start coordinates
+            ends {numpy.ndarray} -- end coordinates
+            rowids {numpy.ndarray} -- row ids in the features table
+            featuretype_codes {numpy.ndarray} -- feature type codes
+            strand_codes {numpy.ndarray} -- strand codes
+            levels {numpy.ndarray} -- feature levels
+            bounds {numpy.ndarray} -- array of shape (chromosomes,\
+                NUM_LENGTH_CLASSES + 1) with the offsets of each length class
+            max_lengths {numpy.ndarray} -- the longest feature in each\
+                chromosome and length class
+        """
+
+        self.seqids = list(seqids)
+        self.featuretypes = list(featuretypes)
+        self.strands = list(strands)
+        self.starts = starts
+        self.ends = ends
+        self.rowids = rowids
+        self.featuretype_codes = featuretype_codes
+        self.strand_codes = strand_codes
+        self.levels = levels
+        self.bounds = bounds
+        self.max_lengths = max_lengths
+        self._seqid_code = {s: i for i, s in enumerate(self.seqids)}
+        self._strand_code = {s: i for i, s in enumerate(self.strands)}
+        self._features = {}
+
+    @classmethod
+    def from_database(cls, db, featuretypes=None):
+        """Builds the index from the features table
+
+        Arguments:
+            db {Database} -- object of the Database class
+
+        Keyword Arguments:
+            featuretypes {iterable} -- index only these feature types, all\
+                if None (default: {None})
+
+        Returns:
+            OverlapIndex -- the index
+        """
+
+        if db.has_feature_levels:
+            levels = "feature_levels"
+        else:
+            levels = "({})".format(FEATURE_LEVELS_SQL.format(where=""))
+        query = ("SELECT features.rowid, seqid, start, end, strand, "
+                 "featuretype, levels.level FROM features LEFT JOIN {} AS "
+                 "levels ON levels.id = features.id WHERE start IS NOT NULL "
+                 "AND end IS NOT NULL".format(levels))
+        params = []
+        if featuretypes is not None:
+            featuretypes = list(featuretypes)
+            query += " AND featuretype IN ({})".format(
+                ", ".join("?" for _ in featuretypes))
+            params = featuretypes
+
+        codes = ({}, {}, {})  # seqid, featuretype and strand codes
+        columns = ([], [], [], [], [], [], [])
+        for row in db.database.conn.execute(query, params):
+            rowid, seqid, start, end, strand, featuretype, level = tuple(row)
+            columns[0].append(rowid)
+            columns[1].append(codes[0].setdefault(seqid, len(codes[0])))
+            columns[2].append(start)
+            columns[3].append(end)
+            columns[4].append(codes[2].setdefault(strand, len(codes[2])))
+            columns[5].append(codes[1].setdefault(featuretype,
+                                                  len(codes[1])))
+            columns[6].append(level)
+
+        return cls.from_arrays(list(codes[0]), list(codes[1]),
+                               list(codes[2]),
+                               np.array(columns[1], dtype=np.int32),
+                               np.array(columns[2], dtype=np.int64),
+                               np.array(columns[3], dtype=np.int64),
+                               np.array(columns[0], dtype=np.int64),
+                               np.array(columns[5], dtype=np.int16),
+                               np.array(columns[4], dtype=np.int8),
+                               np.array(columns[6], dtype=np.int8))
+
+    @classmethod
+    def from_arrays(cls, seqids, featuretypes, strands, seqid_codes, starts,
+                    ends, rowids, featuretype_codes, strand_codes, levels):
+        """Sorts the feature arrays and builds the index
+
+        Arguments:
+            seqids {list} -- chromosome names; position is the chromosome code
+            featuretypes {list} -- feature types; position is the code
+            strands {list} -- strands; position is the strand code
+            seqid_codes {numpy.ndarray} -- chromosome codes
+            starts {numpy.ndarray} -- start coordinates
+            ends {numpy.ndarray} -- end coordinates
+            rowids {numpy.ndarray} -- row ids in the features table
+            featuretype_codes {numpy.ndarray} -- feature type codes
+            strand_codes {numpy.ndarray} -- strand codes
+            levels {numpy.ndarray} -- feature levels
+
+        Returns:
+            OverlapIndex -- the index
+        """
+
+        lengths = ends - starts
+        classes = np.searchsorted(LENGTH_CLASSES, lengths, side="right")
+        order = np.lexsort((rowids, ends, starts, classes, seqid_codes))
+        bins = (seqid_codes.astype(np.int64) * NUM_LENGTH_CLASSES +
+                classes)[order]
+
+        num_bins = len(seqids) * NUM_LENGTH_CLASSES
+        edges = np.searchsorted(bins, np.arange(num_bins + 1), side="left")
+        bounds = np.empty((len(seqids), NUM_LENGTH_CLASSES + 1),
+                          dtype=np.int64)
+        bounds[:, :-1] = edges[:-1].reshape(len(seqids), NUM_LENGTH_CLASSES)
+        bounds[:, -1] = edges[NUM_LENGTH_CLASSES::NUM_LENGTH_CLASSES]
+
+        max_lengths = np.zeros(num_bins, dtype=np.int64)
+        if len(order):
+            np.maximum.at(max_lengths, bins, lengths[order])
+        max_lengths = max_lengths.reshape(len(seqids), NUM_LENGTH_CLASSES)
+
+        return cls(seqids, featuretypes, strands, starts[order], ends[order],
+                   rowids[order], featuretype_codes[order],
+                   strand_codes[order], levels[order], bounds, max_lengths)
+
+    def save(self, path, fingerprint):
+        """Writes the index as a directory of .npy files, which can be\
+            memory-mapped by load()
+
+        Arguments:
+            path {str} -- path of the index directory
+            fingerprint {tuple} -- fingerprint of the features table (see\
+                database.create_features_fingerprint), used to detect a\
+                stale index
+        """
+
+        tmp = "{}.tmp".format(path)
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in _NAME_ARRAYS:
+            np.save(os.path.join(tmp, "{}.npy".format(name)),
+                    np.array(getattr(self, name), dtype=str))
+        for name in _ARRAYS:
+            np.save(os.path.join(tmp, "{}.npy".format(name)),
+                    getattr(self, name))
+        np.save(os.path.join(tmp, "fingerprint.npy"),
+                np.array(fingerprint, dtype=np.int64))
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """Reads the index written by save(). Coordinate arrays are\
+            memory-mapped, so the index is not copied into memory and is\
+            shared between the processes using the same database.
+
+        Arguments:
+            path {str} -- path of the index directory
+
+        Keyword Arguments:
+            mmap_mode {str} -- see numpy.load (default: {"r"})
+
+        Returns:
+            tuple -- OverlapIndex, fingerprint of the features table at the\
+                time the index was written
+        """
+
+        def array(name, mmap=None):
+            return np.load(os.path.join(path, "{}.npy".format(name)),
+                           mmap_mode=mmap)
+
+        names = [array(name).tolist() for name in _NAME_ARRAYS]
+        arrays = [array(name, mmap_mode) for name in _ARRAYS]
+        return cls(*(names + arrays)), tuple(array("fingerprint").tolist())
+
+    def featuretype_mask(self, featuretypes):
+        """Lookup table of the feature type codes to be reported
+
+        Arguments:
+            featuretypes {iterable} -- feature types to be reported
+
+        Returns:
+            numpy.ndarray -- boolean array indexed with feature type codes
+        """
+
+        wanted = set(featuretypes)
+        return np.array([f in wanted for f in self.featuretypes] + [False],
+                        dtype=bool)
+
+    def query(self, seqid, start, end, strand=None, featuretype_mask=None,
+              level=None):
+        """Finds features overlapping a single interval. Same overlap\
+            criteria as in FeatureDB.region() with completely_within=False\
+            (feature start < end and feature end > start).
+
+        Arguments:
+            seqid {str} -- chromosome
+            start {int} -- start coordinate
+            end {int} -- end coordinate
+
+        Keyword Arguments:
+            strand {str} -- report only features on this strand\
+                (default: {None})
+            featuretype_mask {numpy.ndarray} -- see featuretype_mask()\
+                (default: {None})
+            level {int} -- report only features at this level\
+                (default: {None})
+
+        Returns:
+            numpy.ndarray -- positions of the overlapping features in the\
+                index, ordered by start, end and row id
+        """
+
+        code = self._seqid_code.get(seqid)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        bounds, max_lengths = self.bounds[code], self.max_lengths[code]
+        found = []
+        for k in range(NUM_LENGTH_CLASSES):
+            lo, hi = bounds[k], bounds[k + 1]
+            if lo == hi:
+                continue
+            starts = self.starts[lo:hi]
+            first = lo + np.searchsorted(starts, start - max_lengths[k],
+                                         side="right")
+            last = lo + np.searchsorted(starts, end, side="left")
+            if first >= last:
+                continue
+            hits = np.arange(first, last)
+            found.append(hits[self.ends[first:last] > start])
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        hits = np.concatenate(found) if len(found) > 1 else found[0]
+
+        if strand is not None:
+            strand_code = self._strand_code.get(strand)
+            if strand_code is None:
+                return np.empty(0, dtype=np.int64)
+            hits = hits[self.strand_codes[hits] == strand_code]
+        if featuretype_mask is not None:
+            hits = hits[featuretype_mask[self.featuretype_codes[hits]]]
+        if level is not None:
+            hits = hits[self.levels[hits] == level]
+        if len(found) > 1:
+            hits = hits[np.lexsort((self.rowids[hits], self.ends[hits],
+                                    self.starts[hits]))]
+        return hits
+
+    def fetch_features(self, db, rowids):
+        """Returns Feature objects for the given row ids. Features are cached\
+            between the calls.
+
+        Arguments:
+            db {Database} -- object of the Database class
+            rowids {iterable} -- row ids in the features table
+
+        Returns:
+            dict -- row id (key), Feature object (value)
+        """
+
+        rowids = set(rowids)
+        missing = [r for r in rowids if r not in self._features]
+        if len(self._features) + len(missing) > MAX_CACHED_FEATURES:
+            self._features = {}
+            missing = list(rowids)
+        for i in range(0, len(missing), FETCH_CHUNK):
+            chunk = missing[i:i + FETCH_CHUNK]
+            query = "{} WHERE features.rowid IN ({})".format(
+                constants._SELECT, ", ".join("?" for _ in chunk))
+            for row in db.database.conn.execute(query, chunk):
+                self._features[row["file_order"]] = \
+                    db.database._feature_returner(**row)
+        return self._features
+
+    def query_batch(self, batch, strand_specific=False,
+                    featuretype_mask=None, level=None):
+        """Finds features overlapping each interval of the batch. Same\
+            results as query() called for each interval, but the binary\
+            searches are done for all intervals from a chromosome at once.
+
+        Arguments:
+            batch {IntervalBatch} -- input intervals
+
+        Keyword Arguments:
+            strand_specific {bool} -- report only features on the same\
+                strand (default: {False})
+            featuretype_mask {numpy.ndarray} -- see featuretype_mask()\
+                (default: {None})
+            level {int} -- report only features at this level\
+                (default: {None})
+
+        Returns:
+            list -- for each interval, numpy.ndarray of positions of the\
+                overlapping features in the index, ordered by start, end\
+                and row id
+        """
+
+        owners, found = [], []
+        for batch_code, seqid in enumerate(batch.seqids):
+            code = self._seqid_code.get(seqid)
+            if code is None:
+                continue
+            members = np.flatnonzero(batch.seqid_codes == batch_code)
+            if not len(members):
+                continue
+            starts, ends = batch.starts[members], batch.ends[members]
+            bounds, max_lengths = self.bounds[code], self.max_lengths[code]
+            for k in range(NUM_LENGTH_CLASSES):
+                lo, hi = bounds[k], bounds[k + 1]
+                if lo == hi:
+                    continue
+                class_starts = self.starts[lo:hi]
+                first = lo + np.searchsorted(class_starts,
+                                             starts - max_lengths[k],
+                                             side="right")
+                last = lo + np.searchsorted(class_starts, ends, side="left")
+                counts = np.maximum(last - first, 0)
+                total = int(counts.sum())
+                if not total:
+                    continue
+                # positions first, first + 1, ..., last - 1 of each interval
+                shifts = first - (np.cumsum(counts) - counts)
+                hits = np.arange(total) + np.repeat(shifts, counts)
+                keep = self.ends[hits] > np.repeat(starts, counts)
+                owners.append(np.repeat(members, counts)[keep])
+                found.append(hits[keep])
+
+        empty = np.empty(0, dtype=np.int64)
+        if not found:
+            return [empty] * len(batch)
+        owners, hits = np.concatenate(owners), np.concatenate(found)
+
+        keep = np.ones(len(hits), dtype=bool)
+        if strand_specific:
+            # strand codes of the index; -1 for strands absent from the index
+            strand_codes = np.array([self._strand_code.get(s, -1)
+                                     for s in batch.strands], dtype=np.int64)
+            keep &= (self.strand_codes[hits] ==
+                     strand_codes[batch.strand_codes[owners]])
+        if featuretype_mask is not None:
+            keep &= featuretype_mask[self.featuretype_codes[hits]]
+        if level is not None:
+            keep &= self.levels[hits] == level
+        owners, hits = owners[keep], hits[keep]
+
+        order = np.lexsort((self.rowids[hits], self.ends[hits],
+                            self.starts[hits], owners))
+        owners, hits = owners[order], hits[order]
+        edges = np.searchsorted(owners, np.arange(len(batch) + 1)).tolist()
+        return [hits[edges[i]:edges[i + 1]] for i in range(len(batch))]
+
+    def overlaps(self, db, batch, featuretypes, strand_specific=False,
+                 level=None, chunk_size=1000):
+        """Finds features overlapping each interval of the batch
+
+        Arguments:
+            db {Database} -- object of the Database class
+            batch {IntervalBatch} -- input intervals
+            featuretypes {list} -- feature types to be reported
+
+        Keyword Arguments:
+            strand_specific {bool} -- report only features on the same\
+                strand (default: {False})
+            level {int} -- report only features at this level\
+                (default: {None})
+            chunk_size {int} -- number of intervals for which Feature\
+                objects are fetched together (default: {1000})
+
+        Yields:
+            tuple -- ProcessingProduct, list of overlapping features; in the\
+                order of the batch
+        """
+
+        hits = self.query_batch(batch, strand_specific,
+                                self.featuretype_mask(featuretypes), level)
+        products = iter(batch)
+        for i in range(0, len(hits), chunk_size):
+            chunk = [self.rowids[h] for h in hits[i:i + chunk_size]]
+            features = self.fetch_features(
+                db, (int(r) for rowids in chunk for r in rowids))
+            for rowids in chunk:
+                yield next(products), [features[int(r)] for r in rowids]
+
+
+def write_index(db, database):
+    """Builds the overlap index of all features and stores it next to the\
+        database file, with the fingerprint stored in the database
+
+    Arguments:
+        db {Database} -- object of the Database class
+        database {str} -- path of the database file
+    """
+
+    OverlapIndex.from_database(db).save(
+        index_path(database), features_fingerprint(db.database.conn))
+
+
+def load_index(db, featuretypes):
+    """Returns the overlap index for the database. The index written by\
+        create_db is memory-mapped if present and written for this build of\
+        the database (the fingerprints stored in the database and in the\
+        index are equal), otherwise the index of the requested feature types\
+        is built in memory.
+
+    Arguments:
+        db {Database} -- object of the Database class
+        featuretypes {list} -- feature types to be reported
+
+    Returns:
+        OverlapIndex -- the index
+    """
+
+    path = index_path(db.name)
+    if os.path.isdir(path):
+        try:
+            index, fingerprint = OverlapIndex.load(path)
+            if fingerprint == features_fingerprint(db.database.conn):
+                return index
+        except (IOError, ValueError):
+            pass
+    return OverlapIndex.from_database(db, featuretypes)
@@ -0,0 +1,125 @@
+import os
+import sqlite3
+import multiprocessing
+import numpy as np
+import agouti_pkg.gffutils
+from agouti_pkg.database import Database
+
+
+SHARDS_PER_WORKER = 4  # more shards than workers -> better load balancing
+
+_worker = {}  # state of the worker process, set by _init_worker
+
+
+def open_read_only(database):
+    """Opens the database in the read-only mode
+
+    Arguments:
+        database {str} -- path to the database created with agouti create_db
+
+    Returns:
+        Database -- object of the Database class
+    """
+
+    from urllib.request import pathname2url
+    uri = "file:{}?mode=ro".format(pathname2url(os.path.abspath(database)))
+    conn = sqlite3.connect(uri, uri=True)
+    return Database(agouti_pkg.gffutils.FeatureDB(conn, keep_order=False),
+                    database)
+
+
+def shard_products(batch, num_shards):
+    """Partitions a batch of intervals into shards of similar size.\
+        Intervals from the same chromosome are kept together. Chromosomes\
+        with more intervals than the shard size are split into chunks of\
+        neighbouring intervals (sorted by start), while small chromosomes\
+        are packed together.
+
+    Arguments:
+        batch {IntervalBatch} -- input intervals
+        num_shards {int} -- desired number of shards
+
+    Returns:
+        list -- list of shards; each shard is a tuple of indexes of the\
+            intervals (positions in the batch) and an IntervalBatch with\
+            these intervals
+    """
+
+    size = max(1, -(-len(batch) // max(1, num_shards)))
+    shards, small = [], []
+    for code in range(len(batch.seqids)):
+        indices = np.flatnonzero(batch.seqid_codes == code)
+        if len(indices) > size:
+            indices = indices[np.argsort(batch.starts[indices],
+                                         kind="stable")]
+            for k in range(0, len(indices), size):
+                shards.append(indices[k:k + size].tolist())
+        elif len(indices):
+            small.extend(indices.tolist())
+            if len(small) >= size:
+                shards.append(small)
+                small = []
+    if small:
+        shards.append(small)
+    return [(indices, batch.take(indices)) for indices in shards]
+
+
+def _init_worker(annotate, database, kwargs):
+    """Initializer of the worker processes. Each worker opens its own\
+        read-only connection to the database.
+
+    Arguments:
+        annotate {function} -- function called for each shard
+        database {str} -- path to the database
+        kwargs {dict} -- additional keyword arguments of annotate
+    """
+
+    _worker["annotate"] = annotate
+    _worker["db"] = open_read_only(database)
+    _worker["kwargs"] = kwargs
+
+
+def _annotate_shard(shard):
+    """Annotates a single shard in the worker process
+
+    Arguments:
+        shard {tuple} -- indexes of the products and the products
+
+    Returns:
+        tuple -- indexes of the products and the list of results
+    """
+
+    indices, products = shard
+    results = _worker["annotate"](_worker["db"], products, **_worker["kwargs"])
+    return indices, list(results)
+
+
+def parallel_annotate(annotate, database, batches, threads, kwargs):
+    """Annotates batches of input intervals in a pool of worker processes.\
+        Each batch is partitioned with shard_products() and the\
+        results are merged back in the input order.
+
+    Arguments:
+        annotate {function} -- module-level function called as\
+            annotate(db, products, **kwargs); it must yield one result per\
+            product
+        database {str} -- path to the database
+        batches {iterable} -- IntervalBatch objects
+        threads {int} -- number of worker processes
+        kwargs {dict} -- additional keyword arguments of annotate
+
+    Yields:
+        tuple -- batch, list of results of annotate for each product of\
+            the batch (in the input order)
+    """
+
+    with multiprocessing.Pool(threads, initializer=_init_worker,
+                              initargs=(annotate, database, kwargs)) as pool:
+        for batch in batches:
+            results = [None] * len(batch)
+            shards = shard_products(batch, threads * SHARDS_PER_WORKER)
+            for indices, shard_results in pool.imap_unordered(_annotate_shard,
+                                                              shards):
+                for i, result in zip(indices, shard_results):
+                    results[i] = result
+            yield batch, results
@@ -3,7 +3,12 @@ from agouti_pkg.miscallaneous import *
 
 class ProcessingProduct(object):
     """Feature from the BED file. One line in BED corresponds\
-        to one ProcessingProduct"""
+        to one ProcessingProduct. Batches of the input intervals are stored\
+        column-wise (see interval_batch.py) and their rows are accessed as\
+        ProcessingProduct objects"""
+
+    __slots__ = ("coordinates", "processing_product", "score", "strand",
+                 "bed_line", "coords_outside_transcript")
 
     def __init__(self, coordinates, processing_product, score, strand,
                  bed_line, first_base_num, coords_outside_transcript="No"):
@@ -49,50 +54,8 @@ class ProcessingProduct(object):
                      transcript
         """
 
-        transcript_id = self.coordinates[0]
-
-        mRNA = database.database[transcript_id]
-
-        three_prime_UTRs = get_three_prime_UTRs(mRNA,
-                                                list(featuretypes_from_db),
-                                                database)
-
-        five_prime_UTRs = get_five_prime_UTRs(mRNA, list(featuretypes_from_db),
-                                              database)
-
-        exons = get_exons(mRNA, database)
-        cds = get_cds(mRNA, list(featuretypes_from_db), database)
-        five_prime_utr_len = sum_features_length(five_prime_UTRs)
-        three_prime_utr_len = sum_features_length(three_prime_UTRs)
-        transcript_length = sum_features_length(exons)
-        cds_len = transcript_length - five_prime_utr_len - three_prime_utr_len
-
-        if len(cds) == 0:
-            cds_start = None
-        else:
-            cds_start = min(cds, key=attrgetter('start')).start
-
-        if (sum([cds_len, three_prime_utr_len, five_prime_utr_len]) !=
-           transcript_length and len(cds)):
-
-            left_side_of_cds_len = 0
-            for exon in exons:
-                if (cds_start >= exon.end):
-                    left_side_of_cds_len += exon.end - exon.start
-                elif (cds_start < exon.end and cds_start > exon.start):
-                    left_side_of_cds_len += cds_start - exon.start
-
-            five_prime_utr_len = left_side_of_cds_len
-            three_prime_utr_len = (transcript_length - five_prime_utr_len
-                                   - cds_len)
-
-        lengths_tuple = (five_prime_utr_len, cds_len,
-                         three_prime_utr_len)
-
-        if lengths_tuple == (0, 0, 0):
-            lengths_tuple = (0, transcript_length, 0)
-
-        return lengths_tuple, cds_start
+        return database.transcript_model(self.coordinates[0],
+                                         featuretypes_from_db)
 
     def check_overlapping_feature__position(self, lengths_dict, feature,
                                             transcriptomic, offset=0):
@@ -1,163 +1,378 @@
 from agouti_pkg.miscallaneous import handle_negative_coordinates
 from agouti_pkg.processing_product import ProcessingProduct
-from agouti_pkg.eprint import eprint
-import sys
+from agouti_pkg.interval_batch import IntervalBatch
+from agouti_pkg.errors import InputFormatError
+from agouti_pkg.streams import open_input
+import io
+import os
+import mmap
 import codecs
+import locale
+from itertools import chain, islice
 from agouti_pkg.argument_parser import parse_arguments
 
 
+BATCH_SIZE = 100000  # intervals read and annotated at once
+# first or last bytes of a line for which bytes.strip() and str.strip() may
+# differ (non-ASCII characters and separators \x1c-\x1f)
+_AMBIGUOUS_BYTES = frozenset(range(0x1c, 0x20)) | frozenset(range(0x80, 0x100))
+
+
+def batches(records, batch_size, source=None, encoding="utf-8"):
+    """Groups records of the input readers into batches of at most\
+        batch_size intervals, so that only a single batch is kept in memory\
+        at a time
+
+    Arguments:
+        records {iterable} -- tuples of ProcessingProduct and span (see\
+            IntervalBatch.from_records)
+        batch_size {int} -- maximal number of intervals in a batch
+
+    Keyword Arguments:
+        source {mmap.mmap} -- memory-mapped input file (default: {None})
+        encoding {str} -- encoding of the input file (default: {"utf-8"})
+
+    Yields:
+        IntervalBatch -- consecutive intervals
+    """
+
+    records = iter(records)
+    while True:
+        batch = IntervalBatch.from_records(islice(records, batch_size),
+                                           source, encoding)
+        if not len(batch):
+            return
+        yield batch
+
+
+def _line_span(raw, offset):
+    """Returns location of the stripped line in the memory-mapped file
+
+    Arguments:
+        raw {bytes} -- line of the file
+        offset {int} -- offset of the line in the file
+
+    Returns:
+        tuple -- offset and length of the stripped line; None if the line\
+            must be copied, because str.strip() may strip it differently
+    """
+
+    stripped = raw.strip()
+    if stripped and (stripped[0] in _AMBIGUOUS_BYTES or
+                     stripped[-1] in _AMBIGUOUS_BYTES):
+        return None
+    return offset + len(raw) - len(raw.lstrip()), len(stripped)
+
+
+def _skip_header(lines, header_line_num, header):
+    """Yields data lines of the input file, i.e. lines following the header\
+        lines that are not comments. Header lines are collected on the way,\
+        so that the file is read only once.
+
+    Arguments:
+        lines {iterable} -- tuples of line and its location in the\
+            memory-mapped file (or None)
+        header_line_num {int} -- number of header lines from the top of the file
+        header {list} -- list to which the header lines are appended
+
+    Yields:
+        tuple -- data line, its location in the memory-mapped file
+    """
+
+    for index, (line, span) in enumerate(lines):
+        if header_line_num - index > 0:
+            header.append(line)
+            continue
+        if not line.startswith("#"):
+            yield line, span
+
+
+def _text_lines(f):
+    """Yields lines of a file which cannot be memory-mapped. The file is\
+        closed when all lines are read.
+
+    Arguments:
+        f {file} -- input file opened in text mode
+
+    Yields:
+        tuple -- line, None
+    """
+
+    with f:
+        for line in f:
+            yield line, None
+
+
+def _mapped_lines(source, encoding):
+    """Yields lines of the memory-mapped file. Lines end with "\\n" or\
+        "\\r\\n", which is read as "\\n" (as in the text mode).
+
+    Arguments:
+        source {mmap.mmap} -- memory-mapped input file
+        encoding {str} -- encoding of the file
+
+    Yields:
+        tuple -- line, location of the stripped line in the file (see\
+            _line_span)
+    """
+
+    position, size = 0, len(source)
+    while position < size:
+        end = source.find(b"\n", position)
+        end = size if end == -1 else end + 1
+        raw = source[position:end]
+        line = raw.decode(encoding)
+        if line.endswith("\r\n"):
+            line = line[:-2] + "\n"
+        yield line, _line_span(raw, position)
+        position = end
+
+
+def _open_input(input_file):
+    """Opens the input file (see streams.open_input). Uncompressed regular\
+        files are memory-mapped, so that the lines do not need to be kept\
+        in memory.
+
+    Arguments:
+        input_file {str} -- input file name or path, "-" for stdin
+
+    Returns:
+        tuple -- memory-mapped file (None if the file is not mapped),\
+            encoding, iterator over tuples of line and location of the\
+            stripped line in the memory-mapped file (or None)
+    """
+
+    encoding = locale.getpreferredencoding(False)
+    f, mappable = open_input(input_file)
+    if mappable and os.fstat(f.fileno()).st_size > 0:
+        with f:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return source, encoding, _mapped_lines(source, encoding)
+    return None, encoding, _text_lines(io.TextIOWrapper(f, encoding))
+
+
+def _peek(lines):
+    """Reads the first element of an iterator without losing it
+
+    Arguments:
+        lines {iterator} -- iterator
+
+    Returns:
+        tuple -- first element (None if there is none), iterator over all\
+            the elements
+    """
+
+    first = next(lines, None)
+    if first is None:
+        return None, lines
+    return first, chain([first], lines)
+
+
+def _parse_custom_lines(lines, custom_format, sep, first_base_num):
+    """Parses lines of the input file in CUSTOM format
+
+    Arguments:
+        lines {iterable} -- tuples of data line and its location in the\
+            memory-mapped file (or None)
+        custom_format {list} -- column numbers given with --custom
+        sep {str} -- column separator
+        first_base_num {int} -- 0 for 0-based coordinates or 1 for 1-based
+
+    Yields:
+        tuple -- ProcessingProduct and location of its line in the\
+            memory-mapped file; the line is copied into the\
+            ProcessingProduct if it is modified or not mapped
+    """
+
+    for line, span in lines:
+        try:
+            splitted_line = line.split(codecs.decode(sep, 'unicode_escape'))
+
+            line_updated = ""
+            if line.strip().endswith(sep):
+                line_updated = "{}.\n".format(line.strip())
+                span = None
+            else:
+                line_updated = line
+
+            start_coord, end_coord, coord_outside_transcript =\
+                handle_negative_coordinates(int(splitted_line[
+                                             custom_format[2] - 1]),
+                                            int(splitted_line[
+                                             custom_format[3] - 1]))
+
+            coordinates = (splitted_line[custom_format[1] - 1],
+                           start_coord, end_coord)
+
+            processing_product = splitted_line[custom_format[0] - 1]
+            score = 0
+
+            if len(custom_format) == 4:
+                strand = "."
+            else:
+                strand = splitted_line[custom_format[4] - 1]
+        except (IndexError, ValueError):
+            raise InputFormatError("incorrect format provided with --custom "
+                                   "flag or wrong separator used (line: "
+                                   "{})".format(line.strip()))
+
+        bed_line = None
+        if span is None or (sep != "\t" and sep in line_updated):
+            bed_line = line_updated.strip().replace(sep, "\t")
+            span = None
+
+        if coord_outside_transcript != "No":
+            yield ProcessingProduct(coordinates, processing_product,
+                                    score, strand, bed_line,
+                                    first_base_num,
+                                    coord_outside_transcript), span
+        else:
+            yield ProcessingProduct(coordinates, processing_product,
+                                    score, strand, bed_line,
+                                    first_base_num), span
+
+
 def read_custom_format(input_file, custom, sep, first_base_num,
-                       num_of_bed_fields, header_line_num):
-    """Reads and parse input file in CUSTOM format. Returns dictionary of\
-        id (key) and ProcessingProduct's (value)
+                       num_of_bed_fields, header_line_num,
+                       batch_size=BATCH_SIZE):
+    """Reads input file in CUSTOM format. Lines are parsed lazily, when the\
+        returned generator is consumed; every line is kept, including lines\
+        with repeated IDs
 
     Arguments:
-        input_file {str} -- input file name or path
+        input_file {str} -- input file name or path, "-" for stdin
         custom {str} -- custom file format description - as in --custom arg
         sep {str} -- column separator
         first_base_num {int} -- 0 for 0-based coordinates or 1 for 1-based
         num_of_bed_fields {int} -- number of columns in the input file
         header_line_num {int} -- number of header lines from the top of the file
 
+    Keyword Arguments:
+        batch_size {int} -- maximal number of intervals in a batch\
+            (default: {BATCH_SIZE})
+
     Returns:
-        tuple -- first element stands for dictionary based on input file.\
-                Key stands for product ID, value is an object of\
-                ProcessingProduct class. Second element is of int type and\
-                describes number of columns in the input file
+        tuple -- first element is a generator yielding IntervalBatch\
+                objects in the order of the input file. Second element is\
+                of int type and describes number of columns in the input\
+                file. Third element is the list of header lines
+
+    Raises:
+        InputFormatError -- the --custom format is incorrect; malformed\
+            lines are reported when the generator reaches them
     """
 
-    products = {}
     custom_format = custom.split(',')
     custom_format = list(filter(None, custom_format))
     try:
         custom_format = list(map(int, custom_format))
     except ValueError:
-        eprint("ERROR: incorrect format provided with --custom flag. Invalid literal for int() with base 10")
-        sys.exit()
-    if (len(custom_format) < 4): 
-        eprint("ERROR: incorrect format provided with --custom flag or wrong separator used")
-        sys.exit()
+        raise InputFormatError("incorrect format provided with --custom flag. "
+                               "Invalid literal for int() with base 10")
+    if (len(custom_format) < 4):
+        raise InputFormatError("incorrect format provided with --custom flag "
+                               "or wrong separator used")
 
-
-    try:
-        with open(input_file) as f:
-            for index, line in enumerate(f): ###
-                if header_line_num - index > 0:
-                    if header_line_num - index > 1:
-                        print(line.strip())
-                    continue
-                if not line.startswith("#"):
-                    splitted_line = line.split(codecs.decode(
+    # header lines are printed and the number of columns is read from the
+    # first data line before the annotation starts
+    source, encoding, lines = _open_input(input_file)
+    header = []
+    first_line, lines = _peek(_skip_header(lines, header_line_num, header))
+    if first_line is not None and num_of_bed_fields == -1:
+        num_of_bed_fields = len(first_line[0].split(codecs.decode(
                                                        sep,
-                                                       'unicode_escape'))
-
-                    if (num_of_bed_fields == -1):
-                        num_of_bed_fields = len(splitted_line)
-                    line_updated = ""
-                    if line.strip().endswith(sep):
-                        line_updated = "{}.\n".format(line.strip())
-                    else:
-                        line_updated = line
-                    
-
-                    start_coord, end_coord, coord_outside_transcript =\
-                        handle_negative_coordinates(int(splitted_line[
-                                                     custom_format[2] - 1]),
-                                                    int(splitted_line[
-                                                     custom_format[3] - 1]))
-
-                    coordinates = (splitted_line[custom_format[1] - 1],
-                                   start_coord, end_coord)
-
-                    processing_product = splitted_line[custom_format[0] - 1]
-                    score = 0
-
-                    if len(custom_format) == 4:
-                        strand = "."
-                    else:
-                        strand = splitted_line[custom_format[4] - 1]
-
-                    if coord_outside_transcript != "No":
-                        product = ProcessingProduct(coordinates,
-                                                    processing_product,
-                                                    score, strand,
-                                                    line_updated.strip().replace(sep,
-                                                                         "\t"),
-                                                    first_base_num,
-                                                    coord_outside_transcript)
-                    else:
-                        product = ProcessingProduct(coordinates,
-                                                    processing_product,
-                                                    score, strand,
-                                                    line_updated.strip().replace(sep,
-                                                                         "\t"),
-                                                    first_base_num)
-
-                    products[processing_product] = product
-        f.close()
-    except IndexError:
-        eprint("ERROR: incorrect format provided with --custom flag or wrong separator used")
-        sys.exit()
-
-    return products, num_of_bed_fields
-
-
-def read_BED_file(bed_file, num_of_bed_fields, first_base_num, header_line_num):
-    """Reads and parse input file in BED format. Returns dictionary of\
-        id (key) and ProcessingProduct's (value)
+                                                       'unicode_escape')))
+
+    records = _parse_custom_lines(lines, custom_format, sep, first_base_num)
+    return (batches(records, batch_size, source, encoding), num_of_bed_fields,
+            header)
+
+
+def _parse_BED_lines(lines, first_base_num):
+    """Parses lines of the input file in BED format
 
     Arguments:
-        bed_file {str} -- input file name or path
+        lines {iterable} -- tuples of data line and its location in the\
+            memory-mapped file (or None)
+        first_base_num {int} -- 0 for 0-based coordinates or 1 for 1-based
+
+    Yields:
+        tuple -- ProcessingProduct and location of its line in the\
+            memory-mapped file; the line is copied into the\
+            ProcessingProduct if it is not mapped
+    """
+
+    counter = 0
+    for line, span in lines:
+        tab = line.strip().split()
+        try:
+            start_coord, end_coord, coord_outside_transcript = (
+                handle_negative_coordinates(int(tab[1]), int(tab[2])))
+        except (IndexError, ValueError):
+            raise InputFormatError("the input file has the wrong format "
+                                   "(line: {})".format(line.strip()))
+        coordinates = (tab[0], start_coord, end_coord)
+        while (len(tab) < 6):
+            # in case of less than 6 columns in BED,
+            # fill the rest (up to 6) with blank fields
+            tab.append(".")
+        processing_product, score, strand = tab[3], tab[4], tab[5]
+        if processing_product == ".":
+            processing_product = f"unnamed_agouti_feature_{counter}"
+            counter += 1
+        bed_line = line.strip() if span is None else None
+        if coord_outside_transcript != "No":
+            yield ProcessingProduct(coordinates, processing_product,
+                                    score, strand, bed_line,
+                                    first_base_num,
+                                    coord_outside_transcript), span
+        else:
+            yield ProcessingProduct(coordinates, processing_product,
+                                    score, strand, bed_line, 0), span
+
+
+def read_BED_file(bed_file, num_of_bed_fields, first_base_num, header_line_num,
+                  batch_size=BATCH_SIZE):
+    """Reads input file in BED format. Lines are parsed lazily, when the\
+        returned generator is consumed; every line is kept, including lines\
+        with repeated names
+
+    Arguments:
+        bed_file {str} -- input file name or path, "-" for stdin
         num_of_bed_fields {int} -- number of columns in the input file
         first_base_num {int} -- 0 for 0-based coordinates or 1 for 1-based
         header_line_num {int} -- number of header lines from the top of the file
 
+    Keyword Arguments:
+        batch_size {int} -- maximal number of intervals in a batch\
+            (default: {BATCH_SIZE})
+
     Returns:
-        [tuple] -- list of ProcessingProducts objects, number of columns in\
-                   the input file
+        [tuple] -- generator yielding IntervalBatch objects in the order of\
+                   the input file, number of columns in the input file, list\
+                   of header lines
+
+    Raises:
+        InputFormatError -- raised by the generator when it reaches a\
+            malformed line
     """
-    products = {}
-    counter = 0
-    with open(bed_file) as f: 
-        for index, line in enumerate(f): ###
-            if header_line_num - index > 0:
-                continue
-            if not line.startswith("#"):
-                tab = line.strip().split()
-                num_of_bed_fields = len(list(filter(None, tab))) if (
-                    num_of_bed_fields == -1) else num_of_bed_fields
-                start_coord, end_coord, coord_outside_transcript = (
-                    handle_negative_coordinates(int(tab[1]), int(tab[2])))
-                coordinates = (tab[0], start_coord, end_coord)
-                while (len(tab) < 6):
-                    # in case of less than 6 columns in BED,
-                    # fill the rest (up to 6) with blank fields
-                    tab.append(".")
-                processing_product, score, strand = tab[3], tab[4], tab[5]
-                if processing_product == ".":
-                    processing_product = f"unnamed_agouti_feature_{counter}"
-                    counter += 1
-                if coord_outside_transcript != "No":
-                    product = ProcessingProduct(coordinates,
-                                                processing_product,
-                                                score, strand, line.strip(),
-                                                first_base_num,
-                                                coord_outside_transcript)
-                else:
-                    product = ProcessingProduct(coordinates,
-                                                processing_product,
-                                                score, strand, line.strip(),
-                                                0)
-                products[processing_product] = product
-    f.close()
-    return products, num_of_bed_fields
-
-
-def read_header_line(bed_file, custom, sep, header_line_num):
-    """Read and parse header line from the input file
+
+    source, encoding, lines = _open_input(bed_file)
+    header = []
+    first_line, lines = _peek(_skip_header(lines, header_line_num, header))
+    if first_line is not None and num_of_bed_fields == -1:
+        num_of_bed_fields = len(list(filter(None,
+                                            first_line[0].strip().split())))
+    records = _parse_BED_lines(lines, first_base_num)
+    return (batches(records, batch_size, source, encoding), num_of_bed_fields,
+            header)
+
+
+def parse_header_line(header_line, custom, sep, header_line_num):
+    """Parse header line of the input file (captured by the reader)
 
     Arguments:
-        bed_file {str} -- input file name or path
+        header_line {str} -- the last header line of the input file
         custom {str} -- custom file format description - as in --custom arg
         sep {str} -- separator
         header_line_num {int} -- number of header lines from the top of the file
@@ -165,15 +380,12 @@ def read_header_line(bed_file, custom, sep, header_line_num):
     Returns:
         [tuple] -- header line, list of header fields
     """
-    f = open(bed_file)
-    lines = f.readlines()
     header = False
     field_list = []
     potential_header = ""
     if header_line_num != 0:
-        potential_header = lines[header_line_num - 1]
+        potential_header = header_line or ""
         header = True
-    f.close()
     if custom != "BED" and header:
         custom_format = list(
             map(int, list(filter(None, custom.split(',')))))
@@ -0,0 +1,76 @@
+import os
+import io
+import sys
+import gzip
+import stat
+import locale
+from agouti_pkg.bgzf import BgzfWriter
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+BGZF_EXTENSIONS = (".gz", ".bgz")  # compressed with --compression auto
+
+
+def open_input(path):
+    """Opens the input file for reading in binary mode. "-" stands for\
+        stdin. Gzip-compressed input (including BGZF) is recognized by its\
+        first bytes and decompressed on the fly.
+
+    Arguments:
+        path {str} -- input file name or path, "-" for stdin, or a binary\
+            file object supporting peek() (e.g. io.BufferedReader)
+
+    Returns:
+        tuple -- binary stream, True if the stream is an uncompressed\
+            regular file (which can be memory-mapped)
+    """
+
+    if not isinstance(path, str):
+        if path.peek(2)[:2] == GZIP_MAGIC:
+            return gzip.GzipFile(fileobj=path, mode="rb"), False
+        return path, False
+    if path == "-":
+        if sys.stdin.buffer.peek(2)[:2] == GZIP_MAGIC:
+            return gzip.GzipFile(fileobj=sys.stdin.buffer, mode="rb"), False
+        return sys.stdin.buffer, False
+
+    handle = open(path, "rb")
+    if handle.peek(2)[:2] == GZIP_MAGIC:
+        handle.close()
+        return gzip.open(path, "rb"), False
+    return handle, stat.S_ISREG(os.fstat(handle.fileno()).st_mode)
+
+
+def open_output(path, compression="auto"):
+    """Opens the output file for writing in text mode
+
+    Arguments:
+        path {str} -- output file name or path, "-" for stdout
+
+    Keyword Arguments:
+        compression {str} -- "none", "gzip", "bgzf" or "auto" - BGZF for\
+            paths ending with .gz or .bgz, no compression otherwise\
+            (default: {"auto"})
+
+    Returns:
+        file -- text stream; unless it is sys.stdout, it should be closed\
+            by the caller
+    """
+
+    if compression == "auto":
+        compression = "bgzf" if path.endswith(BGZF_EXTENSIONS) else "none"
+    if compression == "none":
+        return sys.stdout if path == "-" else open(path, "w")
+
+    encoding = locale.getpreferredencoding(False)
+    if path == "-":
+        sys.stdout.flush()
+        if compression == "gzip":
+            stream = gzip.GzipFile(fileobj=sys.stdout.buffer, mode="wb")
+        else:
+            stream = BgzfWriter(sys.stdout.buffer, close_handle=False)
+    elif compression == "gzip":
+        stream = gzip.open(path, "wb")
+    else:
+        stream = BgzfWriter(open(path, "wb"))
+    return io.TextIOWrapper(stream, encoding=encoding)
@@ -0,0 +1,189 @@
+from itertools import groupby
+from agouti_pkg.gffutils import constants
+
+
+def is_sorted(products):
+    """Checks whether ProcessingProduct objects are sorted by (seqid, start),\
+        i.e. all intervals from the same chromosome form a single block and\
+        their start coordinates do not decrease within the block. The order\
+        of the chromosomes themselves does not matter.
+
+    Arguments:
+        products {list} -- list of ProcessingProduct objects
+
+    Returns:
+        bool -- True if products are sorted
+    """
+
+    seen = set()
+    last_seqid, last_start = None, None
+    for product in products:
+        seqid, start = product.coordinates[0], product.coordinates[1]
+        if seqid != last_seqid:
+            if seqid in seen:
+                return False
+            seen.add(seqid)
+            last_seqid, last_start = seqid, start
+        elif start < last_start:
+            return False
+        last_start = start
+    return True
+
+
+class _ActiveFeature(object):
+    """Feature row taken from the database during the sweep. Feature object\
+        is created only when the row overlaps at least one interval"""
+
+    __slots__ = ("start", "end", "strand", "row", "feature")
+
+    def __init__(self, row):
+        self.start = row["start"]
+        self.end = row["end"]
+        self.strand = row["strand"]
+        self.row = row
+        self.feature = None
+
+
+def _stream_features(db, seqid, min_start, max_end, featuretypes,
+                     level=None):
+    """Yields feature rows from a single chromosome in the start order. The\
+        rows are searched in the seqidstartend index between\
+        min_start - Database.max_feature_length() and max_end, so\
+        batches of sorted input do not scan the preceding part of the\
+        chromosome again.
+
+    Arguments:
+        db {Database} -- object of the Database class
+        seqid {str} -- chromosome
+        min_start {int} -- features ending at or before this position\
+            are not needed
+        max_end {int} -- features starting at or after this position\
+            are not needed
+        featuretypes {list} -- feature types to be reported
+
+    Keyword Arguments:
+        level {int} -- report only features at this level; ignored if the\
+            database has no feature_levels table (default: {None})
+
+    Returns:
+        sqlite3.Cursor -- rows ordered by start, end and file order
+    """
+
+    placeholders = ", ".join("?" for _ in featuretypes)
+    # features ending after min_start start after min_start - max length
+    params = [seqid, min_start - db.max_feature_length(seqid, featuretypes),
+              max_end, min_start] + list(featuretypes)
+    level_clause = ""
+    if level is not None and db.has_feature_levels:
+        level_clause = (" AND (SELECT level FROM feature_levels WHERE"
+                        " feature_levels.id = features.id) = ?")
+        params.append(level)
+    query = ("{} WHERE seqid = ? AND start >= ? AND start < ? AND end > ? AND"
+             " featuretype IN ({}){} ORDER BY start, end, file_order".format(
+                 constants._SELECT, placeholders, level_clause))
+    return db.database.conn.execute(query, params)
+
+
+def _sweep_chromosome(db, seqid, products, featuretypes, strand_specific,
+                      level=None):
+    """Merge-joins intervals from a single chromosome, sorted by start,\
+        against the features from the same chromosome
+
+    Arguments:
+        db {Database} -- object of the Database class
+        seqid {str} -- chromosome
+        products {list} -- ProcessingProduct objects sorted by start
+        featuretypes {list} -- feature types to be reported
+        strand_specific {bool} -- report only features on the same strand
+
+    Keyword Arguments:
+        level {int} -- report only features at this level (default: {None})
+
+    Yields:
+        list -- overlapping Feature objects for each product
+    """
+
+    # only features ending after the first start are read (see
+    # _stream_features)
+    min_start = products[0].coordinates[1]
+    max_end = max(p.coordinates[2] for p in products)
+    rows = iter(_stream_features(db, seqid, min_start, max_end, featuretypes,
+                                 level))
+    next_row = next(rows, None)
+    active = []
+    for product in products:
+        start, end = product.coordinates[1], product.coordinates[2]
+        while next_row is not None and next_row["start"] < end:
+            active.append(_ActiveFeature(next_row))
+            next_row = next(rows, None)
+        # starts of the subsequent intervals are not smaller, so features
+        # ending before the current start will never overlap again
+        active = [a for a in active if a.end > start]
+        overlapping_features = []
+        for a in active:
+            if a.start >= end or (strand_specific and
+                                  a.strand != product.strand):
+                continue
+            if a.feature is None:
+                a.feature = db.database._feature_returner(**a.row)
+            overlapping_features.append(a.feature)
+        yield overlapping_features
+
+
+def sweep_overlaps(db, products, featuretypes, strand_specific=False,
+                   level=None):
+    """Finds features overlapping each ProcessingProduct with a sorted sweep.\
+        Intervals are sorted by (seqid, start), unless they are sorted\
+        already, and merge-joined against features streamed once per\
+        chromosome in the start order. Overlaps are the same as returned by\
+        FeatureDB.region() with completely_within=False, ordered by start,\
+        end and file order of the features.
+
+    Arguments:
+        db {Database} -- object of the Database class
+        products {list} -- list of ProcessingProduct objects
+        featuretypes {list} -- feature types to be reported
+
+    Keyword Arguments:
+        strand_specific {bool} -- report only features on the same strand\
+            (default: {False})
+        level {int} -- report only features at this level, if the database\
+            stores feature levels (default: {None})
+
+    Yields:
+        tuple -- ProcessingProduct, list of overlapping features; in the\
+            order of products
+    """
+
+    products = list(products)
+    featuretypes = list(featuretypes)
+    if not products or not featuretypes:
+        for product in products:
+            yield product, []
+        return
+
+    def seqid_of(index):
+        return products[index].coordinates[0]
+
+    if is_sorted(products):
+        # results can be passed on as soon as they are computed
+        for seqid, indices in groupby(range(len(products)), key=seqid_of):
+            chromosome = [products[i] for i in indices]
+            for product, features in zip(chromosome, _sweep_chromosome(
+                    db, seqid, chromosome, featuretypes, strand_specific,
+                level)):
+                yield product, features
+        return
+
+    order = sorted(range(len(products)),
+                   key=lambda i: (seqid_of(i), products[i].coordinates[1]))
+    results = [None] * len(products)
+    for seqid, indices in groupby(order, key=seqid_of):
+        indices = list(indices)
+        chromosome = [products[i] for i in indices]
+        for i, features in zip(indices, _sweep_chromosome(
+                db, seqid, chromosome, featuretypes, strand_specific,
+                level)):
+            results[i] = features
+    for product, features in zip(products, results):
+        yield product, features
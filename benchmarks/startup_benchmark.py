@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""Measures the startup time of agouti.
+
+Each command is run several times in a fresh interpreter and the minimum and
+median wall-clock times are reported. Optionally, the modules which take the
+longest to import are listed (python -X importtime).
+
+Example use:
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py -r 20 --importtime
+    python benchmarks/startup_benchmark.py -d my.db -i small.bed
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AGOUTI = os.path.join(REPO, "agouti_pkg", "agouti")
+
+
+def environment():
+    """Returns environment variables for the child processes, with the\
+        repository on the PYTHONPATH
+
+    Returns:
+        dict -- environment variables
+    """
+
+    env = dict(os.environ)
+    paths = [REPO] + [p for p in env.get("PYTHONPATH", "").split(os.pathsep)
+                      if p]
+    env["PYTHONPATH"] = os.pathsep.join(paths)
+    return env
+
+
+def time_command(args, repeats):
+    """Runs agouti with the given arguments and measures the wall-clock time
+
+    Arguments:
+        args {list} -- command-line arguments of agouti
+        repeats {int} -- number of runs
+
+    Returns:
+        list -- times of the runs in seconds
+    """
+
+    env = environment()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, AGOUTI] + args, env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       check=False)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def import_times(module, top):
+    """Returns the modules which take the longest to import, including their\
+        own imports
+
+    Arguments:
+        module {str} -- module to be imported
+        top {int} -- number of modules to be reported
+
+    Returns:
+        list -- tuples of cumulative import time (in microseconds) and name
+    """
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             "import {}".format(module)], env=environment(),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    times = []
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        times.append((int(fields[1]), fields[2].rstrip()))
+    return sorted(times, reverse=True)[:top]
+
+
+def parse_arguments():
+    """Parse command-line arguments of the benchmark
+
+    Returns:
+        argparse.Namespace -- parsed arguments
+    """
+
+    parser = argparse.ArgumentParser(
+        description="startup time benchmark of agouti",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-r", "--repeats", type=int, default=10,
+                        help="number of runs of each command")
+    parser.add_argument("-d", "--database", type=str,
+                        help="database used to time a small annotate run")
+    parser.add_argument("-i", "--input", type=str,
+                        help="small BED file used to time an annotate run")
+    parser.add_argument("--importtime", action="store_true",
+                        help="list modules which take the longest to import")
+    parser.add_argument("--top", type=int, default=15,
+                        help="number of modules listed with --importtime")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    commands = [["-h"], ["annotate", "-h"], ["create_db", "-h"]]
+    if args.database and args.input:
+        commands.append(["annotate", "-d", args.database, "-i", args.input])
+
+    print("{:<50}{:>10}{:>10}".format("command", "min [s]", "median [s]"))
+    for command in commands:
+        times = time_command(command, args.repeats)
+        print("{:<50}{:>10.3f}{:>10.3f}".format(
+            " ".join(["agouti"] + command), min(times),
+            statistics.median(times)))
+
+    if args.importtime:
+        for module in ("agouti_pkg.agouti_annotate",
+                       "agouti_pkg.agouti_create_database"):
+            print("\nslowest imports of {} (cumulative, ms):".format(module))
+            for us, name in import_times(module, args.top):
+                print("{:>10.1f}  {}".format(us / 1000, name))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -28,8 +28,8 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     package_data={'': ["sample_data.tar.gz"]},
-    setup_requires=["numpy", "pandas"],
-    install_requires=["numpy", "pandas"],
+    setup_requires=["numpy"],
+    install_requires=["numpy"],
     scripts=['agouti_pkg/agouti'],
 
 )